@@ -0,0 +1,82 @@
+# benchmarks/archive.py
+"""
+Measures what archiving the checkout history saves on every checkout and checkin.
+
+A library with `--checkouts` checkouts over two years is generated with benchmarks.dataset and
+stored with `Storage`, which rewrites the checkout file on every change. Checkout and checkin cycles
+are timed, with the bytes they write counted by the instrumentation, once with the whole history in
+the checkout file and once after `CheckoutManager.archive` has moved all but the last month to
+monthly segments.
+
+Usage: python -m benchmarks.archive [--checkouts 100000] [--cycles 50]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+
+import instrumentation
+from benchmarks import dataset
+from book import BookManager
+from check import CheckoutManager
+from storage import Storage
+from user import UserManager
+
+def time_cycles(checkout_manager, book_manager, user_manager, cycles, seed):
+
+    """
+    Checks books out and in again and returns the median seconds and the mean bytes written per operation.
+    """
+
+    rng = random.Random(seed)
+    users = user_manager.list_users()
+    books = rng.sample([book for book in book_manager.list_books() if book.available], cycles)
+    instrumentation.reset()
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for book in books:
+            user = rng.choice(users)
+            for operation in (checkout_manager.checkout_book, checkout_manager.checkin_book):
+                start = time.perf_counter()
+                operation(user, book)
+                samples.append(time.perf_counter() - start)
+    written = sum(operation['bytes_written'] for name, operation in instrumentation.snapshot().items()
+                  if name.endswith('.commit'))
+    return {'median_ms': round(statistics.median(samples) * 1000, 3), 'bytes_per_operation': written // len(samples)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkouts', type=int, default=100000)
+    parser.add_argument('--cycles', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    end = datetime.datetime(2024, 1, 1)
+    books, users, checkouts = dataset.generate(max(options.checkouts // 10, options.cycles * 2), checkouts=options.checkouts,
+                                               seed=options.seed, end=end)
+    results = {'benchmark': 'archive', 'checkouts': len(checkouts)}
+    instrumentation.enable()
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = dataset.write(data_dir, books, users, checkouts)
+        del books, users, checkouts
+        book_manager = BookManager(storage)
+        user_manager = UserManager(storage)
+        checkout_manager = CheckoutManager(storage, book_manager, user_manager)
+        results['full_history'] = time_cycles(checkout_manager, book_manager, user_manager, options.cycles, options.seed)
+        start = time.perf_counter()
+        results['archived'] = checkout_manager.archive(end - datetime.timedelta(days=31))
+        results['archive_seconds'] = round(time.perf_counter() - start, 3)
+        results['kept'] = len(checkout_manager.checkouts)
+        results['segments'] = len(storage.archived_months())
+        results['after_archive'] = time_cycles(checkout_manager, book_manager, user_manager, options.cycles, options.seed + 1)
+    instrumentation.disable()
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
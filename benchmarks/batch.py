@@ -0,0 +1,82 @@
+# benchmarks/batch.py
+"""
+Compares `main.py batch` with driving the interactive menus through piped input.
+
+A library with `--books` books and `--checkouts` past checkouts is generated with benchmarks.dataset.
+The same circulation run (checking `--commands // 2` available books out and in again) is then timed
+three ways, each in a fresh copy of the library:
+
+* piped: one `python main.py` session whose menus are fed from stdin, the way scripts drive it today.
+  Only the first `--piped` commands are run, since every one of them rewrites the data files.
+* batch: `python main.py batch`, which commits once at the end.
+* checkpointed: `python main.py batch --checkpoint N`.
+
+Usage: python -m benchmarks.batch [--books 100000] [--checkouts 100000] [--commands 10000] [--piped 200] [--checkpoint 1000]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def circulation(books, users, commands, seed):
+
+    """
+    Returns `(command, user_id, isbn)` for `commands` checkouts and checkins of available books.
+    """
+
+    rng = random.Random(seed)
+    pairs = [(rng.choice(users).user_id, book.isbn)
+             for book in rng.sample([book for book in books if book.available], commands // 2)]
+    return [('checkout', *pair) for pair in pairs] + [('checkin', *pair) for pair in pairs]
+
+def run(data_dir, arguments, stdin):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), *arguments], cwd=data_dir, input=stdin,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONPATH=ROOT))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--checkouts', type=int, default=100000)
+    parser.add_argument('--commands', type=int, default=10000)
+    parser.add_argument('--piped', type=int, default=200, help='Commands run through the menus')
+    parser.add_argument('--checkpoint', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    books, users, checkouts = dataset.generate(options.books, checkouts=options.checkouts, seed=options.seed)
+    commands = circulation(books, users, options.commands, options.seed)
+    piped = commands[:options.piped // 2] + commands[len(commands) // 2:][:options.piped // 2]
+    menu = {'checkout': '1', 'checkin': '2'}
+    menu_input = '3\n' + ''.join(f"{menu[command]}\n{user_id}\n{isbn}\n" for command, user_id, isbn in piped) + '4\n6\n'
+    script = ''.join(f"{command} {user_id} {isbn}\n" for command, user_id, isbn in commands)
+    results = {'benchmark': 'batch', 'books': options.books, 'checkouts': options.checkouts, 'commands': len(commands)}
+
+    with tempfile.TemporaryDirectory() as root:
+        original = os.path.join(root, 'original')
+        dataset.write(original, books, users, checkouts)
+        del books, users, checkouts
+        for name, arguments, stdin, count in (
+                ('piped', [], menu_input, len(piped)),
+                ('batch', ['batch'], script, len(commands)),
+                ('checkpointed', ['batch', '--checkpoint', str(options.checkpoint)], script, len(commands))):
+            data_dir = os.path.join(root, name)
+            shutil.copytree(original, data_dir)
+            seconds = run(data_dir, arguments, stdin.encode())
+            results[name] = {'commands': count, 'seconds': round(seconds, 3),
+                             'commands_per_second': round(count / seconds, 1)}
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/catalog.py
+"""
+Compares the in-memory BookManager with the out-of-core DiskBookManager on a SQLite catalog.
+
+`--books` books are generated with benchmarks.dataset into a temporary SQLite database. Each
+manager then runs in a fresh process, which builds it and looks up `--lookups` ISBNs: skewed
+towards popular books (so the working set fits in the cache) and, for a tenth of them, ISBNs that do
+not exist. The output has the time to build the manager, the mean lookup time, the cache hit rate,
+how many unknown ISBNs the Bloom filter answered without a query, and the peak resident memory.
+
+Usage: python -m benchmarks.catalog [--books 1000000] [--cache 10000] [--lookups 100000]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import dataset
+from sqlite_storage import SQLiteStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, with the database, manager, cache size, lookups and book count as arguments.
+CHILD = """
+import bisect, json, random, resource, sys, time
+from benchmarks.dataset import zipf_weights
+from book import BookManager
+from catalog import DiskBookManager
+from sqlite_storage import SQLiteStorage
+db_file, manager, cache_size, lookups, books = sys.argv[1], sys.argv[2], *map(int, sys.argv[3:])
+storage = SQLiteStorage(db_file)
+start = time.perf_counter()
+book_manager = DiskBookManager(storage, cache_size=cache_size) if manager == 'disk' else BookManager(storage)
+result = {'build_seconds': round(time.perf_counter() - start, 6)}
+rng = random.Random(0)
+weights = zipf_weights(books, 1.1)
+isbns = [f"978{bisect.bisect(weights, rng.random() * weights[-1]):010d}" if rng.random() > 0.1 else f"979{index:010d}"
+         for index in range(lookups)]
+unknown = sum(isbn.startswith('979') for isbn in isbns)
+unknown_queries = 0
+get_book = storage.get_book
+def counting_get_book(isbn):
+    global unknown_queries
+    unknown_queries += isbn.startswith('979')
+    return get_book(isbn)
+storage.get_book = counting_get_book
+start = time.perf_counter()
+for isbn in isbns:
+    book_manager.get_book_by_isbn(isbn)
+result['lookup_us'] = round((time.perf_counter() - start) / lookups * 1e6, 3)
+if manager == 'disk':
+    cache = book_manager.cache
+    result['cache_hit_rate'] = round(cache.hits / max(cache.hits + cache.misses, 1), 4)
+    result['unknown_isbns_skipped'] = round(1 - unknown_queries / max(unknown, 1), 4)
+result['peak_rss_mib'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+print(json.dumps(result))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--cache', type=int, default=10000, help='Books kept in memory by DiskBookManager')
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    books, _, _ = dataset.generate(options.books, users=1, checkouts=0, seed=options.seed)
+    results = {'benchmark': 'catalog', 'books': options.books, 'cache': options.cache}
+    with tempfile.TemporaryDirectory() as data_dir:
+        db_file = os.path.join(data_dir, 'library.db')
+        storage = SQLiteStorage(db_file)
+        storage.save_books(books)
+        storage.close()
+        del books
+        for manager in ('memory', 'disk'):
+            result = subprocess.run([sys.executable, '-c', CHILD, db_file, manager, str(options.cache),
+                                     str(options.lookups), str(options.books)],
+                                    cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+            results[manager] = json.loads(result.stdout)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
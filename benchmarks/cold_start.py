@@ -0,0 +1,75 @@
+# benchmarks/cold_start.py
+"""
+Compares loading the checkout history from JSON with mapping a binary snapshot.
+
+A library with `--checkouts` checkouts is generated with benchmarks.dataset and written both as
+JSON and as `.snap` files. For each format this times, in a fresh process so nothing is cached:
+
+* load: building `CheckoutManager(columnar=True)`, i.e. reading the checkouts file.
+* first query: the first `get_user_history` call, which builds the manager's indexes.
+* query: a second `get_user_history` call for another user.
+
+Books and users are loaded before the clock starts, since only the checkout history is compared.
+
+Usage: python -m benchmarks.cold_start [--checkouts 1000000] [--books N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process, with the data directory and extension as arguments.
+CHILD = """
+import json, os, sys, time
+from book import BookManager
+from check import CheckoutManager
+from storage import Storage
+from user import UserManager
+data_dir, extension = sys.argv[1:]
+storage = Storage(*(os.path.join(data_dir, f"{name}.{extension}") for name in ('books', 'users', 'checkouts')))
+book_manager = BookManager(storage)
+user_manager = UserManager(storage)
+users = user_manager.list_users()
+times = {}
+start = time.perf_counter()
+checkout_manager = CheckoutManager(storage, book_manager, user_manager, columnar=True)
+times['load'] = time.perf_counter() - start
+start = time.perf_counter()
+checkout_manager.get_user_history(users[0])
+times['first_query'] = time.perf_counter() - start
+start = time.perf_counter()
+checkout_manager.get_user_history(users[-1])
+times['query'] = time.perf_counter() - start
+print(json.dumps(times))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkouts', type=int, default=1000000)
+    parser.add_argument('--books', type=int, help='Defaults to a tenth of --checkouts')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    books = options.books or max(options.checkouts // 10, 1)
+    library = dataset.generate(books, checkouts=options.checkouts, seed=options.seed)
+    results = {'benchmark': 'cold_start', 'checkouts': len(library[2]), 'seconds': {}, 'bytes': {}}
+    with tempfile.TemporaryDirectory() as data_dir:
+        for extension in ('json', 'snap'):
+            dataset.write(data_dir, *library, extension=extension)
+        del library
+        for extension in ('json', 'snap'):
+            result = subprocess.run([sys.executable, '-c', CHILD, data_dir, extension], cwd=ROOT,
+                                    env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+            results['seconds'][extension] = {name: round(value, 6) for name, value in json.loads(result.stdout).items()}
+            results['bytes'][extension] = os.path.getsize(os.path.join(data_dir, f"checkouts.{extension}"))
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# benchmarks/concurrency.py
+"""
+Stress test for the thread-safe managers.
+
+`--threads` threads repeatedly pick a random user and book and try to check the book out and in
+again, while reader threads keep searching and listing. A shared ledger records who holds each book
+after every successful checkout; a second holder for the same book means it was double-issued.
+At the end the in-memory state and the data written to disk are checked as well: every book has at
+most one open checkout, and a book is available exactly when it has none.
+
+Runs on a temporary directory, so no real data is touched. Exits with status 1 on any violation.
+
+Usage: python -m benchmarks.concurrency [--threads N] [--operations N] [--books N] [--users N]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from book import BookManager
+from check import CheckoutManager
+from models import Book, User
+from storage import JournaledStorage
+from user import UserManager
+
+def open_managers(data_dir):
+    storage = JournaledStorage(*(os.path.join(data_dir, name) for name in ('books.json', 'users.json', 'checkouts.json')))
+    storage.fsync = False
+    book_manager = BookManager(storage)
+    user_manager = UserManager(storage)
+    return storage, book_manager, user_manager, CheckoutManager(storage, book_manager, user_manager)
+
+def violations(book_manager, checkout_manager):
+
+    """
+    Returns a description of every book with more than one open checkout, or whose availability
+    does not match its open checkouts.
+    """
+
+    problems = []
+    for book in book_manager.list_books():
+        open_checkouts = [checkout for checkout in checkout_manager.get_book_history(book) if checkout.checkin_date is None]
+        if len(open_checkouts) > 1:
+            problems.append(f"{book.isbn} has {len(open_checkouts)} open checkouts")
+        if book.available == bool(open_checkouts):
+            problems.append(f"{book.isbn} is {'available' if book.available else 'unavailable'} "
+                            f"with {len(open_checkouts)} open checkouts")
+    return problems
+
+def worker(checkout_manager, books, users, operations, ledger, ledger_lock, counts, errors):
+    for _ in range(operations):
+        user = random.choice(users)
+        book = random.choice(books)
+        try:
+            checkout_manager.checkout_book(user, book)
+        except ValueError:
+            with ledger_lock:
+                counts['rejected'] += 1
+            continue
+        with ledger_lock:
+            if book.isbn in ledger:
+                errors.append(f"{book.isbn} issued to {user.user_id} while held by {ledger[book.isbn]}")
+            ledger[book.isbn] = user.user_id
+            counts['checkouts'] += 1
+        time.sleep(0)
+        # The ledger entry goes first: once the book is checked in another thread may take it.
+        with ledger_lock:
+            ledger.pop(book.isbn, None)
+        try:
+            checkout_manager.checkin_book(user, book)
+        except ValueError as error:
+            with ledger_lock:
+                errors.append(f"{book.isbn} could not be checked in by {user.user_id}: {error}")
+
+def reader(book_manager, checkout_manager, users, stop, reads):
+    while not stop.is_set():
+        book_manager.search_books(title=random.choice('aeiou'))
+        book_manager.list_books()
+        checkout_manager.get_current_checkouts(random.choice(users))
+        reads.append(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--operations', type=int, default=200, help='Checkout attempts per thread')
+    parser.add_argument('--books', type=int, default=20, help='Few books make contention likely')
+    parser.add_argument('--users', type=int, default=50)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage, book_manager, user_manager, checkout_manager = open_managers(data_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            book_manager.add_books(Book(f"Title {index}", f"Author {index % 7}", f"isbn-{index}", True)
+                                   for index in range(options.books))
+            user_manager.add_users(User(f"User {index}", f"user-{index}") for index in range(options.users))
+        books = book_manager.list_books()
+        users = user_manager.list_users()
+
+        ledger = {}
+        ledger_lock = threading.Lock()
+        errors = []
+        counts = {'checkouts': 0, 'rejected': 0}
+        reads = []
+        stop = threading.Event()
+        readers = [threading.Thread(target=reader, args=(book_manager, checkout_manager, users, stop, reads))
+                   for _ in range(options.readers)]
+        workers = [threading.Thread(target=worker, args=(checkout_manager, books, users, options.operations,
+                                                         ledger, ledger_lock, counts, errors))
+                   for _ in range(options.threads)]
+        start = time.perf_counter()
+        for thread in readers + workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+        errors += violations(book_manager, checkout_manager)
+        storage.close()
+        # What was written to disk must tell the same story.
+        storage, book_manager, user_manager, checkout_manager = open_managers(data_dir)
+        errors += [f"on disk: {problem}" for problem in violations(book_manager, checkout_manager)]
+        stored_checkouts = len(checkout_manager.list_checkouts())
+        storage.close()
+
+    results = {
+        'benchmark': 'concurrency',
+        'threads': options.threads,
+        'seconds': round(elapsed, 6),
+        'checkouts': counts['checkouts'],
+        'rejected': counts['rejected'],
+        'reads': len(reads),
+        'stored_checkouts': stored_checkouts,
+        'violations': errors,
+    }
+    print(json.dumps(results, indent=4))
+    if errors or stored_checkouts != counts['checkouts']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# benchmarks/dataset.py
+"""
+Generates a synthetic library: books.json, users.json and checkouts.json (or .jsonl or .snap).
+
+Titles are made of words from a fixed pseudo-word vocabulary, so title searches hit realistic
+numbers of books. Borrowing is skewed: books and users are drawn from Zipf-like distributions, so a
+few popular books and heavy readers account for most checkouts. Checkouts are generated in date
+order over the last two years and never overlap for the same book; loans that would end in the
+future are still open, and their books are unavailable.
+
+The output is deterministic for a given `--seed`.
+
+Usage: python -m benchmarks.dataset --out DIR [--books N] [--users N] [--checkouts N] [--format json|jsonl|snap]
+"""
+
+import argparse
+import bisect
+import datetime
+import itertools
+import os
+import random
+
+from models import Book, User, Checkout
+from storage import Storage
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'to', 'shi', 'en', 'dor', 'van', 'el', 'us', 'ter', 'mar', 'no', 'bi',
+             'gal', 'fen', 'or', 'ith', 'qua', 'zen', 'lu', 'pe', 'sa', 'win', 'thor', 'ca', 'di', 'ro', 'ny']
+FIRST_NAMES = ['Ada', 'Alan', 'Grace', 'Linus', 'Ken', 'Barbara', 'Edsger', 'Margaret', 'Donald', 'Frances',
+               'John', 'Radia', 'Tim', 'Guido', 'Hedy', 'Niklaus', 'Sophie', 'Dennis', 'Katherine', 'Leslie']
+LAST_NAMES = ['Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Thompson', 'Liskov', 'Dijkstra', 'Hamilton',
+              'Knuth', 'Allen', 'McCarthy', 'Perlman', 'Lee', 'Rossum', 'Lamarr', 'Wirth', 'Wilson',
+              'Ritchie', 'Johnson', 'Lamport']
+
+def zipf_weights(count, exponent):
+
+    """
+    Returns cumulative weights for `random.choices` where the item at rank r has weight 1 / r**exponent.
+    """
+
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+def make_vocabulary(rng, size=2000):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def generate(books=10000, users=None, checkouts=None, seed=0, skew=1.1, end=None):
+
+    """
+    Generates a synthetic library.
+
+    Args:
+        books (int, optional): The number of books. Defaults to 10000.
+        users (int, optional): The number of users. Defaults to a tenth of `books`.
+        checkouts (int, optional): The number of checkouts. Defaults to `books`.
+        seed (int, optional): The random seed. Defaults to 0.
+        skew (float, optional): The Zipf exponent of book popularity; users use 0.8 times it. Defaults to 1.1.
+        end (datetime.datetime, optional): The date of the latest checkout. Defaults to 2024-01-01.
+
+    Returns:
+        tuple: The lists of `Book`, `User` and `Checkout` objects.
+    """
+
+    rng = random.Random(seed)
+    users = users if users is not None else max(books // 10, 1)
+    checkouts = checkouts if checkouts is not None else books
+    end = end or datetime.datetime(2024, 1, 1)
+    start = end - datetime.timedelta(days=730)
+
+    vocabulary = make_vocabulary(rng)
+    book_list = [Book(' '.join(rng.choice(vocabulary).capitalize() for _ in range(rng.randint(1, 4))),
+                      f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"978{index:010d}", True)
+                 for index in range(books)]
+    user_list = [User(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"U{index:07d}")
+                 for index in range(users)]
+
+    # Popularity ranks are shuffled so that popular books are spread over the catalog.
+    popular_books = rng.sample(book_list, len(book_list))
+    heavy_users = rng.sample(user_list, len(user_list))
+    book_weights = zipf_weights(len(popular_books), skew)
+    user_weights = zipf_weights(len(heavy_users), skew * 0.8)
+
+    checkout_list = []
+    returned_at = {}
+    step = (end - start) / max(checkouts, 1)
+    for index in range(checkouts):
+        now = start + step * index
+        # A popular book that is still out is swapped for a less popular one that is on the shelf.
+        for _ in range(8):
+            book = popular_books[bisect.bisect(book_weights, rng.random() * book_weights[-1])]
+            if returned_at.get(book.isbn, start) <= now:
+                break
+        else:
+            book = rng.choice(book_list)
+            if returned_at.get(book.isbn, start) > now:
+                continue
+        user = heavy_users[bisect.bisect(user_weights, rng.random() * user_weights[-1])]
+        checkout = Checkout(user, book)
+        checkout.checkout_date = now
+        checkin_date = now + datetime.timedelta(days=rng.uniform(1, 28))
+        if checkin_date > end:
+            returned_at[book.isbn] = datetime.datetime.max
+            book.available = False
+        else:
+            checkout.checkin_date = checkin_date
+            returned_at[book.isbn] = checkin_date
+        checkout_list.append(checkout)
+    return book_list, user_list, checkout_list
+
+def write(data_dir, books, users, checkouts, extension='json'):
+
+    """
+    Writes a library to books, users and checkouts files in `data_dir` and returns the storage.
+    """
+
+    os.makedirs(data_dir, exist_ok=True)
+    storage = Storage(*(os.path.join(data_dir, f"{name}.{extension}") for name in ('books', 'users', 'checkouts')))
+    storage.fsync = False
+    storage.save_books(books)
+    storage.save_users(users)
+    storage.save_checkouts(checkouts)
+    return storage
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='The directory to write the files to')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--users', type=int, help='Defaults to a tenth of --books')
+    parser.add_argument('--checkouts', type=int, help='Defaults to --books')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of book popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['json', 'jsonl', 'snap'], default='json')
+    options = parser.parse_args()
+
+    books, users, checkouts = generate(options.books, options.users, options.checkouts, options.seed, options.skew)
+    write(options.out, books, users, checkouts, options.format)
+    print(f"Wrote {len(books)} books, {len(users)} users and {len(checkouts)} checkouts to {options.out}.")
+
+if __name__ == '__main__':
+    main()
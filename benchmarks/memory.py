@@ -0,0 +1,93 @@
+# benchmarks/memory.py
+"""
+Measures the memory used per Book, User and Checkout record.
+
+"before" uses plain classes with a per-instance __dict__ and a Checkout that holds its own copies
+of the user and the book, which is how the records were laid out before the models used __slots__.
+"after" uses the current models, and for checkouts also the columnar CheckoutTable.
+
+Usage: python -m benchmarks.memory [--records N]
+"""
+
+import argparse
+import datetime
+import gc
+import tracemalloc
+
+from checkout_table import CheckoutTable
+from models import Book, User, Checkout
+
+class DictBook:
+    def __init__(self, title, author, isbn, available):
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.available = available
+
+class DictUser:
+    def __init__(self, name, user_id):
+        self.name = name
+        self.user_id = user_id
+
+class DictCheckout:
+    def __init__(self, user, book):
+        self.user = user
+        self.book = book
+        self.checkout_date = datetime.datetime.now()
+        self.checkin_date = None
+
+def measure(build):
+
+    """
+    Returns the number of bytes allocated and still alive after calling `build`.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000)
+    n = parser.parse_args().records
+    users = n // 20 or 1
+    books = n // 5 or 1
+    authors = books // 10 or 1
+
+    # Titles, names and authors are built per record, as they are when parsed from JSON.
+    def book_fields(i):
+        return f"title {i}", f"author {i % authors}", str(i), True
+
+    def dict_checkouts():
+        return [DictCheckout(DictUser(f"user {i % users}", str(i % users)), DictBook(*book_fields(i % books)))
+                for i in range(n)]
+
+    def shared_checkouts(factory):
+        user_list = [User(f"user {i}", str(i)) for i in range(users)]
+        book_list = [Book(*book_fields(i)) for i in range(books)]
+        result = []
+        def build():
+            result.append(factory(Checkout(user_list[i % users], book_list[i % books]) for i in range(n)))
+        return measure(build)
+
+    rows = [
+        ('Book', measure(lambda: [DictBook(*book_fields(i)) for i in range(n)]),
+                 measure(lambda: [Book(*book_fields(i)) for i in range(n)])),
+        ('User', measure(lambda: [DictUser(f"user {i}", str(i)) for i in range(n)]),
+                 measure(lambda: [User(f"user {i}", str(i)) for i in range(n)])),
+        ('Checkout (list)', measure(dict_checkouts), shared_checkouts(list)),
+        ('Checkout (CheckoutTable)', measure(dict_checkouts), shared_checkouts(CheckoutTable)),
+    ]
+
+    print(f"{n} records, bytes per record")
+    print(f"{'record':<26}{'before':>10}{'after':>10}")
+    for name, before, after in rows:
+        print(f"{name:<26}{before / n:>10.1f}{after / n:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/reports.py
+"""
+Times the circulation reports on a large checkout history.
+
+A library with `--base` checkouts is generated with benchmarks.dataset and its checkout columns are
+repeated until they hold `--checkouts` rows, which keeps generation fast while the reports see a
+realistically skewed history of the requested size. Every report is timed once, as is building the
+report (copying the columns). The output says whether NumPy was used; without it the reports run in
+pure Python.
+
+Usage: python -m benchmarks.reports [--checkouts 10000000] [--base 200000]
+"""
+
+import argparse
+import datetime
+import json
+import time
+
+import reports
+from benchmarks import dataset
+from checkout_table import CheckoutTable
+from reports import CirculationReport
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checkouts', type=int, default=10000000)
+    parser.add_argument('--base', type=int, default=200000, help='Checkouts generated before repeating them')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    end = datetime.datetime(2024, 1, 1)
+    _, _, checkouts = dataset.generate(max(options.base // 10, 1), checkouts=options.base, seed=options.seed, end=end)
+    table = CheckoutTable(checkouts)
+    del checkouts
+    repeat = -(-options.checkouts // len(table))
+    columns = [column * repeat for column in table.columns()]
+    for column in columns:
+        del column[options.checkouts:]
+
+    results = {'benchmark': 'reports', 'checkouts': len(columns[0]), 'numpy': reports.numpy is not None}
+    start = time.perf_counter()
+    report = CirculationReport(*(column[:] for column in columns), table.user, table.book, now=end)
+    results['build_seconds'] = round(time.perf_counter() - start, 4)
+    timings = {}
+    for name, run in (('summary', lambda: report.summary()),
+                      ('overdue', lambda: report.overdue(limit=100)),
+                      ('top_books', lambda: report.circulation_by_book(10)),
+                      ('top_users', lambda: report.circulation_by_user(10)),
+                      ('loan_durations', lambda: report.loan_duration_percentiles())):
+        start = time.perf_counter()
+        run()
+        timings[name] = round(time.perf_counter() - start, 4)
+    results['seconds'] = timings
+    results['total_seconds'] = round(results['build_seconds'] + sum(timings.values()), 4)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# benchmarks/server_load.py
+"""
+Load generator for the JSON-RPC server (`python main.py serve`).
+
+Opens `--clients` concurrent connections that each send `--requests` requests one after another and
+reports the throughput and the p50/p99 latency. Requests are a mix of title searches, ISBN lookups
+and user lookups; with `--checkout-ratio` a share of them check a book out and back in again
+(each client works on its own books, so clients never conflict).
+
+Without `--connect` a server is started on a free port over a temporary copy of the data files in
+`--data-dir`, so the real data is never modified.
+
+Usage: python -m benchmarks.server_load [--connect HOST:PORT] [--data-dir DIR] [--clients N] [--requests N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ('books.json', 'users.json', 'checkouts.json')
+
+class Client:
+
+    """
+    A minimal JSON-RPC client over one connection.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=64 * 1024 * 1024)
+        return cls(reader, writer)
+
+    async def call(self, method, **params):
+
+        """
+        Sends one request and returns its response message.
+        """
+
+        self.next_id += 1
+        request = {'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params}
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def run_client(host, port, requests, books, user_ids, checkout_ratio, latencies):
+
+    """
+    Sends `requests` requests on one connection, appending each latency in seconds to `latencies`.
+
+    Returns:
+        int: The number of error responses.
+    """
+
+    client = await Client.connect(host, port)
+    errors = 0
+    try:
+        for _ in range(requests):
+            roll = random.random()
+            book = random.choice(books)
+            if roll < checkout_ratio and user_ids:
+                user_id = random.choice(user_ids)
+                calls = [('checkouts.checkout', {'user_id': user_id, 'isbn': book['isbn']}),
+                         ('checkouts.checkin', {'user_id': user_id, 'isbn': book['isbn']})]
+            elif roll < (1 + checkout_ratio) / 2:
+                start = random.randrange(max(len(book['title']) - 4, 1))
+                calls = [('books.search', {'title': book['title'][start:start + 4]})]
+            elif user_ids and roll < (3 + checkout_ratio) / 4:
+                calls = [('users.get', {'user_id': random.choice(user_ids)})]
+            else:
+                calls = [('books.get', {'isbn': book['isbn']})]
+            for method, params in calls:
+                start = time.perf_counter()
+                response = await client.call(method, **params)
+                latencies.append(time.perf_counter() - start)
+                errors += 'error' in response
+    finally:
+        await client.close()
+    return errors
+
+async def run_load(host, port, clients, requests, checkout_ratio):
+
+    """
+    Runs the load and returns the results as a dictionary.
+    """
+
+    client = await Client.connect(host, port)
+    books = (await client.call('books.list'))['result']
+    user_ids = [user['user_id'] for user in (await client.call('users.list'))['result']]
+    await client.close()
+    if not books:
+        raise RuntimeError("The server has no books to query")
+
+    # Only books that are available can be checked out, and each client gets its own share of them.
+    # Clients left without a share when there are fewer books than clients only send reads.
+    available = [book for book in books if book['available']]
+    shares = [available[index::clients] if checkout_ratio else books for index in range(clients)]
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(
+        run_client(host, port, requests, share or books, user_ids, checkout_ratio if share else 0, latencies)
+        for share in shares))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'benchmark': 'server_load',
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': round(elapsed, 6),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {'p50': round(percentiles[49] * 1000, 3), 'p99': round(percentiles[98] * 1000, 3)},
+    }
+
+def start_server(data_dir):
+
+    """
+    Starts `main.py serve` on a free port in `data_dir` and returns the process and its address.
+    """
+
+    process = subprocess.Popen([sys.executable, '-u', os.path.join(ROOT, 'main.py'), 'serve', '--port', '0'],
+                               cwd=data_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('Listening on '):
+        process.kill()
+        raise RuntimeError("The server did not start")
+    # Keep reading what the managers print, so that a full pipe never blocks the server.
+    threading.Thread(target=process.stdout.read, daemon=True).start()
+    host, port = line.split()[-1].rsplit(':', 1)
+    return process, host, int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connect', metavar='HOST:PORT', help='Use a running server instead of starting one')
+    parser.add_argument('--data-dir', default='.', help='The directory holding books.json, users.json and checkouts.json')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client')
+    parser.add_argument('--checkout-ratio', type=float, default=0.1)
+    options = parser.parse_args()
+
+    if options.connect:
+        host, port = options.connect.rsplit(':', 1)
+        results = asyncio.run(run_load(host, int(port), options.clients, options.requests, options.checkout_ratio))
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            for name in DATA_FILES:
+                if os.path.exists(os.path.join(options.data_dir, name)):
+                    shutil.copy(os.path.join(options.data_dir, name), data_dir)
+            process, host, port = start_server(data_dir)
+            try:
+                results = asyncio.run(run_load(host, port, options.clients, options.requests, options.checkout_ratio))
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(timeout=60)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
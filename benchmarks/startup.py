@@ -0,0 +1,101 @@
+# benchmarks/startup.py
+"""
+Measures how long main.py takes to start.
+
+* import: the cumulative `python -X importtime` cost of `import main`.
+* first prompt: wall time from launching `python main.py` until the main menu asks for a choice.
+* user menu / checkout menu: time from choosing the menu until it asks for a choice, which includes
+  loading the datasets that menu needs.
+
+Usage: python -m benchmarks.startup [--data-dir DIR] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import select
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = b"Enter choice: "
+
+def import_time(data_dir):
+
+    """
+    Returns the cumulative import time of `main` in seconds, as reported by `-X importtime`.
+    """
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=data_dir,
+                            env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        if line.rstrip().endswith('| main'):
+            return int(line.split('|')[1]) / 1e6
+    raise RuntimeError("main was not found in the -X importtime output")
+
+def wait_for_prompts(process, count=1, timeout=60):
+
+    """
+    Reads the output of `process` until `count` prompts have been printed.
+
+    Prompts are counted over everything read, since several of them can arrive in one chunk.
+
+    Raises:
+        RuntimeError: If main.py exits or stays silent for `timeout` seconds first.
+    """
+
+    output = b''
+    while output.count(PROMPT) < count:
+        ready, _, _ = select.select([process.stdout], [], [], timeout)
+        if not ready:
+            raise RuntimeError(f"main.py did not prompt within {timeout} seconds")
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            raise RuntimeError("main.py exited before prompting")
+        output += chunk
+
+def menu_times(data_dir):
+
+    """
+    Returns the seconds until the first prompt and until the user and checkout menus are ready.
+    """
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-u', os.path.join(ROOT, 'main.py')], cwd=data_dir,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        wait_for_prompts(process)
+        times = {'first_prompt': time.perf_counter() - start}
+        # Each step sends its keys and waits for as many prompts as the keys lead through.
+        for name, keys, prompts in (('user_menu', b"2\n", 1), ('checkout_menu', b"6\n3\n", 2)):
+            start = time.perf_counter()
+            process.stdin.write(keys)
+            process.stdin.flush()
+            wait_for_prompts(process, prompts)
+            times[name] = time.perf_counter() - start
+        process.stdin.write(b"4\n6\n")
+        process.stdin.flush()
+        process.wait(timeout=60)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default='.', help='The directory holding books.json, users.json and checkouts.json')
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    samples = {}
+    for _ in range(options.repeat):
+        samples.setdefault('import', []).append(import_time(options.data_dir))
+        for name, seconds in menu_times(options.data_dir).items():
+            samples.setdefault(name, []).append(seconds)
+    results = {name: round(statistics.median(values), 6) for name, values in samples.items()}
+    print(json.dumps({'benchmark': 'startup', 'median_seconds': results}, indent=4))
+
+if __name__ == '__main__':
+    main()
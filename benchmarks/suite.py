@@ -0,0 +1,196 @@
+# benchmarks/suite.py
+"""
+Times the core operations on synthetic libraries of increasing size.
+
+For every size a library is generated with benchmarks.dataset (`size` books, a tenth as many users
+and `size` checkouts with skewed borrowing) in a temporary directory, and these are timed:
+
+* storage.load_* / storage.save_*: loading and saving each file with `Storage`.
+* book_manager.search_books: title searches for words and word fragments from the catalog, then the
+  same searches again (`.repeated`), which are answered from the search cache.
+* book_manager.get_book_by_isbn: random ISBN lookups.
+* checkout_manager.checkout_book / checkin_book: checkout and checkin cycles on a `JournaledStorage`,
+  as `main.py` uses it.
+* checkout_manager.get_user_history / get_book_history: history queries for random users and books.
+
+Results are printed (or written with `--output`) as JSON with the median, p95 and mean time per call
+in microseconds. Pass a previous result file to `--compare` to print the change of every median and
+exit with status 1 if any got slower than `--threshold`.
+
+Usage: python -m benchmarks.suite [--sizes 1000,10000,100000] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import dataset
+from book import BookManager
+from check import CheckoutManager
+from storage import JournaledStorage, Storage
+from user import UserManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize(samples):
+
+    """
+    Returns the call count and the median, p95 and mean of `samples` (in seconds) in microseconds.
+    """
+
+    ordered = sorted(samples)
+    return {
+        'calls': len(ordered),
+        'median_us': round(statistics.median(ordered) * 1e6, 3),
+        'p95_us': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1e6, 3),
+        'mean_us': round(statistics.fmean(ordered) * 1e6, 3),
+    }
+
+def time_calls(function, arguments):
+
+    """
+    Calls `function` once per item of `arguments` and returns the time of every call.
+    """
+
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(*argument)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def run_size(size, repeat, operations, seed):
+
+    """
+    Generates a library of `size` books and times every operation on it.
+    """
+
+    rng = random.Random(seed)
+    results = {}
+    books, users, checkouts = dataset.generate(size, seed=seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage = dataset.write(data_dir, books, users, checkouts)
+        del books, users, checkouts
+
+        for name in ('books', 'users'):
+            load = getattr(storage, f'load_{name}')
+            save = getattr(storage, f'save_{name}')
+            results[f'storage.load_{name}'] = summarize(time_calls(load, [()] * repeat))
+            records = load()
+            results[f'storage.save_{name}'] = summarize(time_calls(save, [(records,)] * repeat))
+        book_manager = BookManager(storage)
+        user_manager = UserManager(storage)
+        load = lambda: storage.load_checkouts(book_manager.get_book_by_isbn, user_manager.get_user_by_id)
+        results['storage.load_checkouts'] = summarize(time_calls(load, [()] * repeat))
+        records = load()
+        results['storage.save_checkouts'] = summarize(time_calls(storage.save_checkouts, [(records,)] * repeat))
+        del records
+
+        journaled = JournaledStorage(storage.book_file, storage.user_file, storage.checkout_file)
+        book_manager = BookManager(journaled)
+        user_manager = UserManager(journaled)
+        checkout_manager = CheckoutManager(journaled, book_manager, user_manager)
+        books = book_manager.list_books()
+        users = user_manager.list_users()
+
+        queries = []
+        for book in rng.sample(books, min(operations, len(books))):
+            word = rng.choice(book.title.split())
+            queries.append((word[:rng.randint(3, len(word))],) if len(word) > 3 else (word,))
+        results['book_manager.search_books'] = summarize(time_calls(book_manager.search_books, queries))
+        results['book_manager.search_books.repeated'] = summarize(time_calls(book_manager.search_books, queries))
+        isbns = [(rng.choice(books).isbn,) for _ in range(operations * 10)]
+        results['book_manager.get_book_by_isbn'] = summarize(time_calls(book_manager.get_book_by_isbn, isbns))
+
+        available = [book for book in books if book.available]
+        cycles = [(rng.choice(users), book) for book in rng.sample(available, min(operations, len(available)))]
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['checkout_manager.checkout_book'] = summarize(time_calls(checkout_manager.checkout_book, cycles))
+            results['checkout_manager.checkin_book'] = summarize(time_calls(checkout_manager.checkin_book, cycles))
+
+        history_users = [(rng.choice(users),) for _ in range(operations)]
+        results['checkout_manager.get_user_history'] = summarize(time_calls(checkout_manager.get_user_history, history_users))
+        history_books = [(rng.choice(books),) for _ in range(operations)]
+        results['checkout_manager.get_book_history'] = summarize(time_calls(checkout_manager.get_book_history, history_books))
+        journaled.close()
+    return results
+
+def version():
+
+    """
+    Returns the git commit of the code under test, or None outside a git checkout.
+    """
+
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def compare(results, baseline, threshold):
+
+    """
+    Prints the change of every median compared to `baseline` and returns the operations that got
+    slower by more than `threshold` (a ratio).
+    """
+
+    regressions = []
+    print(f"{'size':>8}  {'operation':<36}{'baseline us':>14}{'current us':>14}{'ratio':>8}", file=sys.stderr)
+    for size, operations in results['results'].items():
+        for name, stats in operations.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if not before or not before['median_us']:
+                continue
+            ratio = stats['median_us'] / before['median_us']
+            flag = '  slower' if ratio > threshold else ''
+            print(f"{size:>8}  {name:<36}{before['median_us']:>14.1f}{stats['median_us']:>14.1f}{ratio:>8.2f}{flag}",
+                  file=sys.stderr)
+            if ratio > threshold:
+                regressions.append(f"{size}:{name}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='Comma separated numbers of books, e.g. 1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of every load and save')
+    parser.add_argument('--operations', type=int, default=200, help='Calls of every query and checkout operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this file instead of printing them')
+    parser.add_argument('--compare', metavar='FILE', help='A previous result file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio that counts as a regression')
+    options = parser.parse_args()
+
+    results = {
+        'benchmark': 'suite',
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': options.seed,
+        'results': {},
+    }
+    for size in (int(size) for size in options.sizes.split(',')):
+        results['results'][str(size)] = run_size(size, options.repeat, options.operations, options.seed)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+    if options.compare:
+        with open(options.compare) as file:
+            regressions = compare(results, json.load(file), options.threshold)
+        if regressions:
+            print(f"Slower than {options.threshold}x: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
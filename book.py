@@ -1,16 +1,40 @@
 # book.py
+import bisect
+import itertools
+import threading
+import paging
+from catalog import LRUCache
 from models import Book
+from locks import ReadWriteLock
 from storage import Storage
+from text_index import FuzzyIndex, NGramIndex
 
 class BookManager:
-    def __init__(self, storage):
+
+    # The orders `page_books` can sort by, besides 'catalog', the order in which the books were added.
+    SORT_KEYS = {
+        'title': lambda book: (book.title or '').lower(),
+        'author': lambda book: (book.author or '').lower(),
+        'isbn': lambda book: book.isbn,
+    }
+
+    def __init__(self, storage, search_cache_size=1024):
     
      """
      Initialize the BookManager with a storage object.
-     Load the books from the storage and store them in the `books` attribute.
+     Load the books from the storage and store them in the `books` attribute,
+     and index them by ISBN for constant-time lookups. The title and author indexes for searching are built
+     on the first search, so sessions that never search do not pay for them.
+
+     The manager can be shared between threads. Searching and listing hold a read lock, so searches run in
+     parallel with each other. Adding, updating and deleting books, and changing a book's availability, hold
+     the write lock only while they change the books in memory; they save them to the storage after
+     releasing it, so searches never wait for the disk. Adding, updating and deleting are also serialized
+     with each other, so the storage sees them in the order they were made.
 
      Args:
      storage (Storage): An instance of the Storage class that handles the storage and retrieval of data.
+     search_cache_size (int, optional): The number of distinct searches whose results are cached. Defaults to 1024.
 
      Returns:
      None
@@ -18,6 +42,21 @@ class BookManager:
         
      self.storage = storage
      self.books = self.storage.load_books()
+     self._books_by_isbn = {}
+     self._sequence = {}
+     self._next_sequence = 0
+     self._title_index = None
+     self._author_index = None
+     self._sorted = {}
+     self._fuzzy_index = None
+     self.search_cache = LRUCache(search_cache_size)
+     # Bumped after every availability change, so cached search results know when to filter again.
+     self._availability_changes = itertools.count(1)
+     self._availability_version = 0
+     self._lock = ReadWriteLock()
+     self._change_lock = threading.Lock()
+     for book in self.books:
+         self._index_book(book)
         
 
     def add_book(self, book):
@@ -35,13 +74,55 @@ class BookManager:
         ValueError: If the ISBN number of the new book already exists in the list of books.
         """
 
-        existing_book = self.get_book_by_isbn(book.isbn)
-        if existing_book:
-            raise ValueError("The ISBN number already exists, Try with different number")
-        else:
-            self.books.append(book)
-            self.storage.save_books(self.books)
-            return print("Book added successfully")
+        with self._change_lock:
+            with self._lock.write():
+                existing_book = self.get_book_by_isbn(book.isbn)
+                if existing_book:
+                    raise ValueError("The ISBN number already exists, Try with different number")
+                self.books.append(book)
+                self._index_book(book)
+                self._invalidate_searches(book)
+            self.storage.put_book(book, self.books)
+        return print("Book added successfully")
+
+    def add_books(self, books, skip_duplicates=False):
+
+        """
+        Add many new books at once and save them to the storage in a single write.
+
+        Args:
+        books (iterable): Book objects to add.
+        skip_duplicates (bool, optional): Skip books whose ISBN already exists instead of raising. Defaults to False.
+
+        Returns:
+        int: The number of books that were added.
+
+        Raises:
+        ValueError: If an ISBN already exists or appears twice in `books` and `skip_duplicates` is False.
+        In that case no book is added.
+        """
+
+        with self._change_lock:
+            new_books = []
+            seen = set()
+            duplicates = []
+            for book in books:
+                if book.isbn in self._books_by_isbn or book.isbn in seen:
+                    duplicates.append(book.isbn)
+                else:
+                    seen.add(book.isbn)
+                    new_books.append(book)
+            if duplicates and not skip_duplicates:
+                raise ValueError(f"The ISBN numbers already exist: {', '.join(duplicates)}")
+
+            if new_books:
+                with self._lock.write():
+                    for book in new_books:
+                        self.books.append(book)
+                        self._index_book(book)
+                    self.search_cache.clear()
+                self.storage.put_books(new_books, self.books)
+        return len(new_books)
 
     def update_book(self, isbn, title=None, author=None):
 
@@ -58,15 +139,28 @@ class BookManager:
 
         """
         
-        book = self.get_book_by_isbn(isbn)
-        if book:
-            if title:
-                book.title = title
-            if author:
-                book.author = author
-            self.storage.save_books(self.books)
-        else:
-            raise ValueError("The book with the given ISBN does not exist.")
+        with self._change_lock:
+            book = self.get_book_by_isbn(isbn)
+            if not book:
+                raise ValueError("The book with the given ISBN does not exist.")
+            with self._lock.write():
+                # Searches that matched the old title or author, and those that match the new ones.
+                self._invalidate_searches(book)
+                if title:
+                    book.title = title
+                    if self._title_index is not None:
+                        self._title_index.add(isbn, title)
+                if author:
+                    book.author = author
+                    if self._author_index is not None:
+                        self._author_index.add(isbn, author)
+                for sort, index in self._sorted.items():
+                    index.remove(isbn)
+                    index.add(isbn, self.SORT_KEYS[sort](book), self._sequence[isbn])
+                if self._fuzzy_index is not None:
+                    self._fuzzy_index.add(isbn, self._fuzzy_text(book))
+                self._invalidate_searches(book)
+            self.storage.put_book(book, self.books)
 
     def delete_book(self, isbn):
         """
@@ -84,13 +178,16 @@ class BookManager:
         This method removes a book from the list of books if it exists. It takes an ISBN number as an argument and searches for the corresponding book in the list of books. If the book is found, it is removed from the list and the updated list is saved to the storage. If the book is not found, a ValueError is raised.
         """
 
-        book = self.get_book_by_isbn(isbn)
-        if book:
-            self.books.remove(book)
-            self.storage.save_books(self.books)
-            return print("Book deleted successfully")
-        else:
-            raise ValueError("To delete the book, add the book first")
+        with self._change_lock:
+            book = self.get_book_by_isbn(isbn)
+            if not book:
+                raise ValueError("To delete the book, add the book first")
+            with self._lock.write():
+                self.books.remove(book)
+                self._unindex_book(book)
+                self._invalidate_searches(book)
+            self.storage.remove_book(book, self.books)
+        return print("Book deleted successfully")
 
     def list_books(self):
 
@@ -99,12 +196,63 @@ class BookManager:
         List all the books in the storage.
 
         Returns:
-        A list of all the books in the storage.
+        A list of all the books in the storage. It is a copy, so it does not change while the caller uses it.
+
+
+        """
+
+        with self._lock.read():
+            return list(self.books)
+
+    def page_books(self, cursor=None, limit=20, sort='catalog', available=None):
+
+        """
+        Get one page of the catalog.
+
+        Args:
+        cursor (str, optional): The `next_cursor` of the previous page. Defaults to None, for the first page.
+        limit (int, optional): The maximum number of books on the page. Defaults to 20.
+        sort (str, optional): 'catalog' (the order the books were added), 'title', 'author' or 'isbn'.
+        Titles and authors are sorted ignoring case. Defaults to 'catalog'.
+        available (bool, optional): Only list available (True) or checked out (False) books. Defaults to None, for all.
+
+        Returns:
+        Page: The books on the page and the cursor of the next page, which is None on the last page.
+
+        Raises:
+        ValueError: If the sort order or the cursor is invalid.
+
+        Sorting by anything but 'catalog' keeps a sorted index of the books, built on first use.
+        """
 
+        if sort != 'catalog' and sort not in self.SORT_KEYS:
+            raise ValueError(f"Cannot sort books by {sort}")
+        position = paging.decode_cursor(cursor, sort)
+        predicate = None if available is None else (lambda book: book.available == available)
+        if sort != 'catalog' and sort not in self._sorted:
+            with self._lock.write():
+                if sort not in self._sorted:
+                    self._sorted[sort] = paging.SortedIndex.from_records(
+                        (book.isbn, self.SORT_KEYS[sort](book), self._sequence[book.isbn]) for book in self.books)
+        with self._lock.read():
+            if sort == 'catalog':
+                # The books are kept in the order of their sequence numbers.
+                start = 0 if position is None else bisect.bisect_left(
+                    self.books, position[0] + 1, key=lambda book: self._sequence[book.isbn])
+                candidates = (((self._sequence[self.books[row].isbn],), self.books[row])
+                              for row in range(start, len(self.books)))
+            else:
+                candidates = ((key, self._books_by_isbn[isbn]) for key, isbn in self._sorted[sort].after(position))
+            return paging.page(candidates, limit, sort, predicate)
+
+    def iter_books(self, sort='catalog', available=None, page_size=1000):
 
         """
+        Yield the books in the order and with the filter of `page_books`, fetching them a page at a time.
+        The lock is only held while a page is fetched, so changes made in between are seen by later pages.
+        """
 
-        return self.books
+        return paging.iterate(lambda cursor, limit: self.page_books(cursor, limit, sort, available), page_size)
 
     def search_books(self, title=None, author=None, isbn=None):
 
@@ -117,17 +265,83 @@ class BookManager:
         isbn (str, optional): The ISBN number of the book to search for. Defaults to None.
 
         Returns:
-        A list of books that match the search criteria.
+        A list of the available books that match any of the given criteria, in catalog order.
+
+        Title and author are matched as case-insensitive substrings using the n-gram indexes,
+        so only the matching books are visited. The indexes are built on the first search.
+
+        Recent searches are kept in `search_cache`, keyed on the lowercased criteria, with all the books they
+        match and the available ones among them. Adding, updating or deleting a book drops the cached searches
+        it matches. Every availability change bumps a version number, and a cached result from an older version
+        is filtered for availability again, so checkouts never make a cached result stale.
+        `search_cache.stats()` reports the hit rate.
         """
 
-        results = []
-        for book in self.books:
-            if book.available and (title and title.lower() in book.title.lower()) or \
-               (author and author.lower() in book.author.lower()) or \
-               (isbn and isbn == book.isbn):
-                results.append(book)
+        if self._title_index is None:
+            with self._lock.write():
+                if self._title_index is None:
+                    author_index = NGramIndex()
+                    title_index = NGramIndex()
+                    for book in self.books:
+                        title_index.add(book.isbn, book.title)
+                        author_index.add(book.isbn, book.author)
+                    self._author_index = author_index
+                    # Set last: the check above reads it without the lock.
+                    self._title_index = title_index
+        key = (title.lower() if title else None, author.lower() if author else None, isbn or None)
+        # Read before filtering: a change after this point bumps the version past the one stored with the result.
+        version = self._availability_version
+        with self._lock.read():
+            cached = self.search_cache.get(key)
+            if cached is not None and cached[2] == version:
+                return list(cached[1])
+            if cached is not None:
+                matches = cached[0]
+            else:
+                found = set()
+                if title:
+                    found |= self._title_index.search(title)
+                if author:
+                    found |= self._author_index.search(author)
+                if isbn and isbn in self._books_by_isbn:
+                    found.add(isbn)
+                matches = tuple(self._books_by_isbn[match] for match in sorted(found, key=self._sequence.__getitem__))
+            results = [book for book in matches if book.available]
+            # Stored under the read lock, so no change to the catalog can slip in between.
+            self.search_cache.put(key, (matches, tuple(results), version))
         return results
 
+    def fuzzy_search_books(self, query, limit=10, min_similarity=0.25):
+
+        """
+        Search for books whose title and author are most similar to `query`, tolerating typos.
+
+        Args:
+        query (str): Words of the title and/or author, in any order, e.g. "tagor geethanjli".
+        limit (int, optional): The maximum number of results. Defaults to 10.
+        min_similarity (float, optional): How similar, from 0 to 1, a word of a book must be to a query word
+        to count. Defaults to 0.25.
+
+        Returns:
+        list: `(book, score)` pairs, the best match first. The score is between 0 and 1, where 1 means every
+        query word appears in the title or author. Equal scores are in catalog order. Unlike `search_books`,
+        checked out books are included.
+
+        Words are compared by their trigrams (see `text_index.FuzzyIndex`). The index is built on first use
+        and kept up to date afterwards; the work per query is bounded however large the catalog is.
+        """
+
+        if self._fuzzy_index is None:
+            with self._lock.write():
+                if self._fuzzy_index is None:
+                    index = FuzzyIndex()
+                    for book in self.books:
+                        index.add(book.isbn, self._fuzzy_text(book))
+                    self._fuzzy_index = index
+        with self._lock.read():
+            matches = self._fuzzy_index.search(query, limit, min_similarity, order=self._sequence.__getitem__)
+            return [(self._books_by_isbn[isbn], score) for isbn, score in matches]
+
     def get_book_by_isbn(self, isbn):
        
         """
@@ -138,14 +352,13 @@ class BookManager:
 
         Returns:
         A Book object if the book is found, otherwise None.
+
+        A single dictionary lookup is atomic, so this takes no lock.
         """
 
-        for book in self.books:
-            if book.isbn == isbn:
-                return book
-        return None
+        return self._books_by_isbn.get(isbn)
     
-    def update_book_availability(self, book, available):
+    def update_book_availability(self, book, available, save=True):
 
         """
         Update the availability status of a book.
@@ -153,6 +366,7 @@ class BookManager:
         Args:
         book (Book): The book object to update.
         available (bool): The new availability status of the book.
+        save (bool, optional): Save the book. False only undoes a change whose save failed. Defaults to True.
 
         Returns:
         None
@@ -161,10 +375,52 @@ class BookManager:
         and a boolean value representing the new availability status. 
         It then updates the availability attribute of the book object and saves 
         the updated list of books to the storage.
+        The flag and the version number of cached searches change together under the write lock, so the
+        version never goes backwards; the book is saved after releasing it. `CheckoutManager` serializes
+        the changes to one book with a per-ISBN lock.
         """
 
-        book.available = available
-        self.storage.save_books(self.books)
-
+        with self._lock.write():
+            book.available = available
+            self._availability_version = next(self._availability_changes)
+        if save:
+            self.storage.put_book(book, self.books)
+
+    def _index_book(self, book):
+        self._books_by_isbn[book.isbn] = book
+        self._sequence[book.isbn] = self._next_sequence
+        self._next_sequence += 1
+        if self._title_index is not None:
+            self._title_index.add(book.isbn, book.title)
+            self._author_index.add(book.isbn, book.author)
+        for sort, index in self._sorted.items():
+            index.add(book.isbn, self.SORT_KEYS[sort](book), self._sequence[book.isbn])
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(book.isbn, self._fuzzy_text(book))
+
+    @staticmethod
+    def _fuzzy_text(book):
+        return f"{book.title or ''} {book.author or ''}"
+
+    def _invalidate_searches(self, book):
 
+        """
+        Drops the cached searches whose criteria match `book`. The caller holds the write lock.
+        """
 
+        title = (book.title or '').lower()
+        author = (book.author or '').lower()
+        self.search_cache.discard_where(lambda key: (key[0] is not None and key[0] in title)
+                                        or (key[1] is not None and key[1] in author)
+                                        or key[2] == book.isbn)
+
+    def _unindex_book(self, book):
+        del self._books_by_isbn[book.isbn]
+        del self._sequence[book.isbn]
+        if self._title_index is not None:
+            self._title_index.remove(book.isbn)
+            self._author_index.remove(book.isbn)
+        for index in self._sorted.values():
+            index.remove(book.isbn)
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.remove(book.isbn)
@@ -0,0 +1,418 @@
+# catalog.py
+"""
+An out-of-core book catalog for catalogs too large to hold in memory.
+
+`DiskBookManager` has the interface of `BookManager`, but keeps no list of books. The books stay in
+a SQLite database, whose primary key B-tree over isbn is the on-disk index that serves
+`get_book_by_isbn`. Materialized `Book` objects are kept in a bounded `LRUCache`, and a
+`BloomFilter` over all ISBNs answers most lookups of unknown ISBNs, such as the duplicate check of
+`add_book`, without touching the disk. Memory use is set by the cache size; the filter adds about
+2.4 bytes per book, instead of the few hundred bytes a `Book` and its index entries take.
+"""
+
+import hashlib
+import math
+import threading
+import paging
+from collections import OrderedDict
+from locks import ReadWriteLock
+
+class BloomFilter:
+
+    """
+    A set of keys that may report false positives but never false negatives.
+
+    Keys cannot be removed; a removed key just keeps answering "maybe", which costs one lookup.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+
+        """
+        Initializes an empty filter.
+
+        Args:
+            capacity (int): The number of keys the filter is sized for. More keys raise the error rate.
+            error_rate (float, optional): The false positive rate at `capacity` keys. Defaults to 0.01.
+
+        Attributes:
+            count (int): The number of keys added so far. Once it exceeds `capacity`, rebuild a larger filter.
+        """
+
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        self.count += 1
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class LRUCache:
+
+    """
+    A mapping that holds at most `capacity` items and evicts the least recently used one when full.
+
+    It can be shared between threads.
+    """
+
+    def __init__(self, capacity):
+
+        """
+        Initializes an empty cache.
+
+        Args:
+            capacity (int): The maximum number of items.
+        """
+
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+
+        """
+        Returns the item cached under `key` and marks it as recently used, or None.
+        """
+
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+
+        """
+        Caches `value` under `key`, evicting the least recently used item if the cache is full.
+        """
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def peek(self, key):
+
+        """
+        Returns the item cached under `key`, or None, without counting a hit or miss or marking it as used.
+        """
+
+        with self._lock:
+            return self._items.get(key)
+
+    def pop(self, key):
+        with self._lock:
+            return self._items.pop(key, None)
+
+    def discard_where(self, predicate):
+
+        """
+        Removes every item whose key `predicate` returns True for, and returns how many were removed.
+        """
+
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                del self._items[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+
+        """
+        Returns the size, capacity, hits, misses and hit rate of the cache, to help choose its capacity.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+class DiskBookManager:
+
+    """
+    A `BookManager` for catalogs that do not fit in memory.
+
+    Books are read from and written to the storage one at a time, so it needs a storage with point
+    reads, i.e. `SQLiteStorage`. `get_book_by_isbn` returns the cached `Book` if there is one, asks the
+    Bloom filter whether the ISBN can exist, and only then looks it up on disk and caches the result.
+    Searches and listings stream the table instead of using in-memory indexes.
+
+    Only the cached copy of a book is kept in sync with the database. A `Book` that was evicted from the
+    cache stays valid for whoever holds it; the next lookup simply reads a fresh copy. Checkouts check and
+    save the current copy, so a stale one is never written back.
+    """
+
+    def __init__(self, storage, cache_size=10000, error_rate=0.01):
+
+        """
+        Initializes the manager. Only the ISBNs are read, to fill the Bloom filter.
+
+        Args:
+            storage (SQLiteStorage): The storage that holds the books.
+            cache_size (int, optional): The number of `Book` objects to keep in memory. Defaults to 10000.
+            error_rate (float, optional): The Bloom filter's false positive rate. Defaults to 0.01.
+
+        Raises:
+            ValueError: If the storage cannot look up single books.
+        """
+
+        if not hasattr(storage, 'get_book'):
+            raise ValueError("DiskBookManager needs a storage with point reads, such as SQLiteStorage")
+        self.storage = storage
+        self.cache = LRUCache(cache_size)
+        self._error_rate = error_rate
+        self._build_filter()
+        self._lock = ReadWriteLock()
+
+    def add_book(self, book):
+
+        """
+        Add a new book to the catalog.
+
+        Args:
+            book (Book): The book to add.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the ISBN already exists.
+        """
+
+        with self._lock.write():
+            if self.get_book_by_isbn(book.isbn):
+                raise ValueError("The ISBN number already exists, Try with different number")
+            self.storage.put_book(book, ())
+            self._filter.add(book.isbn)
+            self._grow_filter()
+            self.cache.put(book.isbn, book)
+        return print("Book added successfully")
+
+    def add_books(self, books, skip_duplicates=False):
+
+        """
+        Add many new books at once and save them to the storage in a single write.
+
+        Args:
+            books (iterable): Book objects to add.
+            skip_duplicates (bool, optional): Skip books whose ISBN already exists instead of raising. Defaults to False.
+
+        Returns:
+            int: The number of books that were added.
+
+        Raises:
+            ValueError: If an ISBN already exists or appears twice in `books` and `skip_duplicates` is False.
+            In that case no book is added.
+        """
+
+        with self._lock.write():
+            new_books = []
+            seen = set()
+            duplicates = []
+            for book in books:
+                if book.isbn in seen or self.get_book_by_isbn(book.isbn):
+                    duplicates.append(book.isbn)
+                else:
+                    seen.add(book.isbn)
+                    new_books.append(book)
+            if duplicates and not skip_duplicates:
+                raise ValueError(f"The ISBN numbers already exist: {', '.join(duplicates)}")
+            if new_books:
+                self.storage.put_books(new_books, ())
+                for book in new_books:
+                    self._filter.add(book.isbn)
+                self._grow_filter()
+        return len(new_books)
+
+    def update_book(self, isbn, title=None, author=None):
+
+        """
+        Update the details of an existing book.
+
+        Args:
+            isbn (str): The ISBN number of the book to update.
+            title (str, optional): The new title. Defaults to None.
+            author (str, optional): The new author. Defaults to None.
+
+        Raises:
+            ValueError: If the book does not exist.
+        """
+
+        with self._lock.write():
+            book = self.get_book_by_isbn(isbn)
+            if not book:
+                raise ValueError("The book with the given ISBN does not exist.")
+            if title:
+                book.title = title
+            if author:
+                book.author = author
+            self.storage.put_book(book, ())
+
+    def delete_book(self, isbn):
+
+        """
+        Delete a book from the catalog.
+
+        Args:
+            isbn (str): The ISBN number of the book to delete.
+
+        Raises:
+            ValueError: If the book does not exist.
+        """
+
+        with self._lock.write():
+            book = self.get_book_by_isbn(isbn)
+            if not book:
+                raise ValueError("To delete the book, add the book first")
+            self.storage.remove_book(book, ())
+            self.cache.pop(isbn)
+        return print("Book deleted successfully")
+
+    def list_books(self):
+
+        """
+        Returns a list of all the books. This reads the whole catalog into memory; use `iter_books` to stream it.
+        """
+
+        return list(self.iter_books())
+
+    def page_books(self, cursor=None, limit=20, sort='catalog', available=None):
+
+        """
+        Get one page of the catalog, with the arguments of `BookManager.page_books`.
+
+        Each page is one indexed query that starts right after the cursor, however deep into the catalog
+        it is. Titles and authors are sorted ignoring the case of ASCII letters, as SQLite's NOCASE does.
+
+        Returns:
+            Page: The books on the page and the cursor of the next page, which is None on the last page.
+
+        Raises:
+            ValueError: If the sort order or the cursor is invalid.
+        """
+
+        position = paging.decode_cursor(cursor, sort)
+        rows = self.storage.iter_sorted_books(sort, position, available)
+        return paging.page(((position, self._cached(book)) for position, book in rows), limit, sort)
+
+    def iter_books(self, sort='catalog', available=None, page_size=1000):
+
+        """
+        Yields the books in the order and with the filter of `page_books`, reading them a page at a time.
+        """
+
+        return paging.iterate(lambda cursor, limit: self.page_books(cursor, limit, sort, available), page_size)
+
+    def search_books(self, title=None, author=None, isbn=None):
+
+        """
+        Search for available books by title, author or ISBN, as `BookManager.search_books` does.
+
+        Returns:
+            list: The matching available books, in catalog order.
+        """
+
+        return [self._cached(book) for book in self.storage.search_books(title, author, isbn)]
+
+    def get_book_by_isbn(self, isbn):
+
+        """
+        Look up a book by its ISBN number.
+
+        Args:
+            isbn (str): The ISBN number to look up.
+
+        Returns:
+            A Book object if the book is found, otherwise None.
+        """
+
+        book = self.cache.get(isbn)
+        if book is not None:
+            return book
+        if isbn not in self._filter:
+            return None
+        book = self.storage.get_book(isbn)
+        if book is not None:
+            self.cache.put(isbn, book)
+        return book
+
+    def update_book_availability(self, book, available, save=True):
+
+        """
+        Update the availability status of a book and save it.
+
+        Args:
+            book (Book): The book to update.
+            available (bool): The new availability status.
+            save (bool, optional): Save the book. False only undoes a change whose save failed. Defaults to True.
+
+        `book` may be a copy that was evicted from the cache, and changed through the cached copy since,
+        so the current copy is what gets saved; both are updated. `CheckoutManager` serializes the changes
+        to one book with a per-ISBN lock.
+        """
+
+        book.available = available
+        current = self.get_book_by_isbn(book.isbn) or book
+        current.available = available
+        if save:
+            self.storage.put_book(current, ())
+
+    def _build_filter(self):
+
+        """
+        Fills a new Bloom filter with the stored ISBNs, sized for twice the current catalog.
+        """
+
+        bloom = BloomFilter(self.storage.count_books() * 2, self._error_rate)
+        for isbn in self.storage.iter_isbns():
+            bloom.add(isbn)
+        self._filter = bloom
+
+    def _grow_filter(self):
+
+        """
+        Rebuilds the Bloom filter once more books were added than it was sized for, which would raise its
+        error rate. The size doubles each time, so the rebuilds take constant time per added book on average.
+        The caller holds the write lock.
+        """
+
+        if self._filter.count > self._filter.capacity:
+            self._build_filter()
+
+    def _cached(self, book):
+
+        """
+        Returns the cached copy of a book read from the storage, so callers share one object per ISBN.
+        """
+
+        return self.cache.peek(book.isbn) or book
@@ -1,19 +1,41 @@
 # check.py
 
+import bisect
 import datetime
+import itertools
+import threading
+import paging
+from array import array
+from checkout_table import CheckoutTable
+from locks import ReadWriteLock, StripedLock
 from models import Checkout
 from storage import Storage
+from user import UserManager
 
 class CheckoutManager:
-    def __init__(self, storage,book_manager):
+    def __init__(self, storage,book_manager, user_manager=None, columnar=False):
 
         """
         Initialize the CheckoutManager with the provided storage and book_manager.
-        Loads the checkouts from the storage and sets them as an attribute.
+        Loads the checkouts from the storage and sets them as an attribute. They are indexed in one pass
+        by user ID, by ISBN and by open (not yet checked in) status the first time they are used, so
+        constructing the manager costs no more than loading the checkouts.
+
+        The manager can be shared between threads. Checking a book out or in holds a lock striped by ISBN,
+        so two threads can never both check out the same book, while checkouts of other books proceed in
+        parallel up to their storage commits. Those take turns: a commit may rewrite the whole checkout
+        file from the list in memory, so another checkout must not commit before its own row is listed.
+        The checkout list and its indexes are guarded by a read-write lock that writers hold only
+        to append or index a checkout, so queries are not held up by storage I/O.
 
         Args:
         storage (Storage): The storage object responsible for loading and saving checkouts.
         book_manager (BookManager): The book manager object responsible for managing book availability.
+        user_manager (UserManager, optional): The user manager used to resolve the users of stored checkouts.
+        Defaults to a new UserManager on the same storage.
+        columnar (bool, optional): Keep the checkouts in a compact, array-backed `CheckoutTable` instead of
+        a list of `Checkout` objects, loaded with `Storage.load_checkout_table`, which maps binary snapshots
+        without decoding them. Defaults to False.
 
         Returns:
         None
@@ -21,7 +43,21 @@ class CheckoutManager:
         
         self.storage = storage
         self.book_manager = book_manager
-        self.checkouts = self.storage.load_checkouts()
+        self.user_manager = user_manager or UserManager(storage)
+        if columnar:
+            self.checkouts = self.storage.load_checkout_table(self.book_manager.get_book_by_isbn, self.user_manager.get_user_by_id)
+        else:
+            self.checkouts = self.storage.load_checkouts(self.book_manager.get_book_by_isbn, self.user_manager.get_user_by_id)
+        # The indexes hold positions in self.checkouts, so they work for lists and tables alike.
+        self._checkouts_by_user = {}
+        self._checkouts_by_isbn = {}
+        self._open_checkouts = {}
+        self._indexed = False
+        # Bumped by `archive`, which renumbers the rows that page cursors point at.
+        self._epoch = 0
+        self._lock = ReadWriteLock()
+        self._book_locks = StripedLock()
+        self._commit_lock = threading.Lock()
 
     def checkout_book(self, user, book):
 
@@ -33,23 +69,45 @@ class CheckoutManager:
         book (Book): The book to be checked out.
 
         Raises:
-        ValueError: If the book is not available.
+        ValueError: If the book is not available, also when another process sharing the storage checked it out.
 
         Returns:
         None
 
         This method first checks if the book is available. If it is, it creates a new Checkout object with the provided user and book,
         appends it to the list of checkouts, marks the book as unavailable, and saves the updated list of checkouts.
+        The book and the checkout are saved together in one storage transaction.
         If the book is not available, it raises a ValueError with an appropriate message.
         """
         
-        if book.available == False:
-            raise ValueError("Book is not available")
-        else :
+        self._ensure_indexed()
+        with self._book_locks.lock_for(book.isbn):
+            # A `DiskBookManager` may have evicted `book` from its cache and changed a fresh copy since.
+            current = self.book_manager.get_book_by_isbn(book.isbn) or book
+            if current.available == False:
+                raise ValueError("Book is not available")
             checkout = Checkout(user, book)
-            self.checkouts.append(checkout)
-            self.book_manager.update_book_availability(book, False)  # Mark the book as unavailable
-            self.storage.save_checkouts(self.checkouts)
+            # The checkout joins the list only once it is stored. Until then the storage sees it at the end of
+            # the list; `unlisted` is emptied when it is appended, in case the write is committed later.
+            unlisted = [checkout]
+            marked = False
+            with self._commit_lock:
+                try:
+                    with self.storage.transaction():
+                        # Rejects the checkout if another process checked the book out since it was loaded.
+                        self.storage.check_book_available(book.isbn)
+                        self.book_manager.update_book_availability(book, False)  # Mark the book as unavailable
+                        marked = True
+                        self.storage.put_checkout(checkout, itertools.chain(self.checkouts, unlisted))
+                except BaseException:
+                    # Nothing was stored, so the book is still available as far as this session knows.
+                    if marked:
+                        self.book_manager.update_book_availability(book, True, save=False)
+                    raise
+                with self._lock.write():
+                    self.checkouts.append(checkout)
+                    unlisted.clear()
+                    self._index_checkout(len(self.checkouts) - 1, checkout)
 
 
     def checkin_book(self, user, book):
@@ -68,16 +126,23 @@ class CheckoutManager:
         None
 
         This method first retrieves the checkout for the provided user and book. If it exists, it updates the checkin_date to the current date and time,
-        marks the book as available, and saves the updated list of checkouts. If the checkout is not found, it raises a ValueError with an appropriate message.
+        marks the book as available, and saves the updated list of checkouts in one storage transaction.
+        If the checkout is not found, it raises a ValueError with an appropriate message.
         """
         
-        checkout = self.get_checkout(user, book)
-        if checkout:
-            checkout.checkin_date = datetime.datetime.now()
-            self.book_manager.update_book_availability(book, True)
-            self.storage.save_checkouts(self.checkouts)
-        else :
-            raise ValueError("Checkout not found for the given user and book")
+        self._ensure_indexed()
+        with self._book_locks.lock_for(book.isbn):
+            with self._lock.write():
+                row = self._open_checkouts.get(user.user_id, {}).get(book.isbn)
+                if row is None:
+                    raise ValueError("Checkout not found for the given user and book")
+                checkout = self.checkouts[row]
+                checkout.checkin_date = datetime.datetime.now()
+                self.checkouts[row] = checkout
+                self._close_checkout(checkout)
+            with self._commit_lock, self.storage.transaction():
+                self.book_manager.update_book_availability(book, True)
+                self.storage.put_checkout(checkout, self.checkouts)
 
     def list_checkouts(self):
 
@@ -86,10 +151,71 @@ class CheckoutManager:
 
         Returns:
         A list of all the current checkouts.
+
+        Checkouts are only ever appended, so the list can be iterated while other threads check books out.
+        Checkouts moved to the archive by `archive` are not included.
         """
         
         return self.checkouts
 
+    def page_checkouts(self, cursor=None, limit=20, user_id=None, isbn=None, open_only=False):
+
+        """
+        Get one page of the checkouts, in the order they were made.
+
+        Args:
+        cursor (str, optional): The `next_cursor` of the previous page. Defaults to None, for the first page.
+        limit (int, optional): The maximum number of checkouts on the page. Defaults to 20.
+        user_id (str, optional): Only list the checkouts of this user. Defaults to None.
+        isbn (str, optional): Only list the checkouts of this book. Defaults to None.
+        open_only (bool, optional): Only list checkouts that were not checked in yet. Defaults to False.
+
+        Returns:
+        Page: The checkouts on the page and the cursor of the next page, which is None on the last page.
+
+        Raises:
+        ValueError: If the cursor is invalid, or was issued before `archive` moved checkouts out of memory.
+
+        Filtering by user or book reads the user and ISBN indexes, so it only visits the matching checkouts.
+        Archived checkouts are not included.
+        """
+
+        position = paging.decode_cursor(cursor, 'checkouts')
+        self._ensure_indexed()
+        with self._lock.read():
+            if position is None:
+                last = -1
+            elif position[0] != self._epoch:
+                raise ValueError("The cursor expired when the checkouts were archived")
+            else:
+                last = position[1]
+            if user_id is not None:
+                rows = self._checkouts_by_user.get(user_id, ())
+            elif isbn is not None:
+                rows = self._checkouts_by_isbn.get(isbn, ())
+            else:
+                rows = range(len(self.checkouts))
+            checkouts = self.checkouts
+            epoch = self._epoch
+            candidates = (((epoch, rows[index]), checkouts[rows[index]])
+                          for index in range(bisect.bisect_right(rows, last), len(rows)))
+
+            def predicate(checkout):
+                return ((not open_only or checkout.checkin_date is None)
+                        and (user_id is None or checkout.user.user_id == user_id)
+                        and (isbn is None or checkout.book.isbn == isbn))
+
+            return paging.page(candidates, limit, 'checkouts', predicate)
+
+    def iter_checkouts(self, user_id=None, isbn=None, open_only=False, page_size=1000):
+
+        """
+        Yield the checkouts with the filters of `page_checkouts`, fetching them a page at a time.
+        """
+
+        return paging.iterate(lambda cursor, limit: self.page_checkouts(cursor, limit, user_id, isbn, open_only),
+                              page_size)
+
     def get_checkout(self, user, book):
 
         """
@@ -102,31 +228,41 @@ class CheckoutManager:
         Returns:
         Checkout: The checkout object if found, otherwise None.
 
-        This method iterates through the list of checkouts and returns the first checkout object where the user and book match.
-        If no matching checkout is found, it returns None.
+        Users and books are matched by user ID and ISBN. The open checkout is returned if there is one,
+        otherwise the first checkout of the book by the user. If no matching checkout is found, it returns None.
         """
         
-        for checkout in self.checkouts:
-            if checkout.user == user and checkout.book == book:
-                return checkout
+        self._ensure_indexed()
+        with self._lock.read():
+            row = self._open_checkouts.get(user.user_id, {}).get(book.isbn)
+            if row is not None:
+                return self.checkouts[row]
+            for row in self._checkouts_by_user.get(user.user_id, []):
+                checkout = self.checkouts[row]
+                if checkout.book.isbn == book.isbn:
+                    return checkout
         return None
     
-    def get_user_history(self, user):
+    def get_user_history(self, user, include_archive=False):
          
         """
         Get the checkout and checkin history for a user.
 
         Args:
         user (User): The user for whom the history is being searched.
+        include_archive (bool, optional): Also read the checkouts that `archive` moved to the storage's
+        monthly segments. Defaults to False, which only returns the checkouts kept in memory.
 
         Returns:
         A list of all the checkouts made by the user, including both checkout and checkin dates.
+        Archived checkouts come first.
         """
          
-        history = []
-        for checkout in self.checkouts:
-            if checkout.user == user:
-                history.append(checkout)
+        self._ensure_indexed()
+        with self._lock.read():
+            history = [self.checkouts[row] for row in self._checkouts_by_user.get(user.user_id, [])]
+        if include_archive:
+            return self._with_archive(history, user_id=user.user_id)
         return history
 
     def get_current_checkouts(self, user):
@@ -141,8 +277,146 @@ class CheckoutManager:
         A list of all the current checkouts made by the user, where the checkin_date is None.
         """
 
-        current_checkouts = []
-        for checkout in self.checkouts:
-            if checkout.user == user and checkout.checkin_date is None:
-                current_checkouts.append(checkout)
-        return current_checkouts
\ No newline at end of file
+        self._ensure_indexed()
+        with self._lock.read():
+            return [self.checkouts[row] for row in self._open_checkouts.get(user.user_id, {}).values()]
+
+    def get_book_history(self, book, include_archive=False):
+
+        """
+        Get the checkout and checkin history for a book.
+
+        Args:
+        book (Book): The book for which the history is being searched.
+        include_archive (bool, optional): Also read the archived checkouts, as in `get_user_history`. Defaults to False.
+
+        Returns:
+        A list of all the checkouts of the book, including both checkout and checkin dates.
+        Archived checkouts come first.
+        """
+
+        self._ensure_indexed()
+        with self._lock.read():
+            history = [self.checkouts[row] for row in self._checkouts_by_isbn.get(book.isbn, [])]
+        if include_archive:
+            return self._with_archive(history, isbn=book.isbn)
+        return history
+
+    def archive(self, before=None):
+
+        """
+        Move the checkouts that were checked in before `before` to the storage's monthly archive segments.
+
+        Open loans and recent checkins stay in memory and in the checkout file, so the file that every
+        checkout and checkin rewrites no longer grows with the whole history. Checkouts and checkins wait
+        while the archive is written.
+
+        Args:
+        before (datetime, optional): Defaults to the start of the current month, so only completed months are archived.
+
+        Returns:
+        int: The number of checkouts that were archived.
+        """
+
+        if before is None:
+            before = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        with self._book_locks.all(), self._lock.write():
+            remaining = self.storage.archive_checkouts(self.checkouts, before)
+            archived = len(self.checkouts) - len(remaining)
+            if archived:
+                self.checkouts = CheckoutTable(remaining) if isinstance(self.checkouts, CheckoutTable) else remaining
+                self._build_indexes()
+                self._epoch += 1
+        return archived
+
+    def circulation_report(self, include_archive=False, now=None):
+
+        """
+        Build a report of overdue loans, circulation counts and loan durations (see reports.py).
+
+        Args:
+        include_archive (bool, optional): Also count the checkouts that `archive` moved to the storage's
+        monthly segments. Defaults to False.
+        now (datetime, optional): The time overdue loans are measured against. Defaults to the current time.
+
+        Returns:
+        CirculationReport: A report over a copy of the checkouts, taken under the read lock.
+
+        With a columnar manager the report copies the table's columns, which takes milliseconds even for
+        millions of checkouts; otherwise the checkouts are first copied into a `CheckoutTable`.
+        """
+
+        # Imported here so that startup does not pay for importing NumPy.
+        from reports import CirculationReport
+        with self._lock.read():
+            if include_archive:
+                archived = self.storage.iter_archived_checkouts(self.book_manager.get_book_by_isbn,
+                                                               self.user_manager.get_user_by_id)
+                table = CheckoutTable(itertools.chain(archived, self.checkouts))
+            elif isinstance(self.checkouts, CheckoutTable):
+                table = self.checkouts
+            else:
+                table = CheckoutTable(self.checkouts)
+            return CirculationReport.from_table(table, now)
+
+    def _with_archive(self, history, user_id=None, isbn=None):
+
+        """
+        Prepends the matching archived checkouts to `history`. A checkout archived after `history` was
+        read is found in both and kept once.
+        """
+
+        archived = list(self.storage.iter_archived_checkouts(
+            self.book_manager.get_book_by_isbn, self.user_manager.get_user_by_id, user_id=user_id, isbn=isbn))
+        keys = {(checkout.user.user_id, checkout.book.isbn, checkout.checkout_date) for checkout in archived}
+        return archived + [checkout for checkout in history
+                           if (checkout.user.user_id, checkout.book.isbn, checkout.checkout_date) not in keys]
+
+    def _ensure_indexed(self):
+
+        """
+        Builds the indexes on first use. Must be called before taking `self._lock`.
+        """
+
+        if self._indexed:
+            return
+        with self._lock.write():
+            if not self._indexed:
+                self._build_indexes()
+
+    def _build_indexes(self):
+
+        """
+        Indexes every checkout from scratch. The caller holds the write lock.
+        """
+
+        self._checkouts_by_user = {}
+        self._checkouts_by_isbn = {}
+        self._open_checkouts = {}
+        if isinstance(self.checkouts, CheckoutTable):
+            rows = self.checkouts.index_rows()
+        else:
+            rows = ((row, checkout.user.user_id, checkout.book.isbn, checkout.checkin_date is None)
+                    for row, checkout in enumerate(self.checkouts))
+        for row, user_id, isbn, is_open in rows:
+            self._index_row(row, user_id, isbn, is_open)
+        self._indexed = True
+
+    def _index_checkout(self, row, checkout):
+        self._index_row(row, checkout.user.user_id, checkout.book.isbn, checkout.checkin_date is None)
+
+    def _index_row(self, row, user_id, isbn, is_open):
+        for index, key in ((self._checkouts_by_user, user_id), (self._checkouts_by_isbn, isbn)):
+            rows = index.get(key)
+            if rows is None:
+                rows = index[key] = array('l')
+            rows.append(row)
+        if is_open:
+            self._open_checkouts.setdefault(user_id, {})[isbn] = row
+
+    def _close_checkout(self, checkout):
+        user_id = checkout.user.user_id
+        open_checkouts = self._open_checkouts.get(user_id, {})
+        open_checkouts.pop(checkout.book.isbn, None)
+        if not open_checkouts:
+            self._open_checkouts.pop(user_id, None)
\ No newline at end of file
@@ -0,0 +1,133 @@
+# checkout_table.py
+
+from array import array
+import datetime
+from models import Checkout
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NO_DATE = -(1 << 63)
+
+def to_micros(date):
+
+    """
+    Converts a naive datetime into microseconds since 1970-01-01, or NO_DATE for None.
+    """
+
+    if date is None:
+        return NO_DATE
+    return (date - EPOCH) // datetime.timedelta(microseconds=1)
+
+def from_micros(micros):
+
+    """
+    Converts microseconds since 1970-01-01 back into a naive datetime, or None for NO_DATE.
+    """
+
+    if micros == NO_DATE:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+class CheckoutTable:
+
+    """
+    A columnar, array-backed list of checkouts.
+
+    Each checkout takes one slot in four typed arrays: the index of its user, the index of its book,
+    and the checkout and checkin timestamps as int64 microseconds. Users and books are stored once each.
+    Reading an item builds a `Checkout` object on the fly and assigning an item writes it back, so the
+    table can stand in for a list of `Checkout` objects, e.g. as `CheckoutManager.checkouts`.
+    """
+
+    def __init__(self, checkouts=()):
+
+        """
+        Initializes the table, optionally filled with the given checkouts.
+
+        Args:
+            checkouts (iterable, optional): `Checkout` objects to append.
+        """
+
+        self._users = []
+        self._user_slots = {}
+        self._books = []
+        self._book_slots = {}
+        self._user_column = array('l')
+        self._book_column = array('l')
+        self._checkout_column = array('q')
+        self._checkin_column = array('q')
+        for checkout in checkouts:
+            self.append(checkout)
+
+    def __len__(self):
+        return len(self._user_column)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def __getitem__(self, row):
+        checkout = Checkout(self._users[self._user_column[row]], self._books[self._book_column[row]])
+        checkout.checkout_date = from_micros(self._checkout_column[row])
+        checkout.checkin_date = from_micros(self._checkin_column[row])
+        return checkout
+
+    def __setitem__(self, row, checkout):
+        self._user_column[row] = self._user_slot(checkout.user)
+        self._book_column[row] = self._book_slot(checkout.book)
+        self._checkout_column[row] = to_micros(checkout.checkout_date)
+        self._checkin_column[row] = to_micros(checkout.checkin_date)
+
+    def append(self, checkout):
+
+        """
+        Appends a checkout to the table.
+
+        Args:
+            checkout (Checkout): The checkout to append.
+        """
+
+        self._user_column.append(self._user_slot(checkout.user))
+        self._book_column.append(self._book_slot(checkout.book))
+        self._checkout_column.append(to_micros(checkout.checkout_date))
+        self._checkin_column.append(to_micros(checkout.checkin_date))
+
+    def columns(self):
+
+        """
+        Returns copies of the user slot, book slot, checkout time and checkin time columns, for vectorized
+        passes over the whole table. Slots are resolved with `user` and `book`; times are as in `to_micros`.
+        """
+
+        return self._user_column[:], self._book_column[:], self._checkout_column[:], self._checkin_column[:]
+
+    def user(self, slot):
+        return self._users[slot]
+
+    def book(self, slot):
+        return self._books[slot]
+
+    def index_rows(self):
+
+        """
+        Yields the row, user ID, ISBN and open status of every checkout without building `Checkout` objects.
+        """
+
+        users = self._users
+        books = self._books
+        for row, (user_slot, book_slot, checkin) in enumerate(
+                zip(self._user_column, self._book_column, self._checkin_column)):
+            yield row, users[user_slot].user_id, books[book_slot].isbn, checkin == NO_DATE
+
+    def _user_slot(self, user):
+        slot = self._user_slots.get(user.user_id)
+        if slot is None:
+            slot = self._user_slots[user.user_id] = len(self._users)
+            self._users.append(user)
+        return slot
+
+    def _book_slot(self, book):
+        slot = self._book_slots.get(book.isbn)
+        if slot is None:
+            slot = self._book_slots[book.isbn] = len(self._books)
+            self._books.append(book)
+        return slot
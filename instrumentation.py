@@ -0,0 +1,300 @@
+# instrumentation.py
+"""
+Per-operation timings and storage I/O counters.
+
+`enable()` wraps every public method of the managers and the load, save, put, remove and flush
+methods of the storages, as well as their commits, which write the files of a transaction. Each call is counted and its duration added to a latency histogram;
+storage calls also record the bytes read and written by the files they touch. `disable()` puts the
+original methods back, so instrumentation costs nothing while it is off.
+
+    import instrumentation
+    instrumentation.enable()
+    ...
+    print(instrumentation.summary())
+    instrumentation.write('metrics.prom')   # or metrics.json
+
+Operations are named `<class>.<method>` after the class of the instance, e.g. `JournaledStorage.load_books`.
+SQLite does its own I/O, so `SQLiteStorage` calls report timings but no bytes.
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in seconds; the last bucket is unbounded.
+BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+STORAGE_PREFIXES = ('load_', 'save_', 'put_', 'remove_', 'flush', 'compact', 'import_from')
+
+class Metrics:
+
+    """
+    Call counts, latency histograms and I/O byte counters, keyed by operation name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._io = threading.local()
+        self.reset()
+
+    def reset(self):
+
+        """
+        Clears every recorded value.
+        """
+
+        with self._lock:
+            self.operations = {}
+
+    def record(self, name, seconds, bytes_read=0, bytes_written=0):
+
+        """
+        Records one call of `name` that took `seconds`.
+        """
+
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+        with self._lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = {
+                    'count': 0, 'seconds': 0.0, 'buckets': [0] * (len(BUCKETS) + 1), 'bytes_read': 0, 'bytes_written': 0}
+            operation['count'] += 1
+            operation['seconds'] += seconds
+            operation['buckets'][bucket] += 1
+            operation['bytes_read'] += bytes_read
+            operation['bytes_written'] += bytes_written
+
+    def count_io(self, bytes_read=0, bytes_written=0):
+
+        """
+        Adds file I/O to the storage call running on this thread.
+        """
+
+        self._io.read = getattr(self._io, 'read', 0) + bytes_read
+        self._io.written = getattr(self._io, 'written', 0) + bytes_written
+
+    def io_counters(self):
+        return getattr(self._io, 'read', 0), getattr(self._io, 'written', 0)
+
+    def snapshot(self):
+
+        """
+        Returns the recorded values as a JSON serializable dictionary.
+
+        Returns:
+            dict: Per operation the call count, total and mean seconds, estimated p50 and p99 seconds
+            (the upper bound of the bucket they fall in), bytes read and written, and the histogram.
+        """
+
+        with self._lock:
+            operations = {name: dict(operation, buckets=list(operation['buckets']))
+                          for name, operation in self.operations.items()}
+        result = {}
+        for name, operation in sorted(operations.items()):
+            count = operation['count']
+            result[name] = {
+                'count': count,
+                'seconds': round(operation['seconds'], 9),
+                'mean_seconds': round(operation['seconds'] / count, 9),
+                'p50_seconds': self._quantile(operation['buckets'], count, 0.5),
+                'p99_seconds': self._quantile(operation['buckets'], count, 0.99),
+                'bytes_read': operation['bytes_read'],
+                'bytes_written': operation['bytes_written'],
+                'buckets': {str(bound): value for bound, value in zip(BUCKETS + ('+Inf',), operation['buckets'])},
+            }
+        return result
+
+    def _quantile(self, buckets, count, quantile):
+        seen = 0
+        for bound, value in zip(BUCKETS + (None,), buckets):
+            seen += value
+            if seen >= quantile * count:
+                return bound
+        return None
+
+    def to_prometheus(self):
+
+        """
+        Returns the recorded values in the Prometheus text exposition format.
+        """
+
+        lines = [
+            '# HELP library_operation_seconds Duration of manager and storage operations.',
+            '# TYPE library_operation_seconds histogram',
+        ]
+        snapshot = self.snapshot()
+        for name, operation in snapshot.items():
+            cumulative = 0
+            for bound, value in operation['buckets'].items():
+                cumulative += value
+                lines.append(f'library_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'library_operation_seconds_sum{{operation="{name}"}} {operation["seconds"]}')
+            lines.append(f'library_operation_seconds_count{{operation="{name}"}} {operation["count"]}')
+        for metric, key, help_text in (('library_storage_bytes_read_total', 'bytes_read', 'Bytes read by storage operations.'),
+                                       ('library_storage_bytes_written_total', 'bytes_written', 'Bytes written by storage operations.')):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, operation in snapshot.items():
+                if operation['bytes_read'] or operation['bytes_written']:
+                    lines.append(f'{metric}{{operation="{name}"}} {operation[key]}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+_originals = []
+
+def _timed(function, io=False, name=None):
+
+    """
+    Wraps `function` so that every call is recorded under `<class of self>.<name>`.
+    """
+
+    name = name or function.__name__
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        if io:
+            read_before, written_before = metrics.io_counters()
+        start = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if io:
+                read_after, written_after = metrics.io_counters()
+                metrics.record(f"{type(self).__name__}.{name}", seconds,
+                               read_after - read_before, written_after - written_before)
+            else:
+                metrics.record(f"{type(self).__name__}.{name}", seconds)
+    return wrapper
+
+def _counting_read(function):
+
+    """
+    Wraps a storage's `_read_rows` to count the bytes of the files it reads.
+    """
+
+    @functools.wraps(function)
+    def wrapper(self, data_file):
+        paths = [data_file]
+        if hasattr(self, '_journal_file'):
+            paths.append(self._journal_file(data_file))
+        metrics.count_io(bytes_read=sum(os.path.getsize(path) for path in paths if os.path.exists(path)))
+        return function(self, data_file)
+    return wrapper
+
+def _counting_write(function):
+
+    """
+    Wraps a storage's `_write_temp` to count the bytes of the file it writes.
+    """
+
+    @functools.wraps(function)
+    def wrapper(self, data_file, rows):
+        temp_file = function(self, data_file, rows)
+        metrics.count_io(bytes_written=os.path.getsize(temp_file))
+        return temp_file
+    return wrapper
+
+def _counting_append(function):
+
+    """
+    Wraps a storage's `_append_lines` to count the bytes it appends.
+    """
+
+    @functools.wraps(function)
+    def wrapper(self, path, lines):
+        metrics.count_io(bytes_written=len(lines.encode()))
+        return function(self, path, lines)
+    return wrapper
+
+def _patch(cls, name, wrapper):
+    _originals.append((cls, name, cls.__dict__[name]))
+    setattr(cls, name, wrapper)
+
+def is_enabled():
+    return bool(_originals)
+
+def enable():
+
+    """
+    Starts recording. Calling it again while enabled does nothing.
+    """
+
+    if _originals:
+        return
+    from book import BookManager
+    from catalog import DiskBookManager
+    from check import CheckoutManager
+    from user import UserManager
+    from sqlite_storage import SQLiteStorage
+    from storage import JournaledStorage, Storage
+
+    for cls in (BookManager, DiskBookManager, UserManager, CheckoutManager):
+        for name, value in list(vars(cls).items()):
+            if inspect.isfunction(value) and not name.startswith('_'):
+                _patch(cls, name, _timed(value))
+    # Only methods a class defines itself are wrapped, so an inherited method is not timed twice.
+    for cls in (Storage, JournaledStorage, SQLiteStorage):
+        for name, value in list(vars(cls).items()):
+            if inspect.isfunction(value) and name.startswith(STORAGE_PREFIXES):
+                _patch(cls, name, _timed(value, io=True))
+    # Transactions and write-behind flushes write their files when they commit.
+    _patch(Storage, '_commit', _timed(Storage.__dict__['_commit'], io=True, name='commit'))
+    _patch(Storage, '_read_rows', _counting_read(Storage.__dict__['_read_rows']))
+    _patch(Storage, '_write_temp', _counting_write(Storage.__dict__['_write_temp']))
+    _patch(Storage, '_append_lines', _counting_append(Storage.__dict__['_append_lines']))
+
+def disable():
+
+    """
+    Stops recording and restores the original methods. Recorded values are kept.
+    """
+
+    while _originals:
+        cls, name, original = _originals.pop()
+        setattr(cls, name, original)
+
+def reset():
+    metrics.reset()
+
+def snapshot():
+    return metrics.snapshot()
+
+def to_prometheus():
+    return metrics.to_prometheus()
+
+def write(path):
+
+    """
+    Writes the recorded values to `path`: JSON if it ends in `.json`, otherwise Prometheus text.
+
+    Args:
+        path (str): The file to write.
+
+    Returns:
+        None
+    """
+
+    with open(path, 'w') as file:
+        if path.endswith('.json'):
+            json.dump({'enabled': is_enabled(), 'operations': snapshot()}, file, indent=4)
+        else:
+            file.write(to_prometheus())
+
+def summary():
+
+    """
+    Returns a table of the recorded operations for printing.
+    """
+
+    rows = [f"{'operation':<44}{'calls':>8}{'mean ms':>10}{'p99 ms':>10}{'read KiB':>10}{'written KiB':>12}"]
+    for name, operation in snapshot().items():
+        p99 = operation['p99_seconds']
+        rows.append(f"{name:<44}{operation['count']:>8}{operation['mean_seconds'] * 1000:>10.3f}"
+                    f"{(f'{p99 * 1000:.3f}' if p99 is not None else '>5000'):>10}"
+                    f"{operation['bytes_read'] / 1024:>10.1f}{operation['bytes_written'] / 1024:>12.1f}")
+    return '\n'.join(rows)
@@ -0,0 +1,101 @@
+# locks.py
+
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+
+    """
+    A lock that many readers can hold at once, or a single writer.
+
+    Once a writer is waiting, new readers wait too, so a steady stream of readers cannot starve it.
+    The lock is not re-entrant: a thread must not acquire it again while holding it.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+
+        """
+        Holds the lock shared for the duration of the `with` block.
+        """
+
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+
+        """
+        Holds the lock exclusively for the duration of the `with` block.
+        """
+
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+class StripedLock:
+
+    """
+    A fixed set of locks shared by many keys.
+
+    Each key maps to one of `stripes` locks by its hash, so operations on different keys usually
+    take different locks and run in parallel, while operations on the same key are serialized.
+    """
+
+    def __init__(self, stripes=64):
+
+        """
+        Initializes the locks.
+
+        Args:
+            stripes (int, optional): The number of locks. Defaults to 64.
+        """
+
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+
+        """
+        Returns the lock that guards `key`.
+        """
+
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def all(self):
+
+        """
+        Holds every lock, taken in a fixed order, for the duration of the `with` block.
+        """
+
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
@@ -1,16 +1,172 @@
 # main.py
 from book import BookManager
+from catalog import DiskBookManager
 from user import UserManager
 from check import CheckoutManager
-from storage import Storage
+import argparse
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+import os
+import shlex
+import sys
+import time
+import traceback
+import instrumentation
+from storage import JournaledStorage, convert_file
 from models import Book, User
+from paging import Page
 
-storage = Storage('books.json', 'users.json', 'checkouts.json')
+# Nothing is opened or loaded at import time. The storage and each manager are built on first use,
+# so a session only parses the data files it actually touches.
+_storage = None
+_book_manager = None
+_user_manager = None
+_checkout_manager = None
 
-book_manager = BookManager(storage)
-user_manager = UserManager(storage)
-checkout_manager = CheckoutManager(storage,book_manager)
+def get_storage():
 
+    """
+    Returns the storage, creating it on first use.
+
+    Set LIBRARY_DB to the path of a SQLite database to use it instead of the JSON files,
+    or LIBRARY_FORMAT=jsonl to use JSON Lines files (books.jsonl, users.jsonl, checkouts.jsonl),
+    or LIBRARY_FORMAT=snap to use memory-mapped binary snapshots (books.snap, users.snap, checkouts.snap).
+    Set LIBRARY_FLUSH_INTERVAL to a number of seconds to write changes to the JSON files in the
+    background (write-behind mode) instead of on every change.
+    """
+
+    global _storage
+    if _storage is None:
+        if os.environ.get('LIBRARY_DB'):
+            from sqlite_storage import SQLiteStorage
+            _storage = SQLiteStorage(os.environ['LIBRARY_DB'])
+        else:
+            extension = os.environ.get('LIBRARY_FORMAT', 'json')
+            _storage = JournaledStorage(f'books.{extension}', f'users.{extension}', f'checkouts.{extension}')
+            if os.environ.get('LIBRARY_FLUSH_INTERVAL'):
+                _storage.enable_write_behind(flush_interval=float(os.environ['LIBRARY_FLUSH_INTERVAL']))
+    return _storage
+
+def get_book_manager():
+
+    """
+    Returns the BookManager, loading the books on first use.
+
+    With LIBRARY_DB set, set LIBRARY_BOOK_CACHE to a number of books to keep the catalog on disk
+    instead: a `DiskBookManager` then holds only that many books in memory.
+    """
+
+    global _book_manager
+    if _book_manager is None:
+        if os.environ.get('LIBRARY_DB') and os.environ.get('LIBRARY_BOOK_CACHE'):
+            _book_manager = DiskBookManager(get_storage(), cache_size=int(os.environ['LIBRARY_BOOK_CACHE']))
+        else:
+            _book_manager = BookManager(get_storage())
+    return _book_manager
+
+def get_user_manager():
+
+    """
+    Returns the UserManager, loading the users on first use.
+    """
+
+    global _user_manager
+    if _user_manager is None:
+        _user_manager = UserManager(get_storage())
+    return _user_manager
+
+def get_checkout_manager():
+
+    """
+    Returns the CheckoutManager, loading the checkouts (and the books and users they refer to) on first use.
+    """
+
+    global _checkout_manager
+    if _checkout_manager is None:
+        # Snapshots are mapped into a columnar table rather than decoded into Checkout objects.
+        columnar = os.environ.get('LIBRARY_FORMAT') == 'snap' and not os.environ.get('LIBRARY_DB')
+        _checkout_manager = CheckoutManager(get_storage(), get_book_manager(), get_user_manager(), columnar=columnar)
+    return _checkout_manager
+
+def refresh_managers():
+
+    """
+    Drops the managers whose data another process changed, so they are reloaded on next use.
+
+    Pending write-behind changes are flushed first, merged into the files if needed.
+    """
+
+    global _book_manager, _user_manager, _checkout_manager
+    if _storage is None:
+        return
+    _storage.flush()
+    stale = _storage.stale_collections()
+    if 'books' in stale:
+        _book_manager = None
+    if 'users' in stale:
+        _user_manager = None
+    if stale:
+        # Checkouts refer to the book and user objects, so they are reloaded along with either.
+        _checkout_manager = None
+
+def close_storage():
+
+    """
+    Closes the storage if it was ever opened.
+    """
+
+    if _storage is not None:
+        _storage.close()
+
+
+# The number of records the listings print before asking whether to show more.
+PAGE_SIZE = 20
+
+def show_pages(heading, fetch, empty_message):
+
+    """
+    Prints a listing one page at a time, asking before each further page.
+
+    Args:
+        heading (str): Printed above the first page.
+        fetch (callable): Called as `fetch(cursor, limit)` and returns a `paging.Page`.
+        empty_message (str): Printed instead if the listing is empty.
+
+    Returns:
+        None
+    """
+
+    page = fetch(None, PAGE_SIZE)
+    if not page.items:
+        print(empty_message)
+        return
+    print(heading)
+    while True:
+        for item in page.items:
+            print(item)
+        if page.next_cursor is None:
+            return
+        if input("Press Enter for more, or q to stop: ").strip().lower() == 'q':
+            return
+        page = fetch(page.next_cursor, PAGE_SIZE)
+
+def ask_sort(choices):
+
+    """
+    Asks for one of `choices` to sort a listing by, the first being the default.
+
+    Returns:
+        str: The chosen sort order, or None if the answer is not one of `choices`.
+    """
+
+    sort = input(f"Sort by ({', '.join(choices)}) [{choices[0]}]: ").strip().lower() or choices[0]
+    if sort not in choices:
+        print("Invalid sort order.")
+        return None
+    return sort
 
 def main_menu():
 
@@ -26,7 +182,9 @@ def main_menu():
     print("1. Book Management")
     print("2. User Management")
     print("3. Checkout Management")
-    print("4. Exit")
+    print("4. Reports")
+    print("5. Metrics")
+    print("6. Exit")
     choice = input("Enter choice: ")
     return choice
 
@@ -45,6 +203,7 @@ def book_management():
 
     """
 
+    book_manager = get_book_manager()
     while True:
         print("\nBook Management")
         print("1. Add Book")
@@ -54,6 +213,9 @@ def book_management():
         print("5. Search Books")
         print("6. Back to Main Menu")
         choice = input("Enter choice: ")
+        # Another session may have changed the data while this menu waited for input.
+        refresh_managers()
+        book_manager = get_book_manager()
 
         if choice == '1':
             title = input("Enter title: ")
@@ -73,13 +235,11 @@ def book_management():
             book_manager.delete_book(isbn)
             # print("Book deleted.")
         elif choice == '4':
-            books = book_manager.list_books()
-            if books:
-                print("Books:")
-                for book in books:
-                    print(book)
-            else:
-                print("No books found.")
+            sort = ask_sort(('catalog', 'title', 'author', 'isbn'))
+            if sort:
+                available = True if input("Only available books? (y/N): ").strip().lower() == 'y' else None
+                show_pages("Books:", lambda cursor, limit: book_manager.page_books(cursor, limit, sort, available),
+                           "No books found.")
         elif choice == '5':
             title = input("Enter title (leave blank for all): ")
             author = input("Enter author (leave blank for all): ")
@@ -89,6 +249,15 @@ def book_management():
                 print("Books:")
                 for book in books:
                     print(book)
+            elif (title or author) and hasattr(book_manager, 'fuzzy_search_books'):
+                # Nothing matched exactly: the query may be misspelled, so show the closest books instead.
+                matches = book_manager.fuzzy_search_books(f"{title} {author}")
+                if matches:
+                    print("No exact matches. Closest books:")
+                    for book, score in matches:
+                        print(f"{score:.0%} {book}")
+                else:
+                    print("No books found.")
             else:
                 print("No books found.")
         elif choice == '6':
@@ -111,6 +280,7 @@ def user_management():
 
     """
 
+    user_manager = get_user_manager()
     while True:
         print("\nUser Management")
         print("1. Add User")
@@ -120,6 +290,9 @@ def user_management():
         print("5. Search Users")
         print("6. Back to Main Menu")
         choice = input("Enter choice: ")
+        # Another session may have changed the data while this menu waited for input.
+        refresh_managers()
+        user_manager = get_user_manager()
 
         if choice == '1':
             name = input("Enter user name: ")
@@ -137,13 +310,11 @@ def user_management():
             user_manager.delete_user(user_id)
             print("User deleted.")
         elif choice == '4':
-            users = user_manager.list_users()
-            if users:
-                print("Users:")
-                for user in users:
-                    print(user)
-            else:
-                print("No users found.")
+            sort = ask_sort(('catalog', 'name', 'user_id'))
+            if sort:
+                name = input("Only names containing (leave blank for all): ")
+                show_pages("Users:", lambda cursor, limit: user_manager.page_users(cursor, limit, sort, name or None),
+                           "No users found.")
         elif choice == '5':
             name = input("Enter name (leave blank for all): ")
             user_id = input("Enter user ID (leave blank for all): ")
@@ -174,6 +345,9 @@ def checkout_management():
 
     """
      
+    book_manager = get_book_manager()
+    user_manager = get_user_manager()
+    checkout_manager = get_checkout_manager()
     while True:
         print("\nCheckout Management")
         print("1. Checkout Book")
@@ -181,6 +355,11 @@ def checkout_management():
         print("3. List Checkouts")
         print("4. Back to Main Menu")
         choice = input("Enter choice: ")
+        # Another session may have changed the data while this menu waited for input.
+        refresh_managers()
+        book_manager = get_book_manager()
+        user_manager = get_user_manager()
+        checkout_manager = get_checkout_manager()
 
         if choice == '1':
             user_id = input("Enter user ID: ")
@@ -209,24 +388,518 @@ def checkout_management():
             else:
                 print("User not found.")
         elif choice == '3':
-            checkouts = checkout_manager.list_checkouts()
-            if checkouts:
-                print("Checkouts:")
-                for checkout in checkouts:
-                    print(checkout)
+            user_id = input("Enter user ID (leave blank for all): ")
+            open_only = input("Only open checkouts? (y/N): ").strip().lower() == 'y'
+            show_pages("Checkouts:",
+                       lambda cursor, limit: checkout_manager.page_checkouts(cursor, limit, user_id or None, open_only=open_only),
+                       "No checkouts found.")
+        elif choice == '4':
+            break
+        else:
+            print("Invalid choice, please try again.")
+
+def pages_of(items):
+
+    """
+    Returns a `fetch` function for `show_pages` that pages through a list already in memory.
+    """
+
+    def fetch(cursor, limit):
+        start = int(cursor or 0)
+        end = start + limit
+        return Page(items[start:end], str(end) if end < len(items) else None)
+
+    return fetch
+
+def ask_number(prompt, default):
+
+    """
+    Asks for a positive whole number, returning `default` for a blank answer and None for an invalid one.
+    """
+
+    answer = input(f"{prompt} [{default}]: ").strip()
+    if not answer:
+        return default
+    try:
+        number = int(answer)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        print("Please enter a positive number.")
+        return None
+    return number
+
+def report_menu():
+
+    """
+    This function provides a menu of circulation reports (see reports.py).
+
+    Every report is computed from a fresh copy of the checkouts. Set LIBRARY_LOAN_DAYS to change the
+    loan period that overdue loans are measured against (14 days by default).
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    """
+
+    checkout_manager = get_checkout_manager()
+    loan_days = float(os.environ.get('LIBRARY_LOAN_DAYS', 14))
+    while True:
+        print("\nReports")
+        print("1. Summary")
+        print("2. Overdue Loans")
+        print("3. Most Borrowed Books")
+        print("4. Most Active Users")
+        print("5. Loan Durations")
+        print("6. Back to Main Menu")
+        choice = input("Enter choice: ")
+        # Another session may have changed the data while this menu waited for input.
+        refresh_managers()
+        checkout_manager = get_checkout_manager()
+
+        if choice == '1':
+            summary = checkout_manager.circulation_report().summary(loan_days)
+            print(f"Checkouts: {summary['checkouts']}")
+            print(f"Open loans: {summary['open']}")
+            print(f"Overdue loans (over {loan_days:g} days): {summary['overdue']}")
+            print(f"Users who borrowed: {summary['users']}")
+            print(f"Books borrowed: {summary['books']}")
+        elif choice == '2':
+            overdue = checkout_manager.circulation_report().overdue(loan_days)
+            show_pages(f"Overdue loans (over {loan_days:g} days):",
+                       pages_of([f"{days:.1f} days overdue: {checkout}" for checkout, days in overdue]),
+                       "No overdue loans.")
+        elif choice in ('3', '4'):
+            top = ask_number("How many", 10)
+            if top:
+                report = checkout_manager.circulation_report()
+                if choice == '3':
+                    ranking = report.circulation_by_book(top)
+                else:
+                    ranking = report.circulation_by_user(top)
+                if ranking:
+                    for rank, (record, count) in enumerate(ranking, 1):
+                        print(f"{rank}. {record} - {count} checkouts")
+                else:
+                    print("No checkouts found.")
+        elif choice == '5':
+            durations = checkout_manager.circulation_report().loan_duration_percentiles()
+            if durations:
+                for percentile, days in durations.items():
+                    print(f"{percentile}th percentile: {days:.1f} days")
+            else:
+                print("No books have been checked in yet.")
+        elif choice == '6':
+            break
+        else:
+            print("Invalid choice, please try again.")
+
+def metrics_menu():
+
+    """
+    This function provides a menu for the built-in instrumentation (see instrumentation.py).
+
+    It shows the call counts, latencies and storage I/O recorded so far and the search cache hit rates, turns recording on or off,
+    and writes the values to a JSON or Prometheus text file.
+
+    Args:
+        None
+
+    Returns:
+        None
+
+    """
+
+    while True:
+        print("\nMetrics (recording is " + ("on" if instrumentation.is_enabled() else "off") + ")")
+        print("1. Show Metrics")
+        print("2. Turn Recording On/Off")
+        print("3. Reset Metrics")
+        print("4. Write Metrics to File")
+        print("5. Back to Main Menu")
+        choice = input("Enter choice: ")
+
+        if choice == '1':
+            print(instrumentation.summary())
+            for name, manager in (('Book', _book_manager), ('User', _user_manager)):
+                if manager is not None and hasattr(manager, 'search_cache'):
+                    stats = manager.search_cache.stats()
+                    print(f"{name} search cache: {stats['size']}/{stats['capacity']} searches, "
+                          f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+        elif choice == '2':
+            if instrumentation.is_enabled():
+                instrumentation.disable()
             else:
-                print("No checkouts found.")
+                instrumentation.enable()
+        elif choice == '3':
+            instrumentation.reset()
         elif choice == '4':
+            path = input("Enter file name (.json for JSON, anything else for Prometheus text): ")
+            instrumentation.write(path)
+            print(f"Metrics written to {path}.")
+        elif choice == '5':
             break
         else:
             print("Invalid choice, please try again.")
 
+def read_records(path):
+
+    """
+    Stream records from a CSV file (with a header row) or a JSON Lines file, one dictionary at a time.
+
+    Args:
+        path (str): The path to a `.csv` or `.jsonl` file.
+
+    Yields:
+        dict: One record per row or line.
+    """
+
+    with open(path, 'r', newline='') as file:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def parse_available(value):
+
+    """
+    Interpret an `available` column from an import file. Missing values mean available.
+    """
+
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('false', '0', 'no', 'n')
+
+def import_records(kind, path, chunk_size=10000):
+
+    """
+    Import books or users from a CSV or JSON Lines file.
+
+    The file is read in chunks of `chunk_size` records and each chunk is added with a single
+    `add_books`/`add_users` call, so memory stays bounded and the storage is written once per chunk.
+    Records whose ISBN or user ID already exists are skipped. Progress and throughput are printed after every chunk.
+
+    Args:
+        kind (str): Either 'books' or 'users'.
+        path (str): The path to a `.csv` or `.jsonl` file.
+        chunk_size (int, optional): The number of records per chunk. Defaults to 10000.
+
+    Returns:
+        int: The number of records that were added.
+    """
+
+    if kind == 'books':
+        build = lambda data: Book(data['title'], data['author'], str(data['isbn']), parse_available(data.get('available')))
+        add = get_book_manager().add_books
+    else:
+        build = lambda data: User(data['name'], str(data['user_id']))
+        add = get_user_manager().add_users
+
+    records = read_records(path)
+    read = added = 0
+    start = time.perf_counter()
+    while True:
+        chunk = [build(data) for data in itertools.islice(records, chunk_size)]
+        if not chunk:
+            break
+        read += len(chunk)
+        added += add(chunk, skip_duplicates=True)
+        elapsed = time.perf_counter() - start
+        print(f"Read {read} {kind}, added {added} ({read / elapsed:.0f} records/s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Imported {added} of {read} {kind} in {elapsed:.2f}s, skipped {read - added} duplicates.")
+    return added
+
+def import_command(args):
+
+    """
+    Entry point for `python main.py import {books,users} FILE [--chunk-size N]`.
+
+    Args:
+        args (list): The command line arguments after `import`.
+
+    Returns:
+        None
+    """
+
+    parser = argparse.ArgumentParser(prog='main.py import', description='Bulk import books or users.')
+    parser.add_argument('kind', choices=['books', 'users'])
+    parser.add_argument('path', help='A .csv file with a header row or a .jsonl file')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    options = parser.parse_args(args)
+    try:
+        import_records(options.kind, options.path, options.chunk_size)
+    finally:
+        close_storage()
+
+def archive_command(args):
+
+    """
+    Entry point for `python main.py archive [--before YYYY-MM-DD]`, which moves the checkouts that were
+    checked in before that date (by default, before the current month) to monthly archive segments.
+
+    Args:
+        args (list): The command line arguments after `archive`.
+
+    Returns:
+        None
+    """
+
+    parser = argparse.ArgumentParser(prog='main.py archive', description='Archive checked-in checkouts by month.')
+    parser.add_argument('--before', type=datetime.datetime.fromisoformat,
+                        help='Archive checkouts checked in before this date. Defaults to the start of this month.')
+    options = parser.parse_args(args)
+    try:
+        archived = get_checkout_manager().archive(options.before)
+        print(f"Archived {archived} checkouts.")
+    finally:
+        close_storage()
+
+def convert_command(args):
+
+    """
+    Entry point for `python main.py convert SOURCE TARGET`, which converts a data file between
+    the JSON array, JSON Lines and binary snapshot formats based on the file extensions.
+
+    Args:
+        args (list): The command line arguments after `convert`.
+
+    Returns:
+        None
+    """
+
+    parser = argparse.ArgumentParser(prog='main.py convert', description='Convert a data file between .json, .jsonl and .snap.')
+    parser.add_argument('source')
+    parser.add_argument('target')
+    options = parser.parse_args(args)
+    convert_file(options.source, options.target)
+    print(f"Converted {options.source} to {options.target}.")
+
+def serve_command(args):
+
+    """
+    Entry point for `python main.py serve [--host HOST] [--port PORT | --unix PATH] [--workers N]`, which serves the
+    managers as a line-delimited JSON-RPC service (see server.py) until interrupted.
+
+    Args:
+        args (list): The command line arguments after `serve`.
+
+    Returns:
+        None
+    """
+
+    import asyncio
+    from server import LibraryService, serve
+
+    parser = argparse.ArgumentParser(prog='main.py serve', description='Serve the library over JSON-RPC.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='0 picks a free port')
+    parser.add_argument('--unix', metavar='PATH', help='Listen on a Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=4, help='Threads that run manager calls')
+    options = parser.parse_args(args)
+    service = LibraryService(get_book_manager(), get_user_manager(), get_checkout_manager())
+    try:
+        asyncio.run(serve(service, options.host, options.port, options.unix, options.workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_storage()
+
+# Short names for the service methods in batch scripts. The full names ('checkouts.checkout') work as well.
+BATCH_COMMANDS = {
+    'add-book': 'books.add',
+    'update-book': 'books.update',
+    'delete-book': 'books.delete',
+    'get-book': 'books.get',
+    'list-books': 'books.list',
+    'search-books': 'books.search',
+    'fuzzy-search-books': 'books.fuzzy_search',
+    'add-user': 'users.add',
+    'update-user': 'users.update',
+    'delete-user': 'users.delete',
+    'get-user': 'users.get',
+    'list-users': 'users.list',
+    'search-users': 'users.search',
+    'checkout': 'checkouts.checkout',
+    'checkin': 'checkouts.checkin',
+    'current-checkouts': 'checkouts.current',
+    'user-history': 'checkouts.user_history',
+    'book-history': 'checkouts.book_history',
+}
+
+def parse_batch_line(line):
+
+    """
+    Parse one line of a batch script into a command and its arguments.
+
+    A line is either a JSON object, `{"command": "checkout", "params": {"user_id": "U1", "isbn": "42"}, "id": 7}`
+    (`method` may be used instead of `command`, so JSON-RPC requests can be replayed, and `params` may be a list),
+    or words split like a shell command line: `checkout U1 42`. Words of the form `name=value` are keyword
+    arguments, `name:=json` passes a JSON value such as `limit:=5` or `available:=false`, and the others are
+    positional arguments. In shell form everything after `#` is a comment.
+
+    Args:
+    line (str): The line.
+
+    Returns:
+    tuple: `(command, args, kwargs, request_id)`, or None for a blank or comment line.
+
+    Raises:
+    ValueError: If the line is malformed.
+    """
+
+    if line.lstrip().startswith('{'):
+        request = json.loads(line)
+        command = request.get('command', request.get('method')) if isinstance(request, dict) else None
+        if not isinstance(command, str):
+            raise ValueError("A JSON command must be an object with a 'command' name")
+        params = request.get('params', {})
+        if isinstance(params, dict):
+            return command, [], params, request.get('id')
+        if isinstance(params, list):
+            return command, params, {}, request.get('id')
+        raise ValueError("params must be an object or an array")
+    words = shlex.split(line, comments=True)
+    if not words:
+        return None
+    args = []
+    kwargs = {}
+    for word in words[1:]:
+        name, separator, value = word.partition('=')
+        if separator and name.isidentifier():
+            kwargs[name] = value
+        elif separator and name.endswith(':') and name[:-1].isidentifier():
+            kwargs[name[:-1]] = json.loads(value)
+        else:
+            args.append(word)
+    return words[0], args, kwargs, None
+
+def run_batch(lines, service, storage, output, checkpoint=0, stop_on_error=False):
+
+    """
+    Run the commands of a batch script and write one JSON result per command to `output`.
+
+    Each result is a JSON object on its own line with the script `line` number, the `id` given in a JSON command,
+    the `command`, and `ok` with either the `result` or the `error` message. A rejected command (an unknown ISBN,
+    an unavailable book, a malformed line, ...) is reported and the batch goes on, unless `stop_on_error` is set.
+    So is a command that fails for any other reason, with an internal error message and a traceback on stderr.
+
+    The commands run inside storage transactions, so the data files are written once at the end, or once
+    every `checkpoint` commands, instead of once per change. A crash loses at most the commands since the
+    last checkpoint; the number of commands committed so far is printed to stderr after every checkpoint.
+    The results of a checkpoint's commands are written once they are committed, so every result in
+    `output` describes a change that was saved.
+
+    Args:
+    lines (iterable): The lines of the script.
+    service (LibraryService): Runs the commands.
+    storage (Storage): The storage of the service's managers.
+    output (file): Receives the results.
+    checkpoint (int, optional): Commit every this many commands. Defaults to 0, for once at the end.
+    stop_on_error (bool, optional): Stop at the first rejected command. Defaults to False.
+
+    Returns:
+    tuple: The number of commands run and the number of them that failed.
+    """
+
+    numbered = enumerate(lines, 1)
+    ran = failed = 0
+    done = False
+    while not done:
+        done = True
+        results = []
+        with storage.transaction():
+            for line_number, line in numbered:
+                record = {'line': line_number}
+                try:
+                    parsed = parse_batch_line(line)
+                    if parsed is None:
+                        continue
+                    command, args, kwargs, request_id = parsed
+                    if request_id is not None:
+                        record['id'] = request_id
+                    record['command'] = command
+                    handler = service.methods.get(BATCH_COMMANDS.get(command, command))
+                    if handler is None:
+                        raise LookupError(f"Unknown command: {command}")
+                    result = handler(*args, **kwargs)
+                except (LookupError, TypeError, ValueError) as error:
+                    record.update(ok=False, error=str(error))
+                    failed += 1
+                except Exception as error:
+                    # A bug or a storage failure: fail this command, not the commands before it.
+                    traceback.print_exc()
+                    record.update(ok=False, error=f"Internal error: {type(error).__name__}: {error}")
+                    failed += 1
+                else:
+                    record.update(ok=True, result=result)
+                ran += 1
+                results.append(json.dumps(record) + '\n')
+                if stop_on_error and not record['ok']:
+                    break
+                if checkpoint and ran % checkpoint == 0:
+                    done = False
+                    break
+        # In write-behind mode the transaction only groups the changes; flushing makes the checkpoint durable.
+        storage.flush()
+        output.writelines(results)
+        output.flush()
+        if not done:
+            print(f"Committed {ran} commands.", file=sys.stderr)
+    return ran, failed
+
+def batch_command(args):
+
+    """
+    Entry point for `python main.py batch [FILE] [--checkpoint N] [--stop-on-error]`, which runs a batch script
+    (see `parse_batch_line`) from FILE or stdin in one process and prints one JSON result per command.
+
+    Exits with status 1 if any command failed.
+
+    Args:
+    args (list): The command line arguments after `batch`.
+
+    Returns:
+    None
+    """
+
+    from server import LibraryService
+
+    parser = argparse.ArgumentParser(prog='main.py batch', description='Run library commands from a script or JSON Lines file.')
+    parser.add_argument('path', nargs='?', default='-', help='The script, or - for stdin (the default)')
+    parser.add_argument('--checkpoint', type=int, default=0, metavar='N',
+                        help='Commit every N commands instead of once at the end')
+    parser.add_argument('--stop-on-error', action='store_true', help='Stop at the first command that fails')
+    options = parser.parse_args(args)
+    output = sys.stdout
+    start = time.perf_counter()
+    try:
+        service = LibraryService(get_book_manager(), get_user_manager(), get_checkout_manager())
+        with contextlib.ExitStack() as stack:
+            file = sys.stdin if options.path == '-' else stack.enter_context(open(options.path, 'r'))
+            # The managers print confirmations such as "Book added successfully"; only results go to stdout.
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            ran, failed = run_batch(file, service, get_storage(), output, options.checkpoint, options.stop_on_error)
+    finally:
+        close_storage()
+    print(f"Ran {ran} commands in {time.perf_counter() - start:.2f}s, {failed} failed.", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
 def main():
-    
+
     """
     This function serves as the main entry point for the Library Management System.
     It continuously prompts the user to choose from the main menu options,
-    which include Book Management, User Management, Checkout Management, and Exit.
+    which include Book Management, User Management, Checkout Management, Reports, Metrics, and Exit.
    
     Args:
         None
@@ -236,8 +909,11 @@ def main():
 
     """
 
+    if os.environ.get('LIBRARY_METRICS'):
+        instrumentation.enable()
     while True:
         choice = main_menu()
+        refresh_managers()
         if choice == '1':
             book_management()
         elif choice == '2':
@@ -245,10 +921,26 @@ def main():
         elif choice == '3':
             checkout_management()
         elif choice == '4':
+            report_menu()
+        elif choice == '5':
+            metrics_menu()
+        elif choice == '6':
+            close_storage()
             print("Exiting.")
             break
         else:
             print("Invalid choice, please try again.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:2] == ['import']:
+        import_command(sys.argv[2:])
+    elif sys.argv[1:2] == ['archive']:
+        archive_command(sys.argv[2:])
+    elif sys.argv[1:2] == ['convert']:
+        convert_command(sys.argv[2:])
+    elif sys.argv[1:2] == ['serve']:
+        serve_command(sys.argv[2:])
+    elif sys.argv[1:2] == ['batch']:
+        batch_command(sys.argv[2:])
+    else:
+        main()
\ No newline at end of file
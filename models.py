@@ -1,6 +1,7 @@
 # models.py
 
 import datetime
+import sys
 
 class Book:
 
@@ -16,8 +17,14 @@ class Book:
     Methods:
         __init__(self, title, author, isbn, available): Initializes a new Book object.
         __repr__(self): Returns a string representation of the Book object.
+        to_dict(self): Returns the attributes of the Book object as a dictionary.
+
+    Books use `__slots__` instead of a per-instance `__dict__`, and author names are interned
+    so that all books by the same author share one string.
     """
 
+    __slots__ = ('title', '_author', 'isbn', 'available')
+
     def __init__(self, title, author, isbn, available):
 
         """
@@ -35,6 +42,25 @@ class Book:
         self.isbn = isbn
         self.available = available  # Add a flag to track availability
 
+    @property
+    def author(self):
+        return self._author
+
+    @author.setter
+    def author(self, author):
+        self._author = sys.intern(author) if isinstance(author, str) else author
+
+    def to_dict(self):
+
+        """
+        Returns the attributes of the Book object as a dictionary.
+
+        Returns:
+            dict: The title, author, ISBN, and availability of the book.
+        """
+
+        return {'title': self.title, 'author': self.author, 'isbn': self.isbn, 'available': self.available}
+
     def __repr__(self):
 
         """
@@ -58,8 +84,11 @@ class User:
     Methods:
         __init__(self, name, user_id): Initializes a new User object.
         __repr__(self): Returns a string representation of the User object.
+        to_dict(self): Returns the attributes of the User object as a dictionary.
     """
 
+    __slots__ = ('name', 'user_id')
+
     def __init__(self, name, user_id):
 
         """
@@ -73,6 +102,17 @@ class User:
         self.name = name
         self.user_id = user_id
 
+    def to_dict(self):
+
+        """
+        Returns the attributes of the User object as a dictionary.
+
+        Returns:
+            dict: The name and user ID of the user.
+        """
+
+        return {'name': self.name, 'user_id': self.user_id}
+
     def __repr__(self):
 
         """
@@ -101,6 +141,8 @@ class Checkout:
         __repr__(self): Returns a string representation of the Checkout object.
     """
 
+    __slots__ = ('user', 'book', 'checkout_date', 'checkin_date')
+
     def __init__(self, user, book):
 
         """
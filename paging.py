@@ -0,0 +1,138 @@
+# paging.py
+"""
+Cursor-based pagination for the managers' listings.
+
+A listing is read one `Page` at a time. Each page carries `next_cursor`, an opaque string that is
+passed back to get the page after it, or None on the last page. A cursor records the sort order
+and the position of the last record shown (its sort key and a unique sequence number), not an
+offset, so records added or removed between two calls never make a page skip or repeat others.
+Fetching a page costs a binary search plus the records on it, however long the listing is.
+"""
+
+import bisect
+import json
+from collections import namedtuple
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+def encode_cursor(sort, position):
+    return json.dumps([sort, *position])
+
+def decode_cursor(cursor, sort):
+
+    """
+    Returns the position stored in `cursor`, or None for no cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or belongs to a listing in another order.
+    """
+
+    if cursor is None:
+        return None
+    try:
+        decoded = json.loads(cursor)
+    except (TypeError, ValueError):
+        decoded = None
+    if not isinstance(decoded, list) or len(decoded) < 2 or decoded[0] != sort:
+        raise ValueError(f"Invalid cursor for a listing sorted by {sort}")
+    return tuple(decoded[1:])
+
+def page(candidates, limit, sort, predicate=None):
+
+    """
+    Collects one page from `candidates`, which yields `(position, record)` pairs in order.
+
+    Args:
+        candidates (iterable): The records after the cursor with their positions.
+        limit (int): The maximum number of records on the page.
+        sort (str): The sort order, stored in the cursor.
+        predicate (callable, optional): Only records for which it returns True are included.
+
+    Returns:
+        Page: The records and the cursor of the last one, or None if no matching record follows.
+
+    Raises:
+        ValueError: If `limit` is not positive.
+    """
+
+    if limit < 1:
+        raise ValueError("The page size must be at least 1")
+    items = []
+    last = None
+    for position, record in candidates:
+        if predicate is not None and not predicate(record):
+            continue
+        if len(items) == limit:
+            return Page(items, encode_cursor(sort, last))
+        items.append(record)
+        last = position
+    return Page(items, None)
+
+def iterate(fetch, page_size=1000):
+
+    """
+    Yields every record of a listing, fetching it one page at a time.
+
+    Args:
+        fetch (callable): Called as `fetch(cursor, limit)` and returns a `Page`.
+        page_size (int, optional): The records fetched per call. Defaults to 1000.
+    """
+
+    cursor = None
+    while True:
+        result = fetch(cursor, page_size)
+        yield from result.items
+        cursor = result.next_cursor
+        if cursor is None:
+            return
+
+class SortedIndex:
+
+    """
+    Record IDs kept sorted by a key, to page through records in that order.
+
+    Entries are `(key, sequence, record_id)`. The sequence number breaks ties between equal keys, so
+    every position is unique and a cursor can point between any two records. Adding or removing a
+    record keeps the entries sorted with a binary search.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._positions = {}
+
+    @classmethod
+    def from_records(cls, records):
+
+        """
+        Builds an index from `(record_id, key, sequence)` triples with a single sort. Adding them one at a
+        time would shift the entries on every insert, which takes quadratic time for a whole catalog.
+        """
+
+        index = cls()
+        index._entries = sorted((key, sequence, record_id) for record_id, key, sequence in records)
+        index._positions = {record_id: (key, sequence) for key, sequence, record_id in index._entries}
+        return index
+
+    def add(self, record_id, key, sequence):
+        bisect.insort(self._entries, (key, sequence, record_id))
+        self._positions[record_id] = (key, sequence)
+
+    def remove(self, record_id):
+        position = self._positions.pop(record_id, None)
+        if position is not None:
+            del self._entries[bisect.bisect_left(self._entries, position)]
+
+    def position(self, record_id):
+        return self._positions[record_id]
+
+    def after(self, position=None):
+
+        """
+        Yields `(position, record_id)` for every entry after `position`, or from the first one for None.
+        """
+
+        entries = self._entries
+        start = 0 if position is None else bisect.bisect_left(entries, (position[0], position[1] + 1))
+        for index in range(start, len(entries)):
+            key, sequence, record_id = entries[index]
+            yield (key, sequence), record_id
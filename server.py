@@ -0,0 +1,388 @@
+# server.py
+"""
+A line-delimited JSON-RPC 2.0 service that exposes the managers to many concurrent clients.
+
+Each request and each response is one JSON object on its own line, e.g.
+
+    {"jsonrpc": "2.0", "id": 1, "method": "books.search", "params": {"title": "dune"}}
+    {"jsonrpc": "2.0", "id": 1, "result": [{"title": "Dune", "author": "Frank Herbert", ...}]}
+
+Clients connect over TCP or a Unix socket and may keep a connection open for any number of requests.
+The event loop only parses and writes messages; every manager call, and with it all storage I/O,
+runs on a pool of worker threads.
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from models import Book, User
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+APPLICATION_ERROR = 1
+
+# The types of the methods' parameters, by name. None is also accepted where it is the default.
+PARAM_TYPES = {
+    'title': str, 'author': str, 'isbn': str, 'name': str, 'user_id': str, 'query': str, 'cursor': str, 'sort': str,
+    'limit': int, 'available': bool, 'open_only': bool, 'include_archive': bool,
+}
+TYPE_NAMES = {str: 'a string', int: 'an integer', bool: 'true or false'}
+
+def checked(method):
+
+    """
+    Wraps a service method so that arguments of the wrong type (see `PARAM_TYPES`) raise TypeError before a
+    manager sees them. A number passed as a title, say, would otherwise fail deep inside the manager.
+    """
+
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        for name, value in signature.bind(*args, **kwargs).arguments.items():
+            expected = PARAM_TYPES.get(name)
+            if expected is None or (value is None and signature.parameters[name].default is None):
+                continue
+            # bool is a subclass of int, but true is no limit.
+            if not isinstance(value, expected) or (expected is not bool and isinstance(value, bool)):
+                raise TypeError(f"{name} must be {TYPE_NAMES[expected]}")
+        return method(*args, **kwargs)
+
+    return wrapper
+
+def checkout_to_dict(checkout):
+
+    """
+    Returns a checkout as a JSON serializable dictionary.
+    """
+
+    return {
+        'user_id': checkout.user.user_id,
+        'isbn': checkout.book.isbn,
+        'checkout_date': checkout.checkout_date.isoformat(),
+        'checkin_date': checkout.checkin_date.isoformat() if checkout.checkin_date else None,
+    }
+
+class LibraryService:
+
+    """
+    The JSON-RPC methods, implemented on top of the managers.
+
+    Every method takes and returns plain JSON values, and rejects arguments of the wrong type with
+    `TypeError`. Errors that the managers report with `ValueError` (an unknown ISBN, an unavailable
+    book, ...) are returned to the client as application errors.
+    """
+
+    def __init__(self, book_manager, user_manager, checkout_manager):
+
+        """
+        Initializes the service.
+
+        Args:
+            book_manager (BookManager): The manager for books.
+            user_manager (UserManager): The manager for users.
+            checkout_manager (CheckoutManager): The manager for checkouts.
+        """
+
+        self.book_manager = book_manager
+        self.user_manager = user_manager
+        self.checkout_manager = checkout_manager
+        self.methods = {
+            'books.add': self.add_book,
+            'books.update': self.update_book,
+            'books.delete': self.delete_book,
+            'books.get': self.get_book,
+            'books.list': self.list_books,
+            'books.search': self.search_books,
+            'books.page': self.page_books,
+            'users.add': self.add_user,
+            'users.update': self.update_user,
+            'users.delete': self.delete_user,
+            'users.get': self.get_user,
+            'users.list': self.list_users,
+            'users.search': self.search_users,
+            'users.page': self.page_users,
+            'checkouts.checkout': self.checkout_book,
+            'checkouts.checkin': self.checkin_book,
+            'checkouts.list': self.list_checkouts,
+            'checkouts.page': self.page_checkouts,
+            'checkouts.current': self.current_checkouts,
+            'checkouts.user_history': self.user_history,
+            'checkouts.book_history': self.book_history,
+        }
+        # A `DiskBookManager` keeps no in-memory index to search fuzzily.
+        if hasattr(book_manager, 'fuzzy_search_books'):
+            self.methods['books.fuzzy_search'] = self.fuzzy_search_books
+        self.methods = {name: checked(method) for name, method in self.methods.items()}
+
+    def call(self, method, params):
+
+        """
+        Calls a method by name.
+
+        Args:
+            method (str): The method name, e.g. 'books.search'.
+            params (dict | list): Keyword or positional arguments.
+
+        Returns:
+            The JSON serializable result.
+
+        Raises:
+            LookupError: If there is no such method.
+            TypeError: If the arguments do not fit the method or have the wrong type.
+            ValueError: If the managers reject the call.
+        """
+
+        handler = self.methods.get(method)
+        if handler is None:
+            raise LookupError(f"Unknown method: {method}")
+        if isinstance(params, dict):
+            return handler(**params)
+        return handler(*params)
+
+    def add_book(self, title, author, isbn, available=True):
+        book = Book(title, author, isbn, available)
+        self.book_manager.add_book(book)
+        return book.to_dict()
+
+    def update_book(self, isbn, title=None, author=None):
+        self.book_manager.update_book(isbn, title, author)
+        return self._book(isbn).to_dict()
+
+    def delete_book(self, isbn):
+        self.book_manager.delete_book(isbn)
+        return None
+
+    def get_book(self, isbn):
+        book = self.book_manager.get_book_by_isbn(isbn)
+        return book.to_dict() if book else None
+
+    def list_books(self):
+        return [book.to_dict() for book in self.book_manager.list_books()]
+
+    def search_books(self, title=None, author=None, isbn=None):
+        return [book.to_dict() for book in self.book_manager.search_books(title, author, isbn)]
+
+    def fuzzy_search_books(self, query, limit=10):
+        return [dict(book.to_dict(), score=round(score, 4))
+                for book, score in self.book_manager.fuzzy_search_books(query, limit)]
+
+    def page_books(self, cursor=None, limit=20, sort='catalog', available=None):
+        page = self.book_manager.page_books(cursor, limit, sort, available)
+        return {'items': [book.to_dict() for book in page.items], 'next_cursor': page.next_cursor}
+
+    def add_user(self, name, user_id):
+        user = User(name, user_id)
+        # UserManager.add_user returns the error for a duplicate ID instead of raising it.
+        error = self.user_manager.add_user(user)
+        if isinstance(error, ValueError):
+            raise error
+        return user.to_dict()
+
+    def update_user(self, user_id, name=None):
+        user = self._user(user_id)
+        self.user_manager.update_user(user_id, name)
+        return user.to_dict()
+
+    def delete_user(self, user_id):
+        self._user(user_id)
+        self.user_manager.delete_user(user_id)
+        return None
+
+    def get_user(self, user_id):
+        user = self.user_manager.get_user_by_id(user_id)
+        return user.to_dict() if user else None
+
+    def list_users(self):
+        return [user.to_dict() for user in self.user_manager.list_users()]
+
+    def search_users(self, name=None, user_id=None):
+        return [user.to_dict() for user in self.user_manager.search_users(name, user_id)]
+
+    def page_users(self, cursor=None, limit=20, sort='catalog', name=None):
+        page = self.user_manager.page_users(cursor, limit, sort, name)
+        return {'items': [user.to_dict() for user in page.items], 'next_cursor': page.next_cursor}
+
+    def checkout_book(self, user_id, isbn):
+        self.checkout_manager.checkout_book(self._user(user_id), self._book(isbn))
+        return None
+
+    def checkin_book(self, user_id, isbn):
+        self.checkout_manager.checkin_book(self._user(user_id), self._book(isbn))
+        return None
+
+    def list_checkouts(self):
+        return [checkout_to_dict(checkout) for checkout in self.checkout_manager.list_checkouts()]
+
+    def page_checkouts(self, cursor=None, limit=20, user_id=None, isbn=None, open_only=False):
+        page = self.checkout_manager.page_checkouts(cursor, limit, user_id, isbn, open_only)
+        return {'items': [checkout_to_dict(checkout) for checkout in page.items], 'next_cursor': page.next_cursor}
+
+    def current_checkouts(self, user_id):
+        return [checkout_to_dict(checkout) for checkout in self.checkout_manager.get_current_checkouts(self._user(user_id))]
+
+    def user_history(self, user_id, include_archive=False):
+        return [checkout_to_dict(checkout)
+                for checkout in self.checkout_manager.get_user_history(self._user(user_id), include_archive)]
+
+    def book_history(self, isbn, include_archive=False):
+        return [checkout_to_dict(checkout)
+                for checkout in self.checkout_manager.get_book_history(self._book(isbn), include_archive)]
+
+    def _book(self, isbn):
+        book = self.book_manager.get_book_by_isbn(isbn)
+        if book is None:
+            raise ValueError("Book not found.")
+        return book
+
+    def _user(self, user_id):
+        user = self.user_manager.get_user_by_id(user_id)
+        if user is None:
+            raise ValueError("User not found.")
+        return user
+
+class LibraryServer:
+
+    """
+    Serves a `LibraryService` over TCP or a Unix socket.
+
+    Connections are handled concurrently by the event loop. Manager calls are handed to `executor`,
+    a pool of worker threads; the managers lock internally, so calls on different books run in parallel.
+    """
+
+    # Longest accepted request line, in bytes.
+    LINE_LIMIT = 1024 * 1024
+
+    def __init__(self, service, executor=None, workers=4):
+
+        """
+        Initializes the server.
+
+        Args:
+            service (LibraryService): The methods to serve.
+            executor (concurrent.futures.Executor, optional): Runs the manager calls.
+                Defaults to a `ThreadPoolExecutor` with `workers` threads.
+            workers (int, optional): The number of worker threads of the default executor. Defaults to 4.
+        """
+
+        self.service = service
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library')
+
+    async def start(self, host='127.0.0.1', port=8765, unix_path=None):
+
+        """
+        Starts listening.
+
+        Args:
+            host (str, optional): The TCP host. Defaults to '127.0.0.1'.
+            port (int, optional): The TCP port, or 0 for any free port. Defaults to 8765.
+            unix_path (str, optional): Listen on this Unix socket instead of TCP.
+
+        Returns:
+            asyncio.Server: The listening server.
+        """
+
+        if unix_path:
+            return await asyncio.start_unix_server(self.handle_client, unix_path, limit=self.LINE_LIMIT)
+        return await asyncio.start_server(self.handle_client, host, port, limit=self.LINE_LIMIT)
+
+    async def handle_client(self, reader, writer):
+
+        """
+        Answers the requests of one connection in order until the client disconnects.
+        """
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The client sent a line longer than LINE_LIMIT (asyncio's LimitOverrunError).
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.handle_line(line)
+                if response is not None:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            # The client went away.
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line):
+
+        """
+        Decodes one request line, runs it on the executor and returns the response, or None for
+        a notification (a request without an id).
+        """
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            return self._error(None, PARSE_ERROR, f"Parse error: {error}")
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return self._error(None, INVALID_REQUEST, "Invalid request")
+
+        request_id = request.get('id')
+        params = request.get('params', {})
+        if request['method'] not in self.service.methods:
+            response = self._error(request_id, METHOD_NOT_FOUND, f"Unknown method: {request['method']}")
+            return response if 'id' in request else None
+        if not isinstance(params, (dict, list)):
+            return self._error(request_id, INVALID_PARAMS, "params must be an object or an array")
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, self.service.call, request['method'], params)
+        except TypeError as error:
+            response = self._error(request_id, INVALID_PARAMS, str(error))
+        except ValueError as error:
+            response = self._error(request_id, APPLICATION_ERROR, str(error))
+        except Exception as error:
+            # A bug or a storage failure: answer this request and keep the connection for the others.
+            traceback.print_exc()
+            response = self._error(request_id, INTERNAL_ERROR, f"Internal error: {type(error).__name__}: {error}")
+        else:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        return response if 'id' in request else None
+
+    def _error(self, request_id, code, message):
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+async def serve(service, host='127.0.0.1', port=8765, unix_path=None, workers=4):
+
+    """
+    Runs a `LibraryServer` until cancelled, printing the address it listens on.
+
+    Args:
+        service (LibraryService): The methods to serve.
+        host (str, optional): The TCP host. Defaults to '127.0.0.1'.
+        port (int, optional): The TCP port, or 0 for any free port. Defaults to 8765.
+        unix_path (str, optional): Listen on this Unix socket instead of TCP.
+        workers (int, optional): The number of threads that run manager calls. Defaults to 4.
+
+    Returns:
+        None
+    """
+
+    library_server = LibraryServer(service, workers=workers)
+    server = await library_server.start(host, port, unix_path)
+    if unix_path:
+        print(f"Listening on {unix_path}", flush=True)
+    else:
+        address = server.sockets[0].getsockname()
+        print(f"Listening on {address[0]}:{address[1]}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        library_server.executor.shutdown(wait=True)
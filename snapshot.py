@@ -0,0 +1,367 @@
+# snapshot.py
+"""
+Binary snapshot files (`.snap`): fixed-width columns plus a string heap, read through mmap.
+
+A snapshot holds the records of one data file. Every field is stored as a column of fixed-width
+values, so record `i` of a column is found by arithmetic alone and nothing has to be parsed up front:
+
+    magic     8 bytes, b'LIBSNAP1'
+    header    u32 length, then JSON: {"byteorder", "count", "strings", "fields": [[name, type], ...]}
+    columns   one per field, `count` values each, every column starting at a multiple of 8 bytes
+    offsets   `strings` + 1 u64 offsets of the strings in the heap
+    heap      the UTF-8 strings, each distinct string stored once
+
+Field types are `str` (u32 index into the string table, NO_STRING for None), `bool` (u8) and `time`
+(int64 microseconds since 1970-01-01, NO_DATE for None). Values are written in the byte order of
+the machine that wrote the file, which the header records.
+
+`Snapshot` maps a file and decodes records only when they are accessed; `write` creates one from the
+same dictionaries the JSON formats store. `SnapshotCheckoutTable` loads a checkouts snapshot without
+building a single `Checkout` or resolving a user or book until a row is read.
+"""
+
+import itertools
+import json
+import mmap
+import struct
+import sys
+from array import array
+from datetime import datetime
+from checkout_table import CheckoutTable, NO_DATE, from_micros, to_micros
+from models import Book, User
+
+MAGIC = b'LIBSNAP1'
+NO_STRING = 0xFFFFFFFF
+TYPECODES = {'str': 'I', 'bool': 'B', 'time': 'q'}
+
+# The fields of each kind of record, in the order of the dictionaries the storages read and write.
+SCHEMAS = (
+    (('title', 'str'), ('author', 'str'), ('isbn', 'str'), ('available', 'bool')),
+    (('name', 'str'), ('user_id', 'str')),
+    (('user_id', 'str'), ('isbn', 'str'), ('checkout_date', 'time'), ('checkin_date', 'time')),
+)
+
+def is_snapshot(data_file):
+
+    """
+    Returns True if `data_file` is stored as a binary snapshot (its name ends in `.snap`).
+    """
+
+    return data_file.endswith('.snap')
+
+def schema_for(row):
+
+    """
+    Returns the schema whose fields are exactly the keys of `row`.
+
+    Raises:
+        ValueError: If no schema matches.
+    """
+
+    keys = set(row)
+    for schema in SCHEMAS:
+        if keys == {name for name, _ in schema}:
+            return schema
+    raise ValueError(f"No snapshot schema for records with the fields {sorted(keys)}")
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+def _layout(start, count, strings, schema):
+
+    """
+    Returns the offsets of the columns, of the string offsets and of the heap for a data section at `start`.
+    """
+
+    columns = []
+    offset = start
+    for _, field_type in schema:
+        columns.append(offset)
+        offset = _aligned(offset + count * array(TYPECODES[field_type]).itemsize)
+    return columns, offset, offset + (strings + 1) * 8
+
+def write(path, rows):
+
+    """
+    Writes records to a snapshot file.
+
+    Args:
+        path (str): The file to write.
+        rows (iterable): Dictionaries, one per record, all with the fields of one of `SCHEMAS`.
+            Times are ISO 8601 strings or None, as `Storage` stores them.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the records do not match a schema.
+    """
+
+    rows = iter(rows)
+    first = next(rows, None)
+    schema = schema_for(first) if first is not None else ()
+    columns = [array(TYPECODES[field_type]) for _, field_type in schema]
+    strings = {}
+    for row in itertools.chain([first], rows) if first is not None else ():
+        for column, (name, field_type) in zip(columns, schema):
+            value = row[name]
+            if field_type == 'str':
+                if value is None:
+                    column.append(NO_STRING)
+                else:
+                    index = strings.get(value)
+                    if index is None:
+                        index = strings[value] = len(strings)
+                    column.append(index)
+            elif field_type == 'bool':
+                column.append(bool(value))
+            else:
+                column.append(to_micros(datetime.fromisoformat(value) if value else None))
+
+    encoded = [string.encode() for string in strings]
+    offsets = array('Q', itertools.accumulate((len(string) for string in encoded), initial=0))
+    count = len(columns[0]) if columns else 0
+    header = json.dumps({'byteorder': sys.byteorder, 'count': count, 'strings': len(encoded),
+                         'fields': [list(field) for field in schema]}).encode()
+    start = _aligned(len(MAGIC) + 4 + len(header))
+    column_offsets, offsets_offset, heap_offset = _layout(start, count, len(encoded), schema)
+    with open(path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for column, offset in zip(columns, column_offsets):
+            file.write(b'\0' * (offset - file.tell()))
+            column.tofile(file)
+        file.write(b'\0' * (offsets_offset - file.tell()))
+        offsets.tofile(file)
+        for string in encoded:
+            file.write(string)
+
+class Snapshot:
+
+    """
+    A snapshot file mapped into memory.
+
+    Opening one only reads the header; records are decoded on access. It can be indexed and iterated
+    like a list of the dictionaries it was written from, and `column` gives direct access to the raw
+    values of a field. Close it (or use it as a context manager) to unmap the file.
+    """
+
+    def __init__(self, path):
+
+        """
+        Maps a snapshot file.
+
+        Args:
+            path (str): The file to map.
+
+        Raises:
+            FileNotFoundError: If `path` does not exist.
+            ValueError: If `path` is not a snapshot, or was written with the other byte order.
+        """
+
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is empty, not a snapshot")
+        self._buffer = memoryview(self._map)
+        self._views = []
+        try:
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a snapshot")
+            header_length, = struct.unpack_from('<I', self._map, len(MAGIC))
+            header = json.loads(self._map[len(MAGIC) + 4:len(MAGIC) + 4 + header_length])
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError(f"{path} was written on a {header['byteorder']}-endian machine")
+            self.count = header['count']
+            self.fields = [tuple(field) for field in header['fields']]
+            column_offsets, offsets_offset, heap_offset = _layout(
+                _aligned(len(MAGIC) + 4 + header_length), self.count, header['strings'], self.fields)
+            self._columns = {name: self._view(offset, self.count, TYPECODES[field_type])
+                             for (name, field_type), offset in zip(self.fields, column_offsets)}
+            self._offsets = self._view(offsets_offset, header['strings'] + 1, 'Q')
+            self._heap = heap_offset
+        except Exception:
+            self.close()
+            raise
+
+    def _view(self, offset, count, typecode):
+        size = array(typecode).itemsize
+        view = self._buffer[offset:offset + count * size].cast(typecode)
+        self._views.append(view)
+        return view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+
+        """
+        Releases the views into the mapping and unmaps the file.
+        """
+
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._buffer.release()
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if not -self.count <= index < self.count:
+            raise IndexError("snapshot index out of range")
+        row = {}
+        for name, field_type in self.fields:
+            value = self._columns[name][index]
+            if field_type == 'str':
+                row[name] = self.string(value)
+            elif field_type == 'bool':
+                row[name] = bool(value)
+            else:
+                date = from_micros(value)
+                row[name] = date.isoformat() if date else None
+        return row
+
+    def column(self, name):
+
+        """
+        Returns the raw values of a field as a memoryview: string indexes, 0/1 or int64 microseconds.
+        """
+
+        return self._columns[name]
+
+    def string(self, index):
+
+        """
+        Decodes a string from the heap, or returns None for NO_STRING.
+        """
+
+        if index == NO_STRING:
+            return None
+        start = self._heap + self._offsets[index]
+        return self._map[start:self._heap + self._offsets[index + 1]].decode()
+
+    def strings(self):
+        return len(self._offsets) - 1
+
+class _LazySlots:
+
+    """
+    The users or books of a `SnapshotCheckoutTable`, resolved from the snapshot's string table on first access.
+
+    Slots below the number of strings are string indexes; checkouts added later get slots after them.
+    """
+
+    def __init__(self, snapshot, resolve):
+        self._snapshot = snapshot
+        self._resolve = resolve
+        self._objects = {}
+        self._length = snapshot.strings()
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, slot):
+        value = self._objects.get(slot)
+        if value is None:
+            value = self._objects[slot] = self._resolve(self._snapshot.string(slot))
+        return value
+
+    def append(self, value):
+        self._objects[self._length] = value
+        self._length += 1
+
+class SnapshotCheckoutTable(CheckoutTable):
+
+    """
+    A `CheckoutTable` loaded from a checkouts snapshot.
+
+    The four columns are copied out of the mapping in one block each, so rows can be checked in and
+    appended as usual. Users and books are looked up by ID only when a row that refers to them is read;
+    as in `Storage.load_checkouts`, one placeholder is built for every ID that cannot be resolved.
+    A row appended for a user or book that mapped rows refer to gets their slot, so reports, which
+    count by slot, see one user or book and not two.
+    The snapshot stays mapped for the string table until the table is garbage collected.
+    """
+
+    def __init__(self, snapshot, get_book=None, get_user=None):
+
+        """
+        Initializes the table from a mapped checkouts snapshot.
+
+        Args:
+            snapshot (Snapshot): The mapped snapshot.
+            get_book (callable, optional): Resolves an ISBN to the shared `Book` object.
+            get_user (callable, optional): Resolves a user ID to the shared `User` object.
+
+        Raises:
+            ValueError: If the snapshot does not hold checkouts.
+        """
+
+        super().__init__()
+        if snapshot.count and snapshot.fields != list(SCHEMAS[2]):
+            raise ValueError("The snapshot does not hold checkouts")
+        self._snapshot = snapshot
+        self._users = _LazySlots(snapshot, lambda user_id: (get_user and get_user(user_id)) or User(None, user_id))
+        self._books = _LazySlots(snapshot, lambda isbn: (get_book and get_book(isbn)) or Book(None, None, isbn, False))
+        self._user_column = array('I')
+        self._book_column = array('I')
+        if snapshot.count:
+            self._user_column.frombytes(snapshot.column('user_id').cast('B'))
+            self._book_column.frombytes(snapshot.column('isbn').cast('B'))
+            self._checkout_column.frombytes(snapshot.column('checkout_date').cast('B'))
+            self._checkin_column.frombytes(snapshot.column('checkin_date').cast('B'))
+        self._seeded = False
+
+    def _user_slot(self, user):
+        self._seed_slots()
+        return super()._user_slot(user)
+
+    def _book_slot(self, book):
+        self._seed_slots()
+        return super()._book_slot(book)
+
+    def _seed_slots(self):
+
+        """
+        Maps the IDs in the mapped rows to their slots, which are their string indexes. Done on the first
+        append or checkin, so loading and reading the table never decodes the string table.
+        """
+
+        if self._seeded:
+            return
+        self._seeded = True
+        strings = self._snapshot.strings()
+        for slots, column in ((self._user_slots, self._user_column), (self._book_slots, self._book_column)):
+            for slot in set(column):
+                if slot < strings:
+                    slots[self._snapshot.string(slot)] = slot
+
+    def index_rows(self):
+
+        """
+        Yields the user ID, ISBN and open status of every row straight from the string table.
+        """
+
+        strings = self._snapshot.strings()
+        user_ids = {}
+        isbns = {}
+        for row, (user_slot, book_slot, checkin) in enumerate(
+                zip(self._user_column, self._book_column, self._checkin_column)):
+            user_id = user_ids.get(user_slot)
+            if user_id is None:
+                user_id = user_ids[user_slot] = (self._snapshot.string(user_slot) if user_slot < strings
+                                                 else self._users[user_slot].user_id)
+            isbn = isbns.get(book_slot)
+            if isbn is None:
+                isbn = isbns[book_slot] = (self._snapshot.string(book_slot) if book_slot < strings
+                                           else self._books[book_slot].isbn)
+            yield row, user_id, isbn, checkin == NO_DATE
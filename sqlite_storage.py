@@ -0,0 +1,453 @@
+# sqlite_storage.py
+import sqlite3
+import threading
+from contextlib import contextmanager
+from checkout_table import CheckoutTable
+from models import Book, User
+from storage import Storage
+
+class SQLiteStorage(Storage):
+
+    """
+    A `Storage` that keeps books, users, and checkouts in a local SQLite database.
+
+    It implements the same interface as the JSON file `Storage`, so the managers work unchanged
+    against either backend. `put_*` and `remove_*` touch a single row inside a transaction, and
+    `save_*` replace a whole table inside one transaction, so a crash never leaves a half written table.
+    The isbn, user_id and open checkout columns are indexed, and so are titles and authors, ignoring case, for sorted listings.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            isbn TEXT PRIMARY KEY,
+            title TEXT,
+            author TEXT,
+            available INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS checkouts (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            isbn TEXT NOT NULL,
+            checkout_date TEXT NOT NULL,
+            checkin_date TEXT,
+            UNIQUE (user_id, isbn, checkout_date)
+        );
+        CREATE INDEX IF NOT EXISTS books_title ON books (IFNULL(title, '') COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS books_author ON books (IFNULL(author, '') COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS checkouts_user_id ON checkouts (user_id);
+        CREATE INDEX IF NOT EXISTS checkouts_isbn ON checkouts (isbn);
+        CREATE INDEX IF NOT EXISTS checkouts_open ON checkouts (user_id, isbn) WHERE checkin_date IS NULL;
+        CREATE TABLE IF NOT EXISTS archived_checkouts (
+            id INTEGER PRIMARY KEY,
+            month TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            isbn TEXT NOT NULL,
+            checkout_date TEXT NOT NULL,
+            checkin_date TEXT NOT NULL,
+            UNIQUE (user_id, isbn, checkout_date)
+        );
+        CREATE INDEX IF NOT EXISTS archived_checkouts_month ON archived_checkouts (month);
+        CREATE INDEX IF NOT EXISTS archived_checkouts_user_id ON archived_checkouts (user_id);
+        CREATE INDEX IF NOT EXISTS archived_checkouts_isbn ON archived_checkouts (isbn);
+    """
+
+    def __init__(self, db_file):
+
+        """
+        Open (and create if needed) the SQLite database.
+
+        Args:
+        db_file (str): The path to the SQLite database file.
+
+        Attributes:
+        db_file (str): The path to the SQLite database file.
+        connection (sqlite3.Connection): The calling thread's database connection.
+
+        The storage can be shared between threads. Every thread gets a connection of its own, opened on first
+        use, so statements and transactions of different threads never mix; SQLite serializes their writes.
+        """
+
+        self.db_file = db_file
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self._seen = {}
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Transactions are begun explicitly (see `transaction`), not implicitly by the sqlite3 module.
+            # Only this thread uses the connection, but `close` may close it from another one.
+            connection = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self):
+
+        """
+        Group mutations into one SQLite transaction that is committed once at the end of the `with` block,
+        or rolled back if the block raises. Nested transactions join the outer one; transactions of other
+        threads are separate and wait for this one to commit.
+
+        The transaction takes the database's write lock when it begins, so rows read inside it, such as the
+        availability checked by `check_book_available`, cannot be changed by another process before it commits.
+        """
+
+        if getattr(self._local, 'in_transaction', False):
+            yield
+            return
+        self._local.in_transaction = True
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        finally:
+            self._local.in_transaction = False
+
+    def enable_write_behind(self, flush_interval=1.0, max_pending=100, fsync=True):
+
+        """
+        Does nothing: every change is already a single-row write committed by SQLite, which is cheap,
+        so there is nothing to collect in the background. Use `transaction` to group many changes
+        into one commit.
+        """
+
+    def flush(self):
+        pass
+
+    def stale_collections(self):
+
+        """
+        Find the collections that another process may have changed since they were loaded.
+
+        Every write goes straight to the database, but the managers keep the rows they loaded in memory.
+        SQLite's `data_version` changes whenever another connection commits, without saying which table
+        changed, so all the collections loaded before such a commit are reported. Other threads have
+        connections of their own, so their commits count too.
+
+        Returns:
+        set: Any of 'books', 'users' and 'checkouts'. Collections that were never loaded are not included.
+        """
+
+        version = self._data_version()
+        return {name for name, seen in self._seen.items() if seen != version}
+
+    def check_book_available(self, isbn):
+
+        """
+        Make sure that no other process checked out or deleted a book since the books were loaded.
+        Inside a transaction the row is read under the database's write lock, which is held until it commits.
+
+        Raises:
+        ValueError: If the stored book is checked out or no longer exists.
+        """
+
+        row = self.connection.execute("SELECT available FROM books WHERE isbn = ?", (isbn,)).fetchone()
+        if row is None:
+            raise ValueError("Book not found.")
+        if not row[0]:
+            raise ValueError("Book is not available")
+
+    def _data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _mark_loaded(self, name):
+        self._seen[name] = self._data_version()
+
+    def _unit(self):
+
+        """
+        Returns a context that commits a single write, unless it is part of an open transaction.
+        """
+
+        return self.transaction()
+
+    def load_books(self):
+        self._mark_loaded('books')
+        return list(self.iter_books())
+
+    def iter_books(self):
+        rows = self.connection.execute("SELECT title, author, isbn, available FROM books ORDER BY rowid")
+        for title, author, isbn, available in rows:
+            yield Book(title, author, isbn, bool(available))
+
+    def get_book(self, isbn):
+
+        """
+        Look up one book through the primary key index on isbn, without loading the others.
+
+        Returns:
+        Book: The stored book, or None if there is none with that ISBN.
+        """
+
+        row = self.connection.execute(
+            "SELECT title, author, isbn, available FROM books WHERE isbn = ?", (isbn,)).fetchone()
+        return Book(row[0], row[1], row[2], bool(row[3])) if row else None
+
+    def count_books(self):
+        return self.connection.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def iter_isbns(self):
+        for isbn, in self.connection.execute("SELECT isbn FROM books"):
+            yield isbn
+
+    # The sort keys of `iter_sorted_books`, which match the expressions of the books_title and books_author indexes.
+    BOOK_SORT_KEYS = {
+        'catalog': 'rowid',
+        'title': "IFNULL(title, '') COLLATE NOCASE",
+        'author': "IFNULL(author, '') COLLATE NOCASE",
+        'isbn': 'isbn',
+    }
+
+    def iter_sorted_books(self, sort='catalog', after=None, available=None):
+
+        """
+        Yield `(position, book)` for the books in the given order, starting after `after`.
+
+        A position is the book's sort key and rowid, so the next page is found with the index on the sort
+        key (keyset pagination) instead of skipping the rows of all the earlier pages.
+
+        Args:
+        sort (str, optional): 'catalog', 'title', 'author' or 'isbn'. Titles and authors ignore case. Defaults to 'catalog'.
+        after (tuple, optional): A position yielded before. Defaults to None, to start from the first book.
+        available (bool, optional): Only yield available (True) or checked out (False) books. Defaults to None.
+
+        Raises:
+        ValueError: If the sort order is unknown.
+        """
+
+        if sort not in self.BOOK_SORT_KEYS:
+            raise ValueError(f"Cannot sort books by {sort}")
+        key = self.BOOK_SORT_KEYS[sort]
+        clauses = []
+        parameters = []
+        if after is not None:
+            if sort == 'catalog':
+                clauses.append("rowid > ?")
+            else:
+                # The first comparison lets SQLite seek in the index, which it does not do for the row value alone.
+                clauses.append(f"{key} >= ? AND ({key}, rowid) > (?, ?)")
+                parameters.append(after[0])
+            parameters.extend(after)
+        if available is not None:
+            clauses.append("available = ?")
+            parameters.append(int(available))
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        order = "rowid" if sort == 'catalog' else f"{key}, rowid"
+        rows = self.connection.execute(
+            f"SELECT {key}, rowid, title, author, isbn, available FROM books {where}ORDER BY {order}",
+            parameters)
+        for sort_key, rowid, title, author, isbn, available in rows:
+            position = (rowid,) if sort == 'catalog' else (sort_key, rowid)
+            yield position, Book(title, author, isbn, bool(available))
+
+    def search_books(self, title=None, author=None, isbn=None):
+
+        """
+        Yield the available books whose title or author contains the given text, or whose ISBN is `isbn`,
+        in catalog order. The table is scanned row by row, so the catalog never has to be held in memory.
+        Like `BookManager.search_books`, matching ignores case (for ASCII letters, as SQLite's LIKE does).
+        """
+
+        clauses = []
+        parameters = []
+        for column, text in (('title', title), ('author', author)):
+            if text:
+                escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                parameters.append(f"%{escaped}%")
+        if isbn:
+            clauses.append("isbn = ?")
+            parameters.append(isbn)
+        if not clauses:
+            return
+        rows = self.connection.execute(
+            f"SELECT title, author, isbn, available FROM books WHERE available AND ({' OR '.join(clauses)}) "
+            "ORDER BY rowid", parameters)
+        for title, author, isbn, available in rows:
+            yield Book(title, author, isbn, bool(available))
+
+    def save_books(self, books):
+        with self._unit():
+            self.connection.execute("DELETE FROM books")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO books (title, author, isbn, available) VALUES (?, ?, ?, ?)",
+                [(book.title, book.author, book.isbn, book.available) for book in books])
+
+    def load_users(self):
+        self._mark_loaded('users')
+        return list(self.iter_users())
+
+    def iter_users(self):
+        rows = self.connection.execute("SELECT name, user_id FROM users ORDER BY rowid")
+        for name, user_id in rows:
+            yield User(name, user_id)
+
+    def save_users(self, users):
+        with self._unit():
+            self.connection.execute("DELETE FROM users")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO users (name, user_id) VALUES (?, ?)",
+                [(user.name, user.user_id) for user in users])
+
+    def load_checkouts(self, get_book=None, get_user=None):
+        self._mark_loaded('checkouts')
+        return list(self.iter_checkouts(get_book, get_user))
+
+    def load_checkout_table(self, get_book=None, get_user=None):
+        return CheckoutTable(self.load_checkouts(get_book, get_user))
+
+    def iter_checkouts(self, get_book=None, get_user=None):
+        cursor = self.connection.execute(
+            "SELECT user_id, isbn, checkout_date, checkin_date FROM checkouts ORDER BY id")
+        columns = [column[0] for column in cursor.description]
+        return self._resolve_checkouts((dict(zip(columns, row)) for row in cursor), get_book, get_user)
+
+    def archive_checkouts(self, checkouts, before):
+
+        """
+        Move the checkouts that were checked in before `before` from the checkouts table to the
+        archived_checkouts table, which records the month of each checkin, in one transaction.
+
+        Args:
+        checkouts (list): The full list of stored `Checkout` objects.
+        before (datetime): Checkouts checked in before this time are archived.
+
+        Returns:
+        list: The checkouts that stay in the checkouts table: open loans and recent checkins.
+        """
+
+        archived = []
+        remaining = []
+        for checkout in checkouts:
+            if checkout.checkin_date is not None and checkout.checkin_date < before:
+                archived.append(dict(self._checkout_to_row(checkout), month=checkout.checkin_date.strftime('%Y-%m')))
+            else:
+                remaining.append(checkout)
+        if archived:
+            with self._unit():
+                # A checkout that was archived before and restored since, e.g. by `import_from`, keeps its first row.
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO archived_checkouts (month, user_id, isbn, checkout_date, checkin_date) "
+                    "VALUES (:month, :user_id, :isbn, :checkout_date, :checkin_date)", archived)
+                self.connection.executemany(
+                    "DELETE FROM checkouts WHERE user_id = :user_id AND isbn = :isbn AND checkout_date = :checkout_date",
+                    archived)
+        return remaining
+
+    def archived_months(self):
+        return [month for month, in self.connection.execute(
+            "SELECT DISTINCT month FROM archived_checkouts ORDER BY month")]
+
+    def iter_archived_checkouts(self, get_book=None, get_user=None, user_id=None, isbn=None):
+        clauses = []
+        parameters = []
+        for column, value in (('user_id', user_id), ('isbn', isbn)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        cursor = self.connection.execute(
+            "SELECT user_id, isbn, checkout_date, checkin_date FROM archived_checkouts "
+            f"{where}ORDER BY month, id", parameters)
+        columns = [column[0] for column in cursor.description]
+        return self._resolve_checkouts((dict(zip(columns, row)) for row in cursor), get_book, get_user)
+
+    def migrate_checkouts(self):
+        return 0
+
+    def save_checkouts(self, checkouts):
+        with self._unit():
+            self.connection.execute("DELETE FROM checkouts")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO checkouts (user_id, isbn, checkout_date, checkin_date) "
+                "VALUES (:user_id, :isbn, :checkout_date, :checkin_date)",
+                [self._checkout_to_row(checkout) for checkout in checkouts])
+
+    def put_book(self, book, books):
+        with self._unit():
+            self.connection.execute(
+                "INSERT INTO books (title, author, isbn, available) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (isbn) DO UPDATE SET title = excluded.title, author = excluded.author, "
+                "available = excluded.available",
+                (book.title, book.author, book.isbn, book.available))
+
+    def put_books(self, new_books, books):
+        with self._unit():
+            self.connection.executemany(
+                "INSERT INTO books (title, author, isbn, available) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (isbn) DO UPDATE SET title = excluded.title, author = excluded.author, "
+                "available = excluded.available",
+                [(book.title, book.author, book.isbn, book.available) for book in new_books])
+
+    def remove_book(self, book, books):
+        with self._unit():
+            self.connection.execute("DELETE FROM books WHERE isbn = ?", (book.isbn,))
+
+    def put_user(self, user, users):
+        with self._unit():
+            self.connection.execute(
+                "INSERT INTO users (name, user_id) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET name = excluded.name",
+                (user.name, user.user_id))
+
+    def put_users(self, new_users, users):
+        with self._unit():
+            self.connection.executemany(
+                "INSERT INTO users (name, user_id) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET name = excluded.name",
+                [(user.name, user.user_id) for user in new_users])
+
+    def remove_user(self, user, users):
+        with self._unit():
+            self.connection.execute("DELETE FROM users WHERE user_id = ?", (user.user_id,))
+
+    def put_checkout(self, checkout, checkouts):
+        with self._unit():
+            self.connection.execute(
+                "INSERT INTO checkouts (user_id, isbn, checkout_date, checkin_date) "
+                "VALUES (:user_id, :isbn, :checkout_date, :checkin_date) "
+                "ON CONFLICT (user_id, isbn, checkout_date) DO UPDATE SET checkin_date = excluded.checkin_date",
+                self._checkout_to_row(checkout))
+
+    def import_from(self, storage):
+
+        """
+        Replace the contents of the database with the data held by another storage, e.g. the JSON files.
+
+        Args:
+        storage (Storage): The storage to copy books, users, and checkouts from.
+
+        Returns:
+        None
+        """
+
+        books = storage.load_books()
+        users = storage.load_users()
+        books_by_isbn = {book.isbn: book for book in books}
+        users_by_id = {user.user_id: user for user in users}
+        with self.transaction():
+            self.save_books(books)
+            self.save_users(users)
+            self.save_checkouts(storage.load_checkouts(books_by_isbn.get, users_by_id.get))
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -1,8 +1,43 @@
 # storage.py
+import atexit
 import json
 import os
+import threading
+from contextlib import contextmanager
+from checkout_table import CheckoutTable
 from models import Book, User, Checkout
 from datetime import datetime
+import snapshot
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; storage then works without inter-process locks.
+    fcntl = None
+
+def is_json_lines(data_file):
+
+    """
+    Return True if `data_file` is stored as JSON Lines (its name ends in `.jsonl`).
+    """
+
+    return data_file.endswith('.jsonl')
+
+def convert_file(source_file, target_file):
+
+    """
+    Convert a data file between the JSON array, JSON Lines and binary snapshot formats, one record at a time.
+    The format of each file is chosen by its extension, e.g. `convert_file('checkouts.json', 'checkouts.snap')`.
+
+    Args:
+    source_file (str): The path to the file to read.
+    target_file (str): The path to the file to write.
+
+    Returns:
+    None
+    """
+
+    storage = Storage(source_file, None, None)
+    storage._write_rows(target_file, storage._read_rows(source_file))
 
 class Storage:
     def __init__(self, book_file, user_file, checkout_file):
@@ -19,11 +54,196 @@ class Storage:
         book_file (str): The path to the JSON file containing the books data.
         user_file (str): The path to the JSON file containing the users data.
         checkout_file (str): The path to the JSON file containing the checkouts data.
+
+        Files whose name ends in `.jsonl` are stored as JSON Lines, one record per line, instead of a JSON array.
+        They are read and written record by record, so they never have to be held in memory as a whole.
+        Files whose name ends in `.snap` are binary snapshots (see `snapshot.py`), which are memory-mapped
+        and decoded record by record as they are read.
+
+        If a previous process crashed while committing a transaction, the commit is completed here.
+
+        Several processes can share the same files. Writes take a short advisory lock (`<file>.lock`)
+        and compare the file's generation (its inode, modification time and size) with the one seen
+        when it was loaded. If another process changed the file in the meantime, single-record changes
+        are merged into the current file contents instead of overwriting them, and `stale_collections`
+        reports the collection so it can be reloaded.
         """
         
         self.book_file = book_file
         self.user_file = user_file
         self.checkout_file = checkout_file
+        self.transaction_file = f"{book_file}.txn"
+        self.fsync = True
+        self._record_keys = {
+            book_file: lambda row: row['isbn'],
+            user_file: lambda row: row['user_id'],
+            checkout_file: self._checkout_key,
+        }
+        self._seen = {}
+        self._stale = set()
+        self._held_locks = threading.local()
+        self._pending = None
+        self._pending_count = 0
+        # How many transactions are open inside another one or in write-behind mode (see `check_book_available`).
+        self._joined = 0
+        self._write_behind = None
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._recover()
+
+    def enable_write_behind(self, flush_interval=1.0, max_pending=100, fsync=True):
+
+        """
+        Switch to write-behind mode, where mutations are collected in memory and written by a background thread.
+
+        Every save, put and remove is recorded as in a transaction. The background thread flushes everything
+        recorded so far in one atomic commit (see `transaction`) every `flush_interval` seconds, or as soon as
+        `max_pending` mutations have been recorded, so a burst of changes costs one write per file.
+        `flush` writes immediately, and `close` (also registered to run at interpreter exit) writes whatever
+        is left. A crash loses at most the changes of the last `flush_interval` seconds.
+
+        Args:
+        flush_interval (float, optional): The longest time in seconds a change stays in memory. Defaults to 1.0.
+        max_pending (int, optional): The number of recorded mutations that triggers an early flush. Defaults to 100.
+        fsync (bool, optional): Sync written files to disk. Turning it off is faster but a power failure
+        can lose flushed changes. Defaults to True.
+
+        Returns:
+        None
+        """
+
+        if self._write_behind is not None:
+            return
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        with self._lock:
+            if self._pending is None:
+                self._pending = self._new_pending()
+        self._wake = threading.Event()
+        self._write_behind = threading.Thread(target=self._flush_loop, name='storage-flush', daemon=True)
+        self._write_behind.start()
+        atexit.register(self.close)
+
+    def flush(self):
+
+        """
+        Write every change recorded in write-behind mode now, in one atomic commit.
+
+        Returns:
+        None
+        """
+
+        if self._write_behind is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = self._new_pending()
+                self._pending_count = 0
+            self._commit(pending)
+
+    def _flush_loop(self):
+        while self._write_behind is not None:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _stop_write_behind(self):
+
+        """
+        Stop the background thread and write what is left.
+        """
+
+        thread = self._write_behind
+        if thread is None:
+            return
+        self._write_behind = None
+        self._wake.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            pending = self._pending
+            self._pending = None
+        self._commit(pending)
+
+    def _new_pending(self):
+        return {'writes': {}, 'ops': {}, 'removes': [], 'appends': [], 'checks': []}
+
+    def _record_pending(self):
+
+        """
+        Count one recorded mutation and wake the flush thread when enough have piled up.
+        """
+
+        if self._write_behind is not None:
+            self._pending_count += 1
+            if self._pending_count >= self.max_pending:
+                self._wake.set()
+
+    @contextmanager
+    def transaction(self):
+
+        """
+        Group mutations into one unit of work that is written in a single atomic flush.
+
+        Inside the `with` block every save, put and remove is only recorded. When the block ends,
+        each changed file is written once: the new contents go to temporary files, a transaction file
+        listing the pending renames and journal appends is synced to disk, and only then are the files
+        renamed into place. A crash at any point leaves either the old data or, once the transaction
+        file exists, data that is completed on the next start. Nested transactions join the outer one.
+        If the block raises, nothing is written; objects already changed in memory are not rolled back.
+        In write-behind mode the block is kept out of any background flush and is written with the next one.
+        Other threads wait at their next storage call until the block ends, so a transaction only ever
+        contains the mutations of the thread that opened it.
+
+        Example:
+        with storage.transaction():
+            book_manager.update_book_availability(book, False)
+            storage.put_checkout(checkout, checkouts)
+        """
+
+        with self._lock:
+            if self._write_behind is not None or self._pending is not None:
+                self._joined += 1
+                try:
+                    yield
+                finally:
+                    self._joined -= 1
+                return
+            self._pending = self._new_pending()
+            try:
+                yield
+                pending = self._pending
+            finally:
+                self._pending = None
+            self._commit(pending)
+
+    def check_book_available(self, isbn):
+
+        """
+        Make sure that no other process checked out or deleted a book since the books were loaded.
+
+        In a transaction of its own the check is made when the transaction commits, under the lock on the
+        book file, so no other process can check the book out in between and a conflict writes nothing.
+        Inside another transaction or in write-behind mode, whose commit comes later, it is made right away.
+
+        Args:
+        isbn (str): The ISBN of the book that is about to be checked out.
+
+        Returns:
+        None
+
+        Raises:
+        ValueError: If the stored book is checked out or no longer exists.
+        """
+
+        with self._lock:
+            if self._pending is not None and not self._joined:
+                self._pending['checks'].append(isbn)
+                return
+            with self._file_locks([self.book_file], shared=True):
+                self._check_books_available([isbn])
 
     def load_books(self):
 
@@ -43,14 +263,28 @@ class Storage:
         This method first attempts to open and load the JSON file. If the file does not exist, an empty list is returned.
         """
         
+        self._mark_loaded(self.book_file)
         try:
-            with open(self.book_file, 'r') as file:
-                book_data = json.load(file)
-            books = [Book(**data) for data in book_data]
+            books = list(self.iter_books())
         except FileNotFoundError:
             books = []
         return books
 
+    def iter_books(self):
+
+        """
+        Yield the stored books one at a time.
+
+        Yields:
+        Book: The next stored book.
+
+        Raises:
+        FileNotFoundError: If the `book_file` does not exist.
+        """
+
+        for data in self._read_rows(self.book_file):
+            yield Book(**data)
+
     def save_books(self, books):
 
         """
@@ -62,21 +296,12 @@ class Storage:
         Returns:
         None
 
-        Raises:
-        FileNotFoundError: If the `book_file` does not exist.
-
         Note:
-        This method first checks if the `book_file` already contains data. If it does, it will print a message indicating that the book already exists.
+        The whole file is rewritten. Use `put_book` or `remove_book` when only one book has changed.
         """
         
-        book_data = [vars(book) for book in books]
-        with open(self.book_file, 'r') as file:
-         existing_data = json.load(file)
-        if existing_data in book_data:
-         print("The Book already exists")
-        else:
-         with open(self.book_file, 'w') as file:
-            json.dump(book_data, file, indent=4)
+        book_data = (book.to_dict() for book in books)
+        self._write_rows(self.book_file, book_data)
 
     def load_users(self):
 
@@ -96,14 +321,28 @@ class Storage:
         This method first attempts to open and load the JSON file. If the file does not exist, an empty list is returned.
         """
         
+        self._mark_loaded(self.user_file)
         try:
-            with open(self.user_file, 'r') as file:
-                user_data = json.load(file)
-            users = [User(**data) for data in user_data]
+            users = list(self.iter_users())
         except FileNotFoundError:
             users = []
         return users
 
+    def iter_users(self):
+
+        """
+        Yield the stored users one at a time.
+
+        Yields:
+        User: The next stored user.
+
+        Raises:
+        FileNotFoundError: If the `user_file` does not exist.
+        """
+
+        for data in self._read_rows(self.user_file):
+            yield User(**data)
+
     def save_users(self, users):
 
         """
@@ -122,46 +361,195 @@ class Storage:
         This method first checks if the `user_file` already contains data. If it does, it will print a message indicating that the user already exists.
         """
         
-        user_data = [vars(user) for user in users]
-        with open(self.user_file, 'w') as file:
-            json.dump(user_data, file, indent=4)
+        user_data = (user.to_dict() for user in users)
+        self._write_rows(self.user_file, user_data)
 
-    def load_checkouts(self):
+    def load_checkouts(self, get_book=None, get_user=None):
 
         """
         Load the checkouts data from the JSON file specified by the `checkout_file` attribute.
 
         Args:
-        None
+        get_book (callable, optional): Resolves an ISBN to the shared `Book` object, e.g. `BookManager.get_book_by_isbn`.
+        get_user (callable, optional): Resolves a user ID to the shared `User` object, e.g. `UserManager.get_user_by_id`.
 
         Returns:
         A list of `Checkout` objects loaded from the JSON file. If the file does not exist, an empty list is returned.
 
-        Raises:
-        FileNotFoundError: If the `checkout_file` does not exist.
-        json.JSONDecodeError: If the JSON data in the file is invalid.
-
         Note:
-        This method first attempts to open and load the JSON file. If the file does not exist, an empty list is returned.
+        Checkout records only store the ISBN and user ID. They are resolved through `get_book` and `get_user`;
+        when a book or user cannot be resolved a single placeholder object is built for it.
+        Files in the old format, where every record embeds a copy of the user and the book, are migrated
+        to the new format the first time they are loaded.
         """
         
+        legacy_rows = 0
+
+        def checkout_data():
+            nonlocal legacy_rows
+            for data in self._read_rows(self.checkout_file):
+                if 'user' in data:
+                    legacy_rows += 1
+                yield data
+
+        self._mark_loaded(self.checkout_file)
         try:
-            with open(self.checkout_file, 'r') as file:
-                checkout_data = json.load(file)
-            checkouts = []
-            for data in checkout_data:
-                user = User(**data['user'])
-                book = Book(**data['book'])
-                checkout_date = datetime.fromisoformat(data['checkout_date'])
-                checkin_date = data['checkin_date']
-                checkin_date = datetime.fromisoformat(checkin_date) if checkin_date else None
-                checkout = Checkout(user, book)
-                checkout.checkout_date = checkout_date
-                checkout.checkin_date = checkin_date
-                checkouts.append(checkout)
-            return checkouts
+            checkouts = list(self._resolve_checkouts(checkout_data(), get_book, get_user))
         except (FileNotFoundError, json.JSONDecodeError):
             return []
+        if legacy_rows:
+            self.save_checkouts(checkouts)
+        return checkouts
+
+    def load_checkout_table(self, get_book=None, get_user=None):
+
+        """
+        Load the checkouts into a columnar `CheckoutTable`, resolved as described in `load_checkouts`.
+
+        A binary snapshot is memory-mapped instead of parsed: its columns are copied in one block each,
+        and no `Checkout` object is built and no user or book resolved until a row is read.
+
+        Returns:
+        A `CheckoutTable`, empty if the file does not exist.
+        """
+
+        if snapshot.is_snapshot(self.checkout_file) and self._can_map(self.checkout_file):
+            self._mark_loaded(self.checkout_file)
+            try:
+                return snapshot.SnapshotCheckoutTable(snapshot.Snapshot(self.checkout_file), get_book, get_user)
+            except FileNotFoundError:
+                return CheckoutTable()
+        return CheckoutTable(self.load_checkouts(get_book, get_user))
+
+    def _can_map(self, data_file):
+
+        """
+        Return True if the snapshot `data_file` holds all of its records, so it can be mapped as it is.
+        """
+
+        return True
+
+    def archive_checkouts(self, checkouts, before):
+
+        """
+        Move the checkouts that were checked in before `before` out of the checkout file and into
+        archive segments, one per month of the checkin date.
+
+        Segments are stored next to the checkout file in the same format, e.g. `checkouts.archive/2024-01.json`
+        for `checkouts.json`. A checkin is always recorded at the current time, so once a month is over
+        its segment never changes again. The segments and the smaller checkout file are written in one
+        transaction; another process's changes to the checkout file are merged, as for `put_checkout`.
+
+        Args:
+        checkouts (list): The full list of `Checkout` objects stored in the checkout file.
+        before (datetime): Checkouts checked in before this time are archived.
+
+        Returns:
+        list: The checkouts that stay in the checkout file: open loans and recent checkins.
+        """
+
+        segments = {}
+        remaining = []
+        for checkout in checkouts:
+            if checkout.checkin_date is not None and checkout.checkin_date < before:
+                segments.setdefault(checkout.checkin_date.strftime('%Y-%m'), []).append(self._checkout_to_row(checkout))
+            else:
+                remaining.append(checkout)
+        if not segments:
+            return remaining
+
+        os.makedirs(self._archive_dir(), exist_ok=True)
+        archived = [['delete', row] for rows in segments.values() for row in rows]
+        with self.transaction():
+            for month, rows in sorted(segments.items()):
+                segment = self._archive_segment(month)
+                try:
+                    existing = list(self._read_rows(segment))
+                except FileNotFoundError:
+                    existing = []
+                # Only a repeated archive of the same records, e.g. after a crash, finds the segment already written.
+                keys = {self._checkout_key(row) for row in rows}
+                self._write_rows(segment, [row for row in existing if self._checkout_key(row) not in keys] + rows)
+            self._write_rows(self.checkout_file, (self._checkout_to_row(checkout) for checkout in remaining), archived)
+        return remaining
+
+    def archived_months(self):
+
+        """
+        Return the months that have an archive segment, oldest first, as `YYYY-MM` strings.
+        """
+
+        extension = os.path.splitext(self.checkout_file)[1]
+        try:
+            names = os.listdir(self._archive_dir())
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(extension)] for name in names if name.endswith(extension))
+
+    def iter_archived_checkouts(self, get_book=None, get_user=None, user_id=None, isbn=None):
+
+        """
+        Yield the archived checkouts, oldest segment first, resolved as described in `load_checkouts`.
+
+        Segments are read one at a time and only the records that match `user_id` and `isbn` are resolved,
+        so the archive never has to be held in memory.
+
+        Args:
+        get_book (callable, optional): Resolves an ISBN to the shared `Book` object.
+        get_user (callable, optional): Resolves a user ID to the shared `User` object.
+        user_id (str, optional): Only yield the checkouts of this user.
+        isbn (str, optional): Only yield the checkouts of this book.
+
+        Yields:
+        Checkout: The next archived checkout.
+        """
+
+        for month in self.archived_months():
+            rows = self._read_rows(self._archive_segment(month))
+            if user_id is not None:
+                rows = (row for row in rows if row['user_id'] == user_id)
+            if isbn is not None:
+                rows = (row for row in rows if row['isbn'] == isbn)
+            yield from self._resolve_checkouts(rows, get_book, get_user)
+
+    def _archive_dir(self):
+        return os.path.splitext(self.checkout_file)[0] + '.archive'
+
+    def _archive_segment(self, month):
+        return os.path.join(self._archive_dir(), month + os.path.splitext(self.checkout_file)[1])
+
+    def iter_checkouts(self, get_book=None, get_user=None):
+
+        """
+        Yield the stored checkouts one at a time, resolved as described in `load_checkouts`.
+
+        Yields:
+        Checkout: The next stored checkout.
+
+        Raises:
+        FileNotFoundError: If the `checkout_file` does not exist.
+        """
+
+        return self._resolve_checkouts(self._read_rows(self.checkout_file), get_book, get_user)
+
+    def migrate_checkouts(self):
+
+        """
+        Rewrite the checkouts file from the old format, where every record embeds a copy of the user
+        and the book, to the format that only stores the ISBN and user ID.
+
+        Returns:
+        int: The number of records that were migrated.
+        """
+
+        try:
+            checkout_data = list(self._read_rows(self.checkout_file))
+        except FileNotFoundError:
+            return 0
+        migrated = sum(1 for data in checkout_data if 'user' in data)
+        if migrated:
+            self._write_rows(self.checkout_file, (self._normalize_checkout_row(data) for data in checkout_data))
+        return migrated
 
     def save_checkouts(self, checkouts):
 
@@ -182,15 +570,698 @@ class Storage:
         This method first checks if the `checkout_file` already contains data. If it does, it will print a message indicating that the checkout already exists.
         """
         
-        checkout_data = []
-        for checkout in checkouts:
-            data = {
-                'user': vars(checkout.user),
-                'book': vars(checkout.book),
-                'checkout_date': checkout.checkout_date.isoformat(),
-                'checkin_date': checkout.checkin_date.isoformat() if checkout.checkin_date else None
-            }
-            checkout_data.append(data)
-
-        with open(self.checkout_file, 'w') as file:
-            json.dump(checkout_data, file, indent=4)
\ No newline at end of file
+        checkout_data = (self._checkout_to_row(checkout) for checkout in checkouts)
+        self._write_rows(self.checkout_file, checkout_data)
+
+    def put_book(self, book, books):
+
+        """
+        Persist a book that was added or changed.
+
+        Args:
+        book (Book): The book that was added or changed.
+        books (list): The full list of `Book` objects it belongs to.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.book_file, (book.to_dict() for book in books), [['put', book.to_dict()]])
+
+    def put_books(self, new_books, books):
+
+        """
+        Persist many books that were added or changed at once.
+
+        Args:
+        new_books (list): The books that were added or changed.
+        books (list): The full list of `Book` objects they belong to.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.book_file, (book.to_dict() for book in books), [['put', book.to_dict()] for book in new_books])
+
+    def remove_book(self, book, books):
+
+        """
+        Persist the removal of a book.
+
+        Args:
+        book (Book): The book that was removed.
+        books (list): The full list of `Book` objects after the removal.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.book_file, (book.to_dict() for book in books), [['delete', book.to_dict()]])
+
+    def put_user(self, user, users):
+
+        """
+        Persist a user that was added or changed.
+
+        Args:
+        user (User): The user that was added or changed.
+        users (list): The full list of `User` objects it belongs to.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.user_file, (user.to_dict() for user in users), [['put', user.to_dict()]])
+
+    def put_users(self, new_users, users):
+
+        """
+        Persist many users that were added or changed at once.
+
+        Args:
+        new_users (list): The users that were added or changed.
+        users (list): The full list of `User` objects they belong to.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.user_file, (user.to_dict() for user in users), [['put', user.to_dict()] for user in new_users])
+
+    def remove_user(self, user, users):
+
+        """
+        Persist the removal of a user.
+
+        Args:
+        user (User): The user that was removed.
+        users (list): The full list of `User` objects after the removal.
+
+        Returns:
+        None
+        """
+
+        self._write_rows(self.user_file, (user.to_dict() for user in users), [['delete', user.to_dict()]])
+
+    def put_checkout(self, checkout, checkouts):
+
+        """
+        Persist a checkout that was created or checked in.
+
+        Args:
+        checkout (Checkout): The checkout that was created or changed.
+        checkouts (iterable): All the `Checkout` objects it belongs to, including `checkout`.
+
+        Returns:
+        None
+        """
+
+        checkout_data = (self._checkout_to_row(checkout) for checkout in checkouts)
+        self._write_rows(self.checkout_file, checkout_data, [['put', self._checkout_to_row(checkout)]])
+
+    def stale_collections(self):
+
+        """
+        Find the collections that another process changed since they were loaded.
+
+        Returns:
+        set: Any of 'books', 'users' and 'checkouts'. Collections that were never loaded are not included.
+        """
+
+        names = {self.book_file: 'books', self.user_file: 'users', self.checkout_file: 'checkouts'}
+        return {name for data_file, name in names.items()
+                if data_file in self._seen and (data_file in self._stale or self._generation(data_file) != self._seen[data_file])}
+
+    def close(self):
+
+        """
+        Release any resources held by the storage and write any changes still held in write-behind mode.
+        Called once when the application exits.
+
+        Returns:
+        None
+        """
+
+        self._stop_write_behind()
+
+    def _read_rows(self, data_file):
+
+        """
+        Read the records stored in a JSON, JSON Lines or snapshot file.
+
+        Args:
+        data_file (str): The path to the file.
+
+        Returns:
+        An iterable of dictionaries, one per record. JSON Lines and snapshot files are read lazily, one record at a time.
+
+        Raises:
+        FileNotFoundError: If `data_file` does not exist.
+        json.JSONDecodeError: If the JSON data in the file is invalid.
+        ValueError: If a snapshot file is invalid.
+        """
+
+        if snapshot.is_snapshot(data_file):
+            return self._read_snapshot(snapshot.Snapshot(data_file))
+        if is_json_lines(data_file):
+            return self._read_json_lines(open(data_file, 'r'))
+        with open(data_file, 'r') as file:
+            return json.load(file)
+
+    def _read_json_lines(self, file):
+        with file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _read_snapshot(self, mapped):
+        with mapped:
+            yield from mapped
+
+    def _write_rows(self, data_file, rows, ops=None):
+
+        """
+        Write records to a JSON or JSON Lines file, replacing its contents.
+
+        The records are written to a temporary file that then replaces `data_file`,
+        so an interrupted write never leaves a truncated file behind.
+
+        Args:
+        data_file (str): The path to the file.
+        rows (iterable): Dictionaries, one per record. JSON Lines files are written one record at a time.
+        ops (list, optional): The `['put', row]` and `['delete', row]` changes that `rows` contains compared to
+        the loaded file. If another process changed the file, these are merged into its current contents
+        instead of writing `rows`. Without `ops`, `rows` always replaces the file.
+
+        Returns:
+        None
+        """
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending['writes'][data_file] = rows
+                if ops is None:
+                    self._pending['ops'][data_file] = None
+                elif self._pending['ops'].get(data_file, []) is not None:
+                    self._pending['ops'].setdefault(data_file, []).extend(ops)
+                self._record_pending()
+                return
+            # Committed under the lock, so threads sharing this storage never overwrite each other's files.
+            pending = self._new_pending()
+            pending['writes'][data_file] = rows
+            pending['ops'][data_file] = ops
+            self._commit(pending)
+
+    def _write_temp(self, data_file, rows):
+
+        """
+        Write records in the format of `data_file` to a temporary file next to it and sync it to disk.
+
+        Returns:
+        str: The path to the temporary file.
+        """
+
+        temp_file = f"{data_file}.{os.getpid()}-{threading.get_ident()}.tmp"
+        if snapshot.is_snapshot(data_file):
+            snapshot.write(temp_file, (self._normalize_checkout_row(row) for row in rows))
+            if self.fsync:
+                with open(temp_file, 'rb') as file:
+                    os.fsync(file.fileno())
+            return temp_file
+        with open(temp_file, 'w') as file:
+            if is_json_lines(data_file):
+                for row in rows:
+                    file.write(json.dumps(row) + '\n')
+            else:
+                json.dump(list(rows), file, indent=4)
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        return temp_file
+
+    def _append_lines(self, path, lines):
+
+        """
+        Append text to `path`, first terminating a torn last line left by an interrupted append.
+        """
+
+        with open(path, 'ab+') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell():
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+            file.write(lines.encode())
+
+    def _commit(self, pending):
+
+        """
+        Atomically apply the writes, removals and journal appends recorded by a transaction.
+
+        New file contents are written to temporary files before any lock is taken. Under the locks only
+        the generations are checked, files changed by another process are rewritten with the recorded
+        changes merged in, and the files are renamed into place. A transaction file is written first
+        when more than one step has to be applied.
+        """
+
+        renames = [[self._write_temp(data_file, rows), data_file] for data_file, rows in pending['writes'].items()]
+        steps = {'renames': renames, 'removes': pending['removes'], 'appends': pending['appends']}
+        step_count = sum(len(value) for value in steps.values())
+        if not step_count:
+            return
+
+        touched = set(pending['writes'])
+        touched.update(self._lock_target(path) for path in pending['removes'])
+        touched.update(self._lock_target(path) for path, lines in pending['appends'])
+        lock_paths = set(touched)
+        if step_count > 1:
+            lock_paths.add(self.transaction_file)
+        if pending['checks']:
+            lock_paths.add(self.book_file)
+
+        with self._file_locks(lock_paths):
+            try:
+                self._check_books_available(pending['checks'])
+            except ValueError:
+                for temp_file, data_file in renames:
+                    os.remove(temp_file)
+                raise
+            for data_file in touched:
+                # Once a file changed under us, the in-memory records are behind it until reloaded,
+                # so every later write is merged too.
+                if self._generation(data_file) == self._seen.get(data_file) and data_file not in self._stale:
+                    continue
+                ops = pending['ops'].get(data_file)
+                if data_file in pending['writes'] and ops is not None:
+                    merged = self._merge_rows(data_file, ops)
+                    for rename in renames:
+                        if rename[1] == data_file:
+                            os.remove(rename[0])
+                            rename[0] = self._write_temp(data_file, merged)
+                if ops is not None or data_file not in pending['writes']:
+                    self._stale.add(data_file)
+
+            if step_count > 1:
+                with open(self.transaction_file, 'w') as file:
+                    json.dump(steps, file)
+                    if self.fsync:
+                        file.flush()
+                        os.fsync(file.fileno())
+            self._apply(steps)
+            if step_count > 1:
+                os.remove(self.transaction_file)
+            for data_file in touched:
+                self._seen[data_file] = self._generation(data_file)
+
+    def _check_books_available(self, isbns):
+
+        """
+        Raise ValueError unless every book in `isbns` is stored as available. The caller holds a lock on the
+        book file. The loaded books are checked by the managers, so the file is only read if another process
+        changed it since.
+        """
+
+        if not isbns or (self._generation(self.book_file) == self._seen.get(self.book_file)
+                         and self.book_file not in self._stale):
+            return
+        self._stale.add(self.book_file)
+        try:
+            rows = {row['isbn']: row for row in self._read_rows(self.book_file)}
+        except FileNotFoundError:
+            rows = {}
+        for isbn in isbns:
+            if isbn not in rows:
+                raise ValueError("Book not found.")
+            if not rows[isbn].get('available', True):
+                raise ValueError("Book is not available")
+
+    def _merge_rows(self, data_file, ops):
+
+        """
+        Apply recorded changes to the current contents of `data_file`.
+        """
+
+        try:
+            rows = self._read_rows(data_file)
+        except FileNotFoundError:
+            rows = []
+        key = self._record_keys[data_file]
+        records = {key(row): row for row in rows}
+        self._apply_ops(records, ops, key)
+        return list(records.values())
+
+    def _apply_ops(self, records, ops, key):
+
+        """
+        Apply `['put', row]` and `['delete', row]` changes to records indexed by `key`.
+        """
+
+        for op, row in ops:
+            if op == 'put':
+                records[key(row)] = row
+            else:
+                records.pop(key(row), None)
+
+    def _checkout_key(self, row):
+        row = self._normalize_checkout_row(row)
+        return f"{row['user_id']}:{row['isbn']}:{row['checkout_date']}"
+
+    def _generation(self, data_file):
+
+        """
+        Return a value that changes whenever `data_file` is rewritten, or None if it does not exist.
+        """
+
+        try:
+            stat = os.stat(data_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _mark_loaded(self, data_file):
+        self._seen[data_file] = self._generation(data_file)
+        self._stale.discard(data_file)
+
+    def _lock_target(self, path):
+        return path
+
+    @contextmanager
+    def _file_locks(self, paths, shared=False):
+
+        """
+        Hold advisory `fcntl` locks on `<path>.lock` for every path, taken in sorted order so that
+        processes never deadlock. Locks this thread already holds are not taken again.
+        """
+
+        held = self._held_locks.__dict__.setdefault('paths', set())
+        files = []
+        try:
+            for path in sorted(set(paths) - held):
+                if fcntl is None:
+                    break
+                file = open(f"{path}.lock", 'a')
+                files.append((path, file))
+                fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                held.add(path)
+            yield
+        finally:
+            for path, file in files:
+                held.discard(path)
+                file.close()
+
+    def _apply(self, steps):
+
+        """
+        Apply the steps of a committed transaction. Running it twice gives the same result.
+        """
+
+        for temp_file, data_file in steps['renames']:
+            if os.path.exists(temp_file):
+                os.replace(temp_file, data_file)
+        for path in steps['removes']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        for path, lines in steps['appends']:
+            self._append_lines(path, lines)
+
+    def _recover(self):
+
+        """
+        Complete a transaction whose commit was interrupted, or drop one that never finished committing.
+        """
+
+        if not os.path.exists(self.transaction_file):
+            return
+        with self._file_locks([self.transaction_file]):
+            try:
+                with open(self.transaction_file, 'r') as file:
+                    steps = json.load(file)
+            except FileNotFoundError:
+                # Another process completed it while we waited for the lock.
+                return
+            except json.JSONDecodeError:
+                # The crash happened while the transaction file was written, so nothing was applied yet.
+                os.remove(self.transaction_file)
+                return
+            self._apply(steps)
+            os.remove(self.transaction_file)
+
+    def _checkout_to_row(self, checkout):
+
+        """
+        Convert a `Checkout` object into a JSON serializable dictionary.
+        """
+
+        return {
+            'user_id': checkout.user.user_id,
+            'isbn': checkout.book.isbn,
+            'checkout_date': checkout.checkout_date.isoformat(),
+            'checkin_date': checkout.checkin_date.isoformat() if checkout.checkin_date else None
+        }
+
+    def _checkout_from_row(self, data, user, book):
+
+        """
+        Build a `Checkout` object for `user` and `book` from a dictionary produced by `_checkout_to_row`.
+        """
+
+        checkin_date = data['checkin_date']
+        checkout = Checkout(user, book)
+        checkout.checkout_date = datetime.fromisoformat(data['checkout_date'])
+        checkout.checkin_date = datetime.fromisoformat(checkin_date) if checkin_date else None
+        return checkout
+
+    def _resolve_checkouts(self, checkout_data, get_book, get_user):
+
+        """
+        Yield `Checkout` objects built from checkout records, resolving each ISBN and user ID once.
+        """
+
+        books = {}
+        users = {}
+        for data in checkout_data:
+            data = self._normalize_checkout_row(data)
+            isbn = data['isbn']
+            user_id = data['user_id']
+            book = books.get(isbn)
+            if book is None:
+                book = (get_book and get_book(isbn)) or Book(None, None, isbn, False)
+                books[isbn] = book
+            user = users.get(user_id)
+            if user is None:
+                user = (get_user and get_user(user_id)) or User(None, user_id)
+                users[user_id] = user
+            yield self._checkout_from_row(data, user, book)
+
+    def _normalize_checkout_row(self, data):
+
+        """
+        Convert a checkout record in the old format, with embedded user and book copies, to the current format.
+        """
+
+        if 'user' not in data:
+            return data
+        return {
+            'user_id': data['user']['user_id'],
+            'isbn': data['book']['isbn'],
+            'checkout_date': data['checkout_date'],
+            'checkin_date': data['checkin_date']
+        }
+
+
+class JournaledStorage(Storage):
+
+    """
+    A `Storage` that records single mutations in append-only journal files.
+
+    Every data file gets a companion `<data_file>.journal` file. Instead of rewriting
+    the whole data file, `put_*` and `remove_*` append one JSON line to the journal.
+    Loading reads the data file (the snapshot) and replays the journal on top of it.
+    Once a journal grows past `compact_threshold` bytes it is folded back into the
+    snapshot and truncated.
+    """
+
+    def __init__(self, book_file, user_file, checkout_file, compact_threshold=1024 * 1024):
+
+        """
+        Initialize the JournaledStorage with the provided file paths.
+
+        Args:
+        book_file (str): The path to the JSON file containing the books data.
+        user_file (str): The path to the JSON file containing the users data.
+        checkout_file (str): The path to the JSON file containing the checkouts data.
+        compact_threshold (int, optional): Journal size in bytes above which the journal
+        is compacted into the snapshot. Defaults to 1 MiB.
+        """
+
+        super().__init__(book_file, user_file, checkout_file)
+        self.compact_threshold = compact_threshold
+
+    def put_book(self, book, books):
+        self._append(self.book_file, 'put', book.to_dict())
+
+    def put_books(self, new_books, books):
+        self._append_many(self.book_file, 'put', [book.to_dict() for book in new_books])
+
+    def remove_book(self, book, books):
+        self._append(self.book_file, 'delete', book.to_dict())
+
+    def put_user(self, user, users):
+        self._append(self.user_file, 'put', user.to_dict())
+
+    def put_users(self, new_users, users):
+        self._append_many(self.user_file, 'put', [user.to_dict() for user in new_users])
+
+    def remove_user(self, user, users):
+        self._append(self.user_file, 'delete', user.to_dict())
+
+    def put_checkout(self, checkout, checkouts):
+        self._append(self.checkout_file, 'put', self._checkout_to_row(checkout))
+
+    def compact(self):
+
+        """
+        Fold every journal into its snapshot and truncate the journals.
+
+        Returns:
+        None
+        """
+
+        for data_file in self._record_keys:
+            if os.path.exists(self._journal_file(data_file)):
+                self._compact(data_file)
+
+    def close(self):
+
+        """
+        Write the changes still held in write-behind mode, then compact the journals that grew past
+        `compact_threshold`. Smaller journals are kept, so a short session does not rewrite the data files.
+        """
+
+        super().close()
+        for data_file in self._record_keys:
+            self._compact_if_needed(data_file)
+
+    def _journal_file(self, data_file):
+        return data_file + '.journal'
+
+    def _lock_target(self, path):
+        if path.endswith('.journal'):
+            return path[:-len('.journal')]
+        return path
+
+    def _generation(self, data_file):
+        return (super()._generation(data_file), super()._generation(self._journal_file(data_file)))
+
+    def _can_map(self, data_file):
+        return not os.path.exists(self._journal_file(data_file))
+
+    def _read_rows(self, data_file):
+
+        """
+        Read the snapshot of `data_file` and replay its journal on top of it.
+
+        The snapshot and journal are read under a shared lock, so another process cannot compact
+        the journal in between.
+
+        Raises:
+        FileNotFoundError: If neither the snapshot nor the journal exists.
+        """
+
+        journal_file = self._journal_file(data_file)
+        if not os.path.exists(journal_file):
+            return super()._read_rows(data_file)
+        with self._file_locks([data_file], shared=True):
+            try:
+                rows = list(super()._read_rows(data_file))
+            except FileNotFoundError:
+                rows = []
+
+            key = self._record_keys[data_file]
+            records = {key(row): row for row in rows}
+            try:
+                with open(journal_file, 'r') as file:
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # A torn line from an interrupted append; the records around it are intact.
+                            continue
+                        self._apply_ops(records, [[entry['op'], entry['data']]], key)
+            except FileNotFoundError:
+                pass
+        return list(records.values())
+
+    def _write_rows(self, data_file, rows, ops=None):
+
+        """
+        Write a full snapshot of `data_file`, which makes its journal obsolete.
+        """
+
+        journal_file = self._journal_file(data_file)
+        with self._lock:
+            if self._pending is not None:
+                # The snapshot already contains every mutation recorded for this journal so far.
+                self._pending['appends'] = [append for append in self._pending['appends'] if append[0] != journal_file]
+                super()._write_rows(data_file, rows, ops)
+                self._pending['removes'].append(journal_file)
+                return
+            pending = self._new_pending()
+            pending['writes'][data_file] = rows
+            pending['ops'][data_file] = ops
+            pending['removes'].append(journal_file)
+            self._commit(pending)
+
+    def _append(self, data_file, op, data):
+
+        """
+        Append one mutation to the journal of `data_file`, compacting it if it grew too large.
+        """
+
+        self._append_many(data_file, op, [data])
+
+    def _append_many(self, data_file, op, records):
+
+        """
+        Append one mutation per record to the journal of `data_file` in a single write.
+        """
+
+        journal_file = self._journal_file(data_file)
+        lines = ''.join(json.dumps({'op': op, 'data': data}) + '\n' for data in records)
+        with self._lock:
+            if self._pending is not None:
+                self._pending['appends'].append([journal_file, lines])
+                self._record_pending()
+                return
+            pending = self._new_pending()
+            pending['appends'].append([journal_file, lines])
+            self._commit(pending)
+
+    def _commit(self, pending):
+        super()._commit(pending)
+        for data_file in self._record_keys:
+            self._compact_if_needed(data_file)
+
+    def _compact_if_needed(self, data_file):
+        journal_file = self._journal_file(data_file)
+        if os.path.exists(journal_file) and os.path.getsize(journal_file) > self.compact_threshold:
+            self._compact(data_file)
+
+    def _compact(self, data_file):
+
+        """
+        Fold the journal of `data_file` into its snapshot right away, even inside a transaction or in
+        write-behind mode. Mutations still held in memory are appended to the new, empty journal later.
+        """
+
+        with self._lock, self._file_locks([data_file]):
+            in_sync = self._generation(data_file) == self._seen.get(data_file)
+            os.replace(self._write_temp(data_file, self._read_rows(data_file)), data_file)
+            try:
+                os.remove(self._journal_file(data_file))
+            except FileNotFoundError:
+                pass
+            if in_sync:
+                self._seen[data_file] = self._generation(data_file)
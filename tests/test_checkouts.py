@@ -0,0 +1,88 @@
+# tests/test_checkouts.py
+"""
+Checks that checkouts committed by one thread are never dropped from the data files by another's commit,
+and that a checkout the storage rejects leaves nothing behind in memory.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks import dataset
+from book import BookManager
+from check import CheckoutManager
+from storage import Storage
+from user import UserManager
+
+class SlowStorage(Storage):
+
+    """
+    A `Storage` that pauses after every transaction, which widens the window between committing a checkout
+    and listing it in memory.
+    """
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with super().transaction():
+            yield
+        time.sleep(0.01)
+
+def open_library(directory, storage_class=Storage):
+    storage = storage_class(*(os.path.join(directory, f"{name}.json") for name in ('books', 'users', 'checkouts')))
+    storage.fsync = False
+    book_manager = BookManager(storage)
+    user_manager = UserManager(storage)
+    return storage, book_manager, CheckoutManager(storage, book_manager, user_manager), user_manager
+
+class CheckoutTest(unittest.TestCase):
+
+    def setUp(self):
+        books, users, checkouts = dataset.generate(200, checkouts=0, seed=7)
+        for book in books:
+            book.available = True
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        dataset.write(self.directory.name, books, users, checkouts)
+
+    def test_concurrent_checkouts_are_all_stored(self):
+        storage, book_manager, manager, user_manager = open_library(self.directory.name, SlowStorage)
+        books = book_manager.list_books()[:40]
+        users = user_manager.list_users()
+
+        def check_out(offset):
+            for book in books[offset::4]:
+                manager.checkout_book(users[offset], book)
+
+        threads = [threading.Thread(target=check_out, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stored = storage.load_checkouts()
+        self.assertEqual(sorted(checkout.book.isbn for checkout in stored), sorted(book.isbn for book in books))
+        self.assertEqual(len(manager.list_checkouts()), len(books))
+
+    def test_rejected_checkout_leaves_the_book_available(self):
+        _, first_books, first, first_users = open_library(self.directory.name)
+        _, second_books, second, second_users = open_library(self.directory.name)
+        isbn = first_books.list_books()[0].isbn
+        with contextlib.redirect_stdout(io.StringIO()):
+            second.checkout_book(second_users.list_users()[0], second_books.get_book_by_isbn(isbn))
+
+        book = first_books.get_book_by_isbn(isbn)
+        self.assertTrue(book.available)
+        self.assertIn(book, first_books.search_books(isbn=isbn))
+        with self.assertRaises(ValueError):
+            first.checkout_book(first_users.list_users()[0], book)
+        # Only the other session's checkout is behind the book being out; this session knows nothing of it yet.
+        self.assertTrue(book.available)
+        self.assertIn(book, first_books.search_books(isbn=isbn))
+        self.assertEqual(first.list_checkouts(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# tests/test_concurrency.py
+"""
+Stress test for the thread-safe managers on each storage: threads check books out and in while another
+searches, and finally each keeps one book checked out. The managers in memory and a fresh load from disk
+must then hold the same checkouts, with every book available exactly when it has no open checkout.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from benchmarks.concurrency import violations, worker
+from book import BookManager
+from check import CheckoutManager
+from models import Book, User
+from sqlite_storage import SQLiteStorage
+from storage import JournaledStorage, Storage
+from user import UserManager
+
+def json_storage(data_dir, storage_class=Storage):
+    storage = storage_class(*(os.path.join(data_dir, name) for name in ('books.json', 'users.json', 'checkouts.json')))
+    storage.fsync = False
+    return storage
+
+def pause_after_transactions(storage):
+
+    """
+    Makes every transaction of `storage` pause after it ends, which widens the window between a commit
+    and the change showing in memory, where a race between two threads would lose data.
+    """
+
+    transaction = storage.transaction
+
+    @contextlib.contextmanager
+    def paused():
+        with transaction():
+            yield
+        time.sleep(0.002)
+
+    storage.transaction = paused
+    return storage
+
+def open_managers(storage):
+    book_manager = BookManager(storage)
+    user_manager = UserManager(storage)
+    return book_manager, CheckoutManager(storage, book_manager, user_manager), user_manager
+
+def reader(book_manager, checkout_manager, users, stop):
+    while not stop.is_set():
+        book_manager.search_books(title='e')
+        book_manager.list_books()
+        checkout_manager.get_current_checkouts(users[0])
+        # Without a pause the reader holds the GIL most of the time and the test takes many times longer.
+        time.sleep(0.001)
+
+def borrower(checkout_manager, books, users, operations, ledger, ledger_lock, counts, errors, start_keeping, keep):
+    worker(checkout_manager, books, users, operations, ledger, ledger_lock, counts, errors)
+    # All threads check out their last book at once, so no later commit can repair a checkout row a commit lost.
+    start_keeping.wait()
+    checkout_manager.checkout_book(users[keep], books[keep])
+    with ledger_lock:
+        counts['checkouts'] += 1
+
+def rows(checkout_manager):
+    return sorted((checkout.user.user_id, checkout.book.isbn, checkout.checkout_date, checkout.checkin_date)
+                  for checkout in checkout_manager.list_checkouts())
+
+class ConcurrencyTest(unittest.TestCase):
+
+    THREADS = 6
+    READERS = 1
+    OPERATIONS = 20
+
+    def stress(self, open_storage):
+        with tempfile.TemporaryDirectory() as data_dir:
+            storage = pause_after_transactions(open_storage(data_dir))
+            book_manager, checkout_manager, user_manager = open_managers(storage)
+            with contextlib.redirect_stdout(io.StringIO()):
+                book_manager.add_books(Book(f"Title {index}", f"Author {index % 3}", f"isbn-{index}", True)
+                                       for index in range(10))
+                user_manager.add_users(User(f"User {index}", f"user-{index}") for index in range(20))
+            books = book_manager.list_books()
+            users = user_manager.list_users()
+
+            ledger = {}
+            ledger_lock = threading.Lock()
+            errors = []
+            counts = {'checkouts': 0, 'rejected': 0}
+            stop = threading.Event()
+            start_keeping = threading.Barrier(self.THREADS)
+            readers = [threading.Thread(target=reader, args=(book_manager, checkout_manager, users, stop))
+                       for _ in range(self.READERS)]
+            workers = [threading.Thread(target=borrower, args=(checkout_manager, books, users, self.OPERATIONS,
+                                                               ledger, ledger_lock, counts, errors, start_keeping, keep))
+                       for keep in range(self.THREADS)]
+            for thread in readers + workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            stop.set()
+            for thread in readers:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(violations(book_manager, checkout_manager), [])
+            in_memory = rows(checkout_manager)
+            self.assertEqual(len(in_memory), counts['checkouts'])
+            self.assertEqual(sum(not book.available for book in books), self.THREADS)
+            storage.close()
+
+            storage = open_storage(data_dir)
+            book_manager, checkout_manager, _ = open_managers(storage)
+            self.assertEqual(rows(checkout_manager), in_memory)
+            self.assertEqual(violations(book_manager, checkout_manager), [])
+            storage.close()
+
+    def test_storage(self):
+        self.stress(json_storage)
+
+    def test_journaled_storage(self):
+        self.stress(lambda data_dir: json_storage(data_dir, JournaledStorage))
+
+    def test_sqlite_storage(self):
+        self.stress(lambda data_dir: SQLiteStorage(os.path.join(data_dir, 'library.db')))
+
+if __name__ == '__main__':
+    unittest.main()
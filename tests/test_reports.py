@@ -0,0 +1,67 @@
+# tests/test_reports.py
+"""
+Checks that circulation reports over a mapped checkouts snapshot count every user and book once,
+also after checkouts were appended to it.
+"""
+
+import collections
+import contextlib
+import io
+import tempfile
+import unittest
+
+from benchmarks import dataset
+from book import BookManager
+from check import CheckoutManager
+from checkout_table import CheckoutTable
+from reports import CirculationReport
+from snapshot import SnapshotCheckoutTable
+from user import UserManager
+
+class SnapshotReportTest(unittest.TestCase):
+
+    def setUp(self):
+        books, users, checkouts = dataset.generate(500, checkouts=2000, seed=5)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        storage = dataset.write(self.directory.name, books, users, checkouts, extension='snap')
+        self.book_manager = BookManager(storage)
+        self.user_manager = UserManager(storage)
+        self.manager = CheckoutManager(storage, self.book_manager, self.user_manager, columnar=True)
+        self.assertIsInstance(self.manager.checkouts, SnapshotCheckoutTable)
+
+    def circulate(self):
+
+        """
+        Checks available books out to users that the snapshot already has checkouts of, and some of them in again.
+        """
+
+        table = self.manager.checkouts
+        users = [table[row].user for row in range(0, len(table), 97)]
+        books = [book for book in self.book_manager.list_books() if book.available][:len(users)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for user, book in zip(users, books):
+                self.manager.checkout_book(user, book)
+            for user, book in list(zip(users, books))[::2]:
+                self.manager.checkin_book(user, book)
+        return len(users)
+
+    def test_appended_checkouts_share_slots(self):
+        before = len(self.manager.checkouts)
+        appended = self.circulate()
+        report = self.manager.circulation_report()
+        self.assertEqual(len(report), before + appended)
+
+        expected = CirculationReport.from_table(CheckoutTable(self.manager.list_checkouts()), report.now)
+        self.assertEqual(report.summary(), expected.summary())
+        by_user = [(user.user_id, count) for user, count in report.circulation_by_user()]
+        by_book = [(book.isbn, count) for book, count in report.circulation_by_book()]
+        self.assertEqual(len(by_user), len({user_id for user_id, _ in by_user}))
+        self.assertEqual(len(by_book), len({isbn for isbn, _ in by_book}))
+        self.assertEqual(collections.Counter(dict(by_user)),
+                         collections.Counter(dict((user.user_id, count) for user, count in expected.circulation_by_user())))
+        self.assertEqual(collections.Counter(dict(by_book)),
+                         collections.Counter(dict((book.isbn, count) for book, count in expected.circulation_by_book())))
+
+if __name__ == '__main__':
+    unittest.main()
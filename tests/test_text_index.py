@@ -0,0 +1,90 @@
+# tests/test_text_index.py
+"""
+Checks that the n-gram index answers title and author searches exactly like the linear scan it replaced.
+"""
+
+import random
+import tempfile
+import unittest
+
+from benchmarks import dataset
+from book import BookManager
+from models import Book
+from text_index import NGramIndex
+
+def scan(books, title=None, author=None, isbn=None):
+
+    """
+    The search before the index: a case-insensitive substring scan over every book, with the
+    availability filter applied to all criteria.
+    """
+
+    return [book for book in books
+            if book.available and ((title and title.lower() in book.title.lower())
+                                   or (author and author.lower() in book.author.lower())
+                                   or (isbn and isbn == book.isbn))]
+
+def mixed_case(rng, text):
+    return ''.join(char.upper() if rng.random() < 0.5 else char.lower() for char in text)
+
+class NGramIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(3)
+        books, users, checkouts = dataset.generate(3000, seed=3)
+        for book in rng.sample(books, 300):
+            book.title = mixed_case(rng, book.title)
+        books += [Book('Über Straße', 'Émile Zola', 'U1', True), Book('İstanbul Nights', 'ÇELİK', 'U2', True),
+                  Book('a', 'B', 'U3', True), Book('', '', 'U4', True)]
+        cls.books = books
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.storage = dataset.write(cls.directory.name, books, users, checkouts)
+        cls.manager = BookManager(cls.storage)
+
+        texts = [book.title for book in books] + [book.author for book in books]
+        queries = ['', 'zzzz', 'q', 'straße', 'STRASSE', 'i̇st', 'çel', 'ü']
+        for _ in range(400):
+            text = rng.choice(texts)
+            if not text:
+                continue
+            # Short queries (up to n characters) are answered from one posting, longer ones by intersection.
+            length = rng.choice([1, 2, 3, 4, 6, 10, len(text)])
+            start = rng.randrange(max(len(text) - length, 0) + 1)
+            queries.append(mixed_case(rng, text[start:start + length]))
+        cls.queries = queries
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_index_matches_substring_scan(self):
+        index = NGramIndex()
+        for book in self.books:
+            index.add(book.isbn, book.title)
+        for query in self.queries:
+            expected = {book.isbn for book in self.books if query.lower() in book.title.lower()}
+            self.assertEqual(index.search(query), expected, query)
+
+    def test_search_books_matches_scan(self):
+        loaded = self.storage.load_books()
+        rng = random.Random(4)
+        for query in self.queries:
+            other = rng.choice(self.queries)
+            for title, author in ((query, None), (None, query), (query, other)):
+                expected = [book.isbn for book in scan(loaded, title, author)]
+                found = [book.isbn for book in self.manager.search_books(title, author)]
+                self.assertEqual(found, expected, (title, author))
+
+    def test_index_follows_changes(self):
+        index = NGramIndex()
+        index.add('1', 'Dune')
+        index.add('2', 'Dune Messiah')
+        index.add('1', 'Children of Dune')
+        index.remove('2')
+        self.assertEqual(index.search('dune'), {'1'})
+        self.assertEqual(index.search('messiah'), set())
+        self.assertEqual(index.search('CHILD'), {'1'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+# text_index.py
+import collections
+import heapq
+import itertools
+import re
+import unicodedata
+
+class NGramIndex:
+
+    """
+    An inverted index that answers case-insensitive substring queries.
+
+    Every indexed text is lowercased and split into all of its n-grams of length 1 up to `n`.
+    Each n-gram maps to the set of keys whose text contains it. A query no longer than `n`
+    is answered by a single posting lookup; a longer query intersects the postings of its
+    n-grams and verifies the few remaining candidates with a substring test.
+
+    Attributes:
+        n (int): The longest n-gram length that is indexed.
+    """
+
+    def __init__(self, n=3):
+
+        """
+        Initializes an empty index.
+
+        Args:
+            n (int, optional): The longest n-gram length to index. Defaults to 3.
+        """
+
+        self.n = n
+        self._postings = {}
+        self._texts = {}
+
+    def add(self, key, text):
+
+        """
+        Indexes `text` under `key`, replacing any text previously indexed under that key.
+
+        Args:
+            key (str): The key returned by `search` when `text` matches.
+            text (str): The text to index.
+        """
+
+        if key in self._texts:
+            self.remove(key)
+        text = self.normalize(text)
+        self._texts[key] = text
+        for gram in self._grams(text):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+
+        """
+        Removes the text indexed under `key`. Unknown keys are ignored.
+
+        Args:
+            key (str): The key to remove.
+        """
+
+        text = self._texts.pop(key, None)
+        if text is None:
+            return
+        for gram in self._grams(text):
+            posting = self._postings[gram]
+            posting.discard(key)
+            if not posting:
+                del self._postings[gram]
+
+    def search(self, query):
+
+        """
+        Finds every key whose text contains `query`, ignoring case.
+
+        Args:
+            query (str): The substring to look for.
+
+        Returns:
+            set: The matching keys.
+        """
+
+        query = self.normalize(query)
+        if not query:
+            return set(self._texts)
+        if len(query) <= self.n:
+            return set(self._postings.get(query, ()))
+
+        postings = []
+        for gram in {query[i:i + self.n] for i in range(len(query) - self.n + 1)}:
+            posting = self._postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return {key for key in candidates if query in self._texts[key]}
+
+    @staticmethod
+    def normalize(text):
+        return text.lower()
+
+    def _grams(self, text):
+        grams = set()
+        for size in range(1, self.n + 1):
+            for i in range(len(text) - size + 1):
+                grams.add(text[i:i + size])
+        return grams
+
+class FuzzyIndex:
+
+    """
+    An index that ranks texts by how similar their words are to the words of a query, so misspelled
+    queries still find what was meant ("tagor" finds "Tagore", "geethanjli" finds "Gitanjali").
+
+    Texts are normalized (lowercased, accents removed) and split into words. Each distinct word is
+    indexed once, under its trigrams, and maps to the keys whose text contains it. A query word is
+    compared with the words that share trigrams with it, using the Dice coefficient of the trigram sets
+    (1.0 for the same word). A key scores the mean, over the query words, of the best similarity of any
+    of its words, so it is between 0 and 1.
+
+    The work per query is bounded, whatever the number of texts. Every query word is compared with at
+    most `max_candidates` similar words. Candidate keys are then collected, first those containing the
+    most similar words of several query words, then from the most similar words of every query word in
+    turn until `max_visits` keys are found, skipping words too common to fit. Each candidate key is
+    scored from its own words.
+
+    Attributes:
+        max_candidates (int): The most similar words considered per query word.
+        max_visits (int): The most keys scored per query.
+    """
+
+    def __init__(self, max_candidates=30, max_visits=4000):
+
+        """
+        Initializes an empty index.
+
+        Args:
+            max_candidates (int, optional): The most similar words considered per query word. Defaults to 30.
+            max_visits (int, optional): The most keys scored per query. Defaults to 4000.
+        """
+
+        self.max_candidates = max_candidates
+        self.max_visits = max_visits
+        self._keys = {}
+        self._postings = {}
+        self._grams = {}
+        self._gram_counts = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, text):
+
+        """
+        Indexes `text` under `key`, replacing any text previously indexed under that key.
+        """
+
+        if key in self._keys:
+            self.remove(key)
+        words = self.words(text)
+        self._keys[key] = words
+        for word in words:
+            keys = self._postings.get(word)
+            if keys is None:
+                keys = self._postings[word] = set()
+                grams = self._trigrams(word)
+                self._gram_counts[word] = len(grams)
+                for gram in grams:
+                    self._grams.setdefault(gram, set()).add(word)
+            keys.add(key)
+
+    def remove(self, key):
+
+        """
+        Removes the text indexed under `key`. Unknown keys are ignored.
+        """
+
+        for word in self._keys.pop(key, ()):
+            keys = self._postings[word]
+            keys.discard(key)
+            if not keys:
+                del self._postings[word]
+                del self._gram_counts[word]
+                for gram in self._trigrams(word):
+                    words = self._grams[gram]
+                    words.discard(word)
+                    if not words:
+                        del self._grams[gram]
+
+    def similar_words(self, word, min_similarity=0.25):
+
+        """
+        Returns up to `max_candidates` indexed words whose similarity to `word` is at least `min_similarity`.
+
+        Returns:
+            list: `(similarity, word)` pairs, the most similar first.
+        """
+
+        grams = self._trigrams(word)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        # Dice similarity: twice the shared trigrams over the trigrams of both words.
+        candidates = ((2 * count / (len(grams) + self._gram_counts[candidate]), candidate)
+                      for candidate, count in shared.items())
+        return heapq.nlargest(self.max_candidates,
+                              (candidate for candidate in candidates if candidate[0] >= min_similarity))
+
+    def search(self, query, limit=10, min_similarity=0.25, order=None):
+
+        """
+        Finds the keys whose text is most similar to `query`.
+
+        Args:
+            query (str): The text to look for. Word order does not matter.
+            limit (int, optional): The maximum number of results. Defaults to 10.
+            min_similarity (float, optional): Words less similar than this to a query word do not count. Defaults to 0.25.
+            order (callable, optional): Returns a number for a key; keys with equal scores are ranked by it,
+                lowest first. Defaults to None, which leaves ties in no particular order.
+
+        Returns:
+            list: `(key, score)` pairs, the best match first.
+        """
+
+        words = self.words(query)
+        if not words:
+            return []
+        candidates = [self.similar_words(word, min_similarity) for word in words]
+        # Keys with the best candidates of several query words go first: scan the rarest of those words.
+        found = set()
+        best = sorted((self._postings[word_candidates[0][1]] for word_candidates in candidates if word_candidates), key=len)
+        if len(best) > 1 and len(best[0]) <= self.max_visits:
+            found.update(key for key in best[0] if any(key in keys for keys in best[1:]))
+        # Then keys from the best candidate of every query word, then the second best, and so on.
+        for rank_candidates in itertools.zip_longest(*candidates):
+            for candidate in rank_candidates:
+                if candidate is not None and len(found) + len(self._postings[candidate[1]]) <= self.max_visits:
+                    found.update(self._postings[candidate[1]])
+        if not found:
+            # Every similar word is too common: take a bounded sample of the keys of the most similar one.
+            similarity, word = max(itertools.chain(*candidates), default=(0, None))
+            if word is None:
+                return []
+            found = set(itertools.islice(self._postings[word], self.max_visits))
+        similarities = {}
+        for position, word_candidates in enumerate(candidates):
+            for similarity, word in word_candidates:
+                similarities.setdefault(word, []).append((position, similarity))
+        totals = {}
+        for key in found:
+            best = [0] * len(words)
+            for word in self._keys[key]:
+                for position, similarity in similarities.get(word, ()):
+                    if similarity > best[position]:
+                        best[position] = similarity
+            totals[key] = sum(best)
+        if order is None:
+            rank = lambda item: item[1]
+        else:
+            rank = lambda item: (item[1], -order(item[0]))
+        return [(key, total / len(words)) for key, total in heapq.nlargest(limit, totals.items(), key=rank)]
+
+    @staticmethod
+    def words(text):
+
+        """
+        Returns the distinct normalized words of `text`, in order.
+        """
+
+        text = unicodedata.normalize('NFKD', (text or '').lower())
+        text = ''.join(character for character in text if not unicodedata.combining(character))
+        return tuple(dict.fromkeys(re.findall(r'\w+', text)))
+
+    @staticmethod
+    def _trigrams(word):
+        padded = f"  {word} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
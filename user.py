@@ -1,16 +1,33 @@
 # user.py
+import bisect
+import threading
+import paging
+from catalog import LRUCache
+from locks import ReadWriteLock
 from models import User
 from storage import Storage
 
 class UserManager:
-    def __init__(self, storage):
+
+    # The orders `page_users` can sort by, besides 'catalog', the order in which the users were added.
+    SORT_KEYS = {
+        'name': lambda user: (user.name or '').lower(),
+        'user_id': lambda user: user.user_id,
+    }
+
+    def __init__(self, storage, search_cache_size=1024):
 
         """
         Initialize the UserManager with a storage object.
-        Loads the users from the storage and sets it as an attribute.
+        Loads the users from the storage and sets it as an attribute,
+        and indexes them by user ID for constant-time lookups.
+        The manager can be shared between threads: searches and listings hold a read lock, and changes hold the
+        write lock only while they change the users in memory, saving them to the storage after releasing it.
+        Changes are also serialized with each other, so the storage sees them in the order they were made.
 
         Args:
         storage (Storage): An instance of the Storage class that handles user data.
+        search_cache_size (int, optional): The number of distinct searches whose results are cached. Defaults to 1024.
 
         Returns:
         None
@@ -18,6 +35,13 @@ class UserManager:
         
         self.storage = storage
         self.users = self.storage.load_users()
+        self._users_by_id = {user.user_id: user for user in self.users}
+        self._sequence = {user.user_id: sequence for sequence, user in enumerate(self.users)}
+        self._next_sequence = len(self.users)
+        self._sorted = {}
+        self.search_cache = LRUCache(search_cache_size)
+        self._lock = ReadWriteLock()
+        self._change_lock = threading.Lock()
 
     def add_user(self, user):
 
@@ -37,13 +61,55 @@ class UserManager:
         If so, it raises a ValueError with an appropriate message. Otherwise, it appends the new user to the list of users and saves the updated list to the storage.
         """
         
-        existing_user = self.get_user_by_id(user.user_id)
-        if existing_user:
-            return ValueError("The user id already exists, Try with different id")
-        else:
-            self.users.append(user)
-            self.storage.save_users(self.users)
-            return print("User added successfully")
+        with self._change_lock:
+            with self._lock.write():
+                existing_user = self.get_user_by_id(user.user_id)
+                if existing_user:
+                    return ValueError("The user id already exists, Try with different id")
+                self.users.append(user)
+                self._index_user(user)
+                self._invalidate_searches(user)
+            self.storage.put_user(user, self.users)
+        return print("User added successfully")
+
+    def add_users(self, users, skip_duplicates=False):
+
+        """
+        Add many new users at once and save them to the storage in a single write.
+
+        Args:
+        users (iterable): User objects to add.
+        skip_duplicates (bool, optional): Skip users whose ID already exists instead of raising. Defaults to False.
+
+        Returns:
+        int: The number of users that were added.
+
+        Raises:
+        ValueError: If a user ID already exists or appears twice in `users` and `skip_duplicates` is False.
+        In that case no user is added.
+        """
+
+        with self._change_lock:
+            new_users = []
+            seen = set()
+            duplicates = []
+            for user in users:
+                if user.user_id in self._users_by_id or user.user_id in seen:
+                    duplicates.append(user.user_id)
+                else:
+                    seen.add(user.user_id)
+                    new_users.append(user)
+            if duplicates and not skip_duplicates:
+                raise ValueError(f"The user ids already exist: {', '.join(duplicates)}")
+
+            if new_users:
+                with self._lock.write():
+                    for user in new_users:
+                        self.users.append(user)
+                        self._index_user(user)
+                    self.search_cache.clear()
+                self.storage.put_users(new_users, self.users)
+        return len(new_users)
 
     def update_user(self, user_id, name=None):
 
@@ -62,11 +128,18 @@ class UserManager:
         Finally, it saves the updated list of users to the storage.
         """
         
-        user = self.get_user_by_id(user_id)
-        if user:
-            if name:
-                user.name = name
-            self.storage.save_users(self.users)
+        with self._change_lock:
+            user = self.get_user_by_id(user_id)
+            if user:
+                if name:
+                    with self._lock.write():
+                        self._invalidate_searches(user)
+                        user.name = name
+                        self._invalidate_searches(user)
+                        for sort, index in self._sorted.items():
+                            index.remove(user_id)
+                            index.add(user_id, self.SORT_KEYS[sort](user), self._sequence[user_id])
+                self.storage.put_user(user, self.users)
 
     def delete_user(self, user_id):
 
@@ -83,19 +156,71 @@ class UserManager:
         If so, it removes the user from the list of users and saves the updated list to the storage.
         """
 
-        user = self.get_user_by_id(user_id)
-        if user:
-            self.users.remove(user)
-            self.storage.save_users(self.users)
+        with self._change_lock:
+            user = self.get_user_by_id(user_id)
+            if user:
+                with self._lock.write():
+                    self.users.remove(user)
+                    self._unindex_user(user)
+                    self._invalidate_searches(user)
+                self.storage.remove_user(user, self.users)
 
     def list_users(self):
         """
         List all users in the UserManager.
 
         Returns:
-        list: A list of all users in the UserManager.
+        list: A list of all users in the UserManager. It is a copy, so it does not change while the caller uses it.
+        """
+        with self._lock.read():
+            return list(self.users)
+
+    def page_users(self, cursor=None, limit=20, sort='catalog', name=None):
+
+        """
+        Get one page of the users.
+
+        Args:
+        cursor (str, optional): The `next_cursor` of the previous page. Defaults to None, for the first page.
+        limit (int, optional): The maximum number of users on the page. Defaults to 20.
+        sort (str, optional): 'catalog' (the order the users were added), 'name' (ignoring case) or 'user_id'.
+        Defaults to 'catalog'.
+        name (str, optional): Only list users whose name contains it, ignoring case. Defaults to None, for all.
+
+        Returns:
+        Page: The users on the page and the cursor of the next page, which is None on the last page.
+
+        Raises:
+        ValueError: If the sort order or the cursor is invalid.
+        """
+
+        if sort != 'catalog' and sort not in self.SORT_KEYS:
+            raise ValueError(f"Cannot sort users by {sort}")
+        position = paging.decode_cursor(cursor, sort)
+        predicate = None if not name else (lambda user: name.lower() in user.name.lower())
+        if sort != 'catalog' and sort not in self._sorted:
+            with self._lock.write():
+                if sort not in self._sorted:
+                    self._sorted[sort] = paging.SortedIndex.from_records(
+                        (user.user_id, self.SORT_KEYS[sort](user), self._sequence[user.user_id]) for user in self.users)
+        with self._lock.read():
+            if sort == 'catalog':
+                # The users are kept in the order of their sequence numbers.
+                start = 0 if position is None else bisect.bisect_left(
+                    self.users, position[0] + 1, key=lambda user: self._sequence[user.user_id])
+                candidates = (((self._sequence[self.users[row].user_id],), self.users[row])
+                              for row in range(start, len(self.users)))
+            else:
+                candidates = ((key, self._users_by_id[user_id]) for key, user_id in self._sorted[sort].after(position))
+            return paging.page(candidates, limit, sort, predicate)
+
+    def iter_users(self, sort='catalog', name=None, page_size=1000):
+
+        """
+        Yield the users in the order and with the filter of `page_users`, fetching them a page at a time.
         """
-        return self.users
+
+        return paging.iterate(lambda cursor, limit: self.page_users(cursor, limit, sort, name), page_size)
 
     def search_users(self, name=None, user_id=None):
 
@@ -110,14 +235,21 @@ class UserManager:
         list: A list of users that match the search criteria.
 
         This method iterates through all users in the UserManager and checks if the provided name or user ID matches any user in the list. If a match is found, the user is added to the results list. Finally, the method returns the list of matching users.
+        The results of recent searches are kept in `search_cache`, keyed on the lowercased name and the user ID,
+        and adding, updating or deleting a user drops the cached searches it matches.
         """
 
-        results = []
-        for user in self.users:
-            if (name and name.lower() in user.name.lower()) or \
-               (user_id and user_id == user.user_id):
-                results.append(user)
-        return results
+        key = (name.lower() if name else None, user_id or None)
+        with self._lock.read():
+            results = self.search_cache.get(key)
+            if results is None:
+                results = []
+                for user in self.users:
+                    if (name and name.lower() in user.name.lower()) or \
+                       (user_id and user_id == user.user_id):
+                        results.append(user)
+                self.search_cache.put(key, results)
+        return list(results)
 
     def get_user_by_id(self, user_id):
 
@@ -130,10 +262,29 @@ class UserManager:
         Returns:
         User: The user object with the matching user ID, or None if no match is found.
 
-        This method iterates through all users in the UserManager and checks if the provided user ID matches any user in the list. If a match is found, the user object is returned. If no match is found, None is returned.
+        The lookup is served from the user ID index, so it takes constant time regardless of the number of users.
         """
         
-        for user in self.users:
-            if user.user_id == user_id:
-                return user
-        return None
\ No newline at end of file
+        return self._users_by_id.get(user_id)
+
+    def _index_user(self, user):
+        self._users_by_id[user.user_id] = user
+        self._sequence[user.user_id] = self._next_sequence
+        self._next_sequence += 1
+        for sort, index in self._sorted.items():
+            index.add(user.user_id, self.SORT_KEYS[sort](user), self._sequence[user.user_id])
+
+    def _invalidate_searches(self, user):
+
+        """
+        Drops the cached searches whose criteria match `user`. The caller holds the write lock.
+        """
+
+        name = user.name.lower()
+        self.search_cache.discard_where(lambda key: (key[0] is not None and key[0] in name) or key[1] == user.user_id)
+
+    def _unindex_user(self, user):
+        del self._users_by_id[user.user_id]
+        del self._sequence[user.user_id]
+        for index in self._sorted.values():
+            index.remove(user.user_id)